@@ -0,0 +1,100 @@
+import os
+import shutil
+import sys
+import tempfile
+from fractions import Fraction
+
+import pytest
+
+# The comparison uses the remux packaging path, configure it before importing the worker
+os.environ.setdefault("HLS_PACKAGING", "remux")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+if shutil.which("ffmpeg") is None:
+    pytest.skip("ffmpeg is not installed", allow_module_level=True)
+
+ffmpeg = pytest.importorskip("ffmpeg")
+worker = pytest.importorskip("worker")
+
+RENDITIONS = ["240p", "360p", "720p"]
+DURATION_TOLERANCE = 0.1  # seconds
+
+
+def create_source(path, duration, rate="30"):
+    """Generate a synthetic 720p source with audio using ffmpeg lavfi."""
+    video = ffmpeg.input(f"testsrc2=size=1280x720:rate={rate}:duration={duration}", format="lavfi")
+    audio = ffmpeg.input(f"sine=frequency=440:sample_rate=48000:duration={duration}", format="lavfi")
+    (
+        ffmpeg.output(video, audio, path, vcodec="libx264", pix_fmt="yuv420p", acodec="aac")
+        .overwrite_output()
+        .run(quiet=True)
+    )
+
+
+def describe_output(mp4_file, hls_dir, label):
+    """Return (mp4 duration, segment count) for a rendition."""
+    duration = float(ffmpeg.probe(mp4_file)["format"]["duration"])
+    with open(os.path.join(hls_dir, f"{label}.m3u8")) as f:
+        segments = sum(1 for line in f if line.startswith("#EXTINF"))
+    return duration, segments
+
+
+def compare_chunked_with_sequential(duration, chunk_duration, rate="30"):
+    """
+    1. Encode a synthetic source sequentially and with chunked encoding
+    2. Package both as HLS by remux
+    3. Return (label, sequential, chunked) with the (duration, segment count) of every rendition
+    """
+    renditions = {k: v for k, v in worker.ALL_RENDITIONS.items() if k in RENDITIONS}
+
+    with tempfile.TemporaryDirectory() as tmp_root:
+        src = os.path.join(tmp_root, "source.mp4")
+        create_source(src, duration, rate)
+        info = worker.get_video_info(src)
+
+        sequential_dir = os.path.join(tmp_root, "sequential")
+        chunked_dir = os.path.join(tmp_root, "chunked")
+        os.makedirs(sequential_dir)
+        os.makedirs(chunked_dir)
+
+        sequential = []
+        for label, cfg in renditions.items():
+            out_file = os.path.join(sequential_dir, f"source_{label}.mp4")
+            worker.generate_mp4_rendition(src, out_file, cfg["size"], cfg["bitrate"], info["has_audio"])
+            sequential.append((label, out_file))
+
+        chunked = worker.generate_ladder_chunked(
+            src, chunked_dir, "source", renditions, info["has_audio"], info["duration"],
+            chunk_duration=chunk_duration, frame_rate=info["frame_rate"],
+        )
+
+        results = []
+        for (label, sequential_file), (_, chunked_file) in zip(sequential, chunked):
+            worker.remux_hls_rendition(sequential_file, sequential_dir, label)
+            worker.remux_hls_rendition(chunked_file, chunked_dir, label)
+            results.append((
+                label,
+                describe_output(sequential_file, sequential_dir, label),
+                describe_output(chunked_file, chunked_dir, label),
+            ))
+
+    return results
+
+
+def test_plan_chunks_cuts_on_frames():
+    rate = Fraction(30000, 1001)
+    chunks = worker.plan_chunks(75, 30, rate)
+
+    # Every cut is on the first frame at or after a multiple of the chunk length
+    assert [frames for _, _, frames in chunks] == [900, 899, None]
+    for start, _, _ in chunks[1:]:
+        frame = round(start * rate)
+        assert (frame - 1) / rate < start <= frame / rate
+
+
+@pytest.mark.parametrize("rate", ["30", "30000/1001", "24000/1001"])
+def test_chunked_matches_sequential(rate):
+    for label, sequential, chunked in compare_chunked_with_sequential(75, 30, rate):
+        assert chunked[0] == pytest.approx(sequential[0], abs=DURATION_TOLERANCE), label
+        assert chunked[1] == sequential[1], label
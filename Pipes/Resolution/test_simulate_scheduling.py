@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+# manager_common imports the manager's clients at module level
+for module in ("docker", "pika", "prometheus_client"):
+    pytest.importorskip(module)
+
+import manager_common  # noqa: E402
+import simulate_scheduling  # noqa: E402
+
+JOBS = 2000
+SLOTS = 4
+SEED = 1
+PREFETCH = 10
+
+
+@pytest.fixture
+def results(monkeypatch):
+    """Replay the same fixed-seed workload with FIFO and with SJF, with the default aging."""
+    monkeypatch.setattr(manager_common, "SJF_AGING", 10.0)
+    jobs = simulate_scheduling.make_workload(JOBS, SEED)
+    return {
+        policy: simulate_scheduling.simulate(jobs, SLOTS, policy, prefetch=PREFETCH)
+        for policy in ("fifo", "sjf")
+    }
+
+
+def test_sjf_improves_time_to_playable(results):
+    fifo = [r[1] for r in results["fifo"]]
+    sjf = [r[1] for r in results["sjf"]]
+
+    # About -31% on this workload; shorter jobs no longer queue behind long recordings
+    assert simulate_scheduling.percentile(sjf, 50) < 0.8 * simulate_scheduling.percentile(fifo, 50)
+    assert simulate_scheduling.percentile(sjf, 95) <= simulate_scheduling.percentile(fifo, 95)
+
+
+def test_sjf_does_not_starve_long_jobs(results):
+    fifo, sjf = results["fifo"], results["sjf"]
+
+    # Every job is started, and aging bounds how long the longest ones wait
+    assert len(sjf) == JOBS
+    assert max(r[0] for r in sjf) <= max(r[0] for r in fifo)
+    long_fifo = max(r[0] for r in fifo if r[2] >= 3600)
+    long_sjf = max(r[0] for r in sjf if r[2] >= 3600)
+    assert long_sjf <= 1.25 * long_fifo
@@ -1,21 +1,45 @@
+import hashlib
+import io
+import json
 import logging
+import math
 import os
 import shutil
 import sys
 import tempfile
+import threading
 import time
-from typing import Dict, Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from fractions import Fraction
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+from urllib.parse import urlparse
 
 import ffmpeg
 from minio import Minio
+from minio.error import S3Error
+
+import worker_common
+from worker_common import (
+    BUCKET, DEDUP_ENABLED, INDEX_PREFIX, REPORTS_ENABLED, RETRY_FAILED_JOBS, SOURCE_URL_EXPIRY, JobReport, SourceCache,
+    claim_job, complete_job, consume_queue, current_stage, hash_source, open_source, probe_source, read_index,
+    record_outputs, release_job, reuse_outputs, source_cache, stage, wait_for_minio, write_index,
+)
 
 # --- Config ---
-MINIO_EP = os.getenv("MINIO_ENDPOINT", "minio:9000")
-ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY", "minioadmin")
-SECRET_KEY = os.getenv("MINIO_SECRET_KEY", "minioadmin")
 JOB_ID = os.getenv("JOB_ID")
 OBJECT_KEY = os.getenv("OBJECT_KEY")
-BUCKET = "video"
+
+# "job" processes JOB_ID/OBJECT_KEY once, "consumer" takes jobs from RabbitMQ (warm pool)
+WORKER_MODE = os.getenv("WORKER_MODE", "job").lower()
+QUEUE = "resolution_jobs"
+
+PIPELINE = "resolution"
+worker_common.set_pipeline(PIPELINE)
+
+# CPU threads granted by the manager (0 lets ffmpeg decide)
+THREADS = int(os.getenv("THREADS", "0"))
 
 ENABLED_RENDITIONS = os.getenv("RENDITIONS", "240p,1080p").split(",")
 
@@ -24,6 +48,43 @@ HLS_ENABLED = os.getenv("HLS_ENABLED", "true").lower() == "true"
 HLS_SEGMENT_TIME = int(os.getenv("HLS_SEGMENT_TIME", "6"))
 HLS_PLAYLIST_TYPE = os.getenv("HLS_PLAYLIST_TYPE", "vod")
 
+# "encode": HLS renditions are encoded on their own
+# "remux":  HLS is stream-copied from the keyframe-aligned MP4 renditions
+HLS_PACKAGING = os.getenv("HLS_PACKAGING", "encode").lower()
+HLS_SEGMENT_TYPE = os.getenv("HLS_SEGMENT_TYPE", "mpegts").lower()
+HLS_SEGMENT_SUFFIXES = (".ts", ".m4s", ".mp4")
+
+# Decode the source once and encode every rendition from a single ffmpeg process
+SINGLE_DECODE = os.getenv("SINGLE_DECODE", "false").lower() == "true"
+
+# Split the source into chunks and encode them in parallel across a process pool
+CHUNKED_ENCODING = os.getenv("CHUNKED_ENCODING", "false").lower() == "true"
+CHUNK_DURATION = int(os.getenv("CHUNK_DURATION", "60"))
+CHUNK_WORKERS = int(os.getenv("CHUNK_WORKERS", str(THREADS or os.cpu_count() or 1)))
+
+# Upload HLS segments while ffmpeg is still encoding
+PIPELINED_UPLOAD = os.getenv("PIPELINED_UPLOAD", "false").lower() == "true"
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+UPLOAD_POLL_INTERVAL = float(os.getenv("UPLOAD_POLL_INTERVAL", "0.5"))
+
+# Build outputs in memory instead of the scratch directory: MP4s are written as fragmented MP4 to
+# ffmpeg's stdout and uploaded in multipart parts, HLS files are PUT by ffmpeg to a local ingest
+# endpoint that stores them with put_object. With SOURCE_MODE=url a job needs no scratch disk.
+STREAMING_OUTPUT = os.getenv("STREAMING_OUTPUT", "false").lower() == "true"
+STREAM_PART_SIZE = int(os.getenv("STREAM_PART_SIZE", str(16 * 1024 * 1024)))
+
+# Encode the audio once per job (or copy it if the source is already AAC); HLS rungs become
+# video-only and reference a single audio rendition through #EXT-X-MEDIA
+SHARED_AUDIO = os.getenv("SHARED_AUDIO", "false").lower() == "true"
+AUDIO_LABEL = "audio"
+AUDIO_BANDWIDTH = 128000
+
+# Keep a per-job progress manifest so a retried job skips rungs that were already uploaded
+CHECKPOINT_ENABLED = os.getenv("CHECKPOINT_ENABLED", "false").lower() == "true"
+
+# Publish HLS rungs one at a time, lowest first, so playback can start before the full ladder is done
+PROGRESSIVE_PUBLISH = os.getenv("PROGRESSIVE_PUBLISH", "false").lower() == "true"
+
 # --- Logging ---
 logging.basicConfig(
     level=logging.INFO,
@@ -41,31 +102,119 @@ ALL_RENDITIONS = {
 }
 
 
-def wait_for_minio(max_retries: int = 30, delay: int = 2) -> Minio | None:
-    """Wait for MinIO to become available."""
-    client = Minio(MINIO_EP, ACCESS_KEY, SECRET_KEY, secure=False)
-    for attempt in range(max_retries):
-        try:
-            client.list_buckets()
-            logging.info("MinIO is ready")
-            return client
-        except Exception as e:
-            if attempt < max_retries - 1:
-                logging.warning(
-                    f"Waiting for MinIO at {MINIO_EP} "
-                    f"(attempt {attempt + 1}/{max_retries})..."
-                )
-                time.sleep(delay)
-            else:
-                raise RuntimeError(
-                    f"MinIO not available after {max_retries} attempts: {e}"
-                )
+def settings_digest(renditions: Dict[str, Dict]) -> str:
+    """Digest of the settings that shape the outputs."""
+    settings = json.dumps([
+        sorted(renditions), HLS_ENABLED, HLS_SEGMENT_TIME, HLS_PLAYLIST_TYPE, HLS_PACKAGING, HLS_SEGMENT_TYPE,
+        SHARED_AUDIO,
+    ])
+    return hashlib.sha256(settings.encode("utf-8")).hexdigest()[:12]
+
+
+def dedup_key(source_hash: str, renditions: Dict[str, Dict]) -> str:
+    """Content key: the source hash plus a digest of the settings that shape the outputs."""
+    return f"{source_hash}-{settings_digest(renditions)}"
+
+
+def list_outputs(minio: Minio, base_name: str, renditions: Dict[str, Dict]) -> List[str]:
+    """Names of all uploaded rendition objects, relative to base_name."""
+    objects = []
+    labels = list(renditions) + ([AUDIO_LABEL] if SHARED_AUDIO and HLS_ENABLED else [])
+    for label in labels:
+        for obj in minio.list_objects(BUCKET, prefix=f"{base_name}/{label}/", recursive=True):
+            objects.append(obj.object_name[len(base_name) + 1:])
+    if HLS_ENABLED:
+        objects.append("master.m3u8")
+    return objects
 
 
-def get_video_info(src: str) -> Dict:
-    """Probe video file to get resolution and other metadata."""
+class JobCheckpoint:
+    """
+    Progress manifest of one job, so a retried job carries on where the last attempt stopped.
+
+    Every rung has two stages, "mp4" (the download rendition) and "hls" (playlist
+    and segments). Once a stage is uploaded, its objects are recorded with their
+    ETags under the index. On the next attempt a stage only counts as done if
+    the source object and the output settings are unchanged and every recorded
+    object still has the recorded ETag.
+    """
+
+    def __init__(self, minio: Minio, job_id: str, object_key: str, base_name: str, renditions: Dict[str, Dict]):
+        self.minio = minio
+        self.key = f"progress/{job_id}.json"
+        self.base_name = base_name
+        self.stages = {}
+        self.done = set()
+        if not CHECKPOINT_ENABLED:
+            return
+
+        self.identity = {
+            "source": minio.stat_object(BUCKET, object_key).etag,
+            "settings": settings_digest(renditions),
+        }
+        manifest = read_index(minio, self.key)
+        if not manifest or manifest.get("identity") != self.identity:
+            return
+
+        self.stages = manifest["stages"]
+        for label, stages in self.stages.items():
+            for stage, objects in stages.items():
+                if self._verified(objects):
+                    self.done.add((label, stage))
+        if self.done:
+            logging.info(f"Resuming job {job_id}, already uploaded: {sorted(self.done)}")
+
+    def _verified(self, objects: Dict[str, str]) -> bool:
+        for name, etag in objects.items():
+            try:
+                stat = self.minio.stat_object(BUCKET, f"{self.base_name}/{name}")
+            except S3Error:
+                return False
+            if stat.etag != etag:
+                return False
+        return bool(objects)
+
+    def is_done(self, label: str, stage: str) -> bool:
+        return (label, stage) in self.done
+
+    def rung_done(self, label: str) -> bool:
+        return self.is_done(label, "mp4") and (self.is_done(label, "hls") or not HLS_ENABLED)
+
+    def mark(self, label: str, stage: str) -> None:
+        """Record the uploaded objects of one stage of a rung."""
+        if not CHECKPOINT_ENABLED:
+            return
+        mp4_name = f"{label}/{label}.mp4"
+        objects = {}
+        for obj in self.minio.list_objects(BUCKET, prefix=f"{self.base_name}/{label}/", recursive=True):
+            name = obj.object_name[len(self.base_name) + 1:]
+            if (name == mp4_name) == (stage == "mp4"):
+                objects[name] = obj.etag
+
+        self.stages.setdefault(label, {})[stage] = objects
+        self.done.add((label, stage))
+        write_index(self.minio, self.key, {"identity": self.identity, "stages": self.stages})
+
+    def clear(self) -> None:
+        if CHECKPOINT_ENABLED:
+            self.minio.remove_object(BUCKET, f"{INDEX_PREFIX}/{PIPELINE}/{self.key}")
+
+
+def constant_frame_rate(video_stream: Dict) -> Fraction | None:
+    """Exact frame rate of a constant frame rate stream (30000/1001 for 29.97), None if unknown or variable."""
     try:
-        probe = ffmpeg.probe(src)
+        rate = Fraction(video_stream["r_frame_rate"])
+        average = Fraction(video_stream["avg_frame_rate"])
+    except (KeyError, ValueError, ZeroDivisionError):
+        return None
+    return rate if rate > 0 and rate == average else None
+
+
+def get_video_info(src: str, minio: Minio | None = None, object_key: str | None = None) -> Dict:
+    """Probe video file to get resolution and other metadata (through the probe sidecar if minio is given)."""
+    try:
+        with stage("probe"):
+            probe = probe_source(minio, object_key, src) if minio else ffmpeg.probe(src)
         video_stream = next(
             (s for s in probe["streams"] if s["codec_type"] == "video"), None
         )
@@ -77,18 +226,24 @@ def get_video_info(src: str) -> Dict:
             "width": 0,
             "height": 0,
             "duration": 0,
+            "frame_rate": None,
             "has_audio": False,
             "audio_codec": None,
+            "audio_sample_rate": 0,
+            "audio_channels": 0,
         }
 
         if video_stream:
             info["width"] = int(video_stream["width"])
             info["height"] = int(video_stream["height"])
             info["duration"] = float(probe["format"].get("duration", 0))
+            info["frame_rate"] = constant_frame_rate(video_stream)
 
         if audio_stream:
             info["has_audio"] = True
             info["audio_codec"] = audio_stream.get("codec_name")
+            info["audio_sample_rate"] = int(audio_stream.get("sample_rate") or 0)
+            info["audio_channels"] = int(audio_stream.get("channels") or 0)
             logging.info(f"Audio detected: codec={info['audio_codec']}, "
                          f"channels={audio_stream.get('channels')}, "
                          f"sample_rate={audio_stream.get('sample_rate')}")
@@ -98,7 +253,10 @@ def get_video_info(src: str) -> Dict:
         return info
     except Exception as e:
         logging.warning(f"Could not probe video: {e}")
-    return {"width": 0, "height": 0, "duration": 0, "has_audio": False, "audio_codec": None}
+    return {
+        "width": 0, "height": 0, "duration": 0, "frame_rate": None,
+        "has_audio": False, "audio_codec": None, "audio_sample_rate": 0, "audio_channels": 0,
+    }
 
 
 def filter_renditions_by_source(
@@ -117,48 +275,132 @@ def filter_renditions_by_source(
     return filtered
 
 
-def generate_mp4_rendition(src: str, dst: str, size: str, bitrate: str, has_audio: bool) -> None:
+def parse_progress(output: bytes) -> Dict:
+    """Final fps, speed and output size from ffmpeg -progress key=value output."""
+    values = {}
+    for line in output.decode("utf-8", "replace").splitlines():
+        key, _, value = line.partition("=")
+        values[key.strip()] = value.strip()
+
+    progress = {}
+    for key, field, convert in (
+            ("fps", "fps", float),
+            ("speed", "speed", lambda v: float(v.rstrip("x"))),
+            ("out_time_us", "media_seconds", lambda v: round(int(v) / 1e6, 3)),
+            ("total_size", "bytes", int),
+    ):
+        try:
+            progress[field] = convert(values[key])
+        except (KeyError, ValueError):
+            pass
+    return progress
+
+
+def run_ffmpeg(stream) -> Tuple[bytes, bytes]:
+    """ffmpeg.run with -progress on stdout; fps and speed of the run are added to the current stage."""
+    out, err = ffmpeg.run(
+        stream.global_args("-progress", "pipe:1", "-nostats"), capture_stdout=True, capture_stderr=True
+    )
+    entry = current_stage()
+    if entry is not None:
+        entry.update(parse_progress(out))
+    return out, err
+
+
+def _keyframe_args() -> Dict:
+    """Force keyframes on HLS segment boundaries so the output can be cut by stream copy."""
+    return {"force_key_frames": f"expr:gte(t,n_forced*{HLS_SEGMENT_TIME})"}
+
+
+def _mp4_output_args(bitrate: str, has_audio: bool, copy_audio: bool = False) -> Dict:
+    """ffmpeg output options for an MP4 rendition (copy_audio: the audio input is the shared AAC track)."""
+    args = {
+        "vcodec": "libx264",
+        "preset": "faster",
+        "video_bitrate": bitrate,
+    }
+    if THREADS:
+        args["threads"] = THREADS
+    if HLS_ENABLED and HLS_PACKAGING == "remux":
+        args.update(_keyframe_args())
+    if has_audio and copy_audio:
+        args["acodec"] = "copy"
+    elif has_audio:
+        args.update(acodec="aac", audio_bitrate="128k", ar=48000, ac=2)
+    args["movflags"] = "+faststart"
+    return args
+
+
+def _hls_muxer_args(output_dir: str, label: str) -> Dict:
+    """HLS muxer options for a rendition playlist written into output_dir."""
+    args = {
+        "format": "hls",
+        "hls_time": HLS_SEGMENT_TIME,
+        "hls_playlist_type": HLS_PLAYLIST_TYPE,
+        "start_number": 0,
+    }
+    if output_dir.startswith("http://"):
+        # Written to the HlsIngestServer, over one keep-alive connection
+        args.update(method="PUT", http_persistent=1)
+    elif PIPELINED_UPLOAD:
+        # Segments are written as .tmp and renamed once complete
+        args["hls_flags"] = "temp_file"
+    if HLS_SEGMENT_TYPE == "fmp4":
+        args.update(
+            hls_segment_type="fmp4",
+            hls_fmp4_init_filename=f"{label}_init.mp4",
+            hls_segment_filename=os.path.join(output_dir, f"{label}_%03d.m4s"),
+        )
+    else:
+        args["hls_segment_filename"] = os.path.join(output_dir, f"{label}_%03d.ts")
+    return args
+
+
+def _hls_output_args(output_dir: str, label: str, bitrate: str, has_audio: bool) -> Dict:
+    """ffmpeg output options for an HLS rendition written into output_dir."""
+    args = {
+        "vcodec": "libx264",
+        "preset": "faster",
+        "video_bitrate": bitrate,
+    }
+    if THREADS:
+        args["threads"] = THREADS
+    if has_audio:
+        args.update(acodec="aac", audio_bitrate="128k", ar=48000, ac=2)
+    args.update(_hls_muxer_args(output_dir, label))
+    return args
+
+
+def _rendition_height(cfg: Dict) -> int:
+    return int(cfg["size"].split(":")[1])
+
+
+def generate_mp4_rendition(
+        src: str, dst: str, size: str, bitrate: str, has_audio: bool, audio_file: str | None = None
+) -> None:
     width, height = map(int, size.split(":"))
 
     input_stream = ffmpeg.input(src)
     video = input_stream['v:0'].filter("scale", width, height)
 
-    # Only add audio if it exists
-    if has_audio:
-        audio = input_stream['a:0']
-        stream = (
-            ffmpeg.output(
-                video,
-                audio,
-                dst,
-                vcodec="libx264",
-                preset="faster",
-                video_bitrate=bitrate,
-                acodec="aac",
-                audio_bitrate="128k",
-                ar=48000,
-                ac=2,
-                movflags="+faststart",
-            )
-            .overwrite_output()
-        )
+    # Only add audio if it exists; the shared audio track is muxed in without re-encoding
+    if has_audio and audio_file:
+        streams = [video, ffmpeg.input(audio_file)['a:0']]
+    elif has_audio:
+        streams = [video, input_stream['a:0']]
     else:
         logging.info(f"Creating video-only MP4 (no audio): {dst}")
-        stream = (
-            ffmpeg.output(
-                video,
-                dst,
-                vcodec="libx264",
-                preset="faster",
-                video_bitrate=bitrate,
-                movflags="+faststart",
-            )
-            .overwrite_output()
-        )
+        streams = [video]
+
+    stream = (
+        ffmpeg.output(*streams, dst, **_mp4_output_args(bitrate, has_audio, copy_audio=audio_file is not None))
+        .overwrite_output()
+    )
 
     logging.info(f"Running ffmpeg MP4 rendition: {dst}")
     try:
-        out, err = ffmpeg.run(stream, capture_stdout=True, capture_stderr=True)
+        with stage("encode_mp4", size=size):
+            out, err = run_ffmpeg(stream)
         logging.info(f"FFmpeg stderr (last 500 chars): {err.decode('utf-8')[-500:]}")
     except ffmpeg.Error as e:
         logging.error(f"FFmpeg error: {e.stderr.decode('utf-8')}")
@@ -172,55 +414,28 @@ def generate_hls_rendition(
     width, height = map(int, size.split(":"))
 
     playlist_file = os.path.join(output_dir, f"{label}.m3u8")
-    segment_pattern = os.path.join(output_dir, f"{label}_%03d.ts")
 
     input_stream = ffmpeg.input(src)
     video = input_stream['v:0'].filter("scale", width, height)
 
     # Only add audio if it exists
     if has_audio:
-        audio = input_stream['a:0']
-        stream = (
-            ffmpeg.output(
-                video,
-                audio,
-                playlist_file,
-                vcodec="libx264",
-                preset="faster",
-                video_bitrate=bitrate,
-                acodec="aac",
-                audio_bitrate="128k",
-                ar=48000,
-                ac=2,
-                format="hls",
-                hls_time=HLS_SEGMENT_TIME,
-                hls_playlist_type=HLS_PLAYLIST_TYPE,
-                hls_segment_filename=segment_pattern,
-                start_number=0,
-            )
-            .overwrite_output()
-        )
+        streams = [video, input_stream['a:0']]
     else:
         logging.info(f"Creating video-only HLS (no audio): {label}")
-        stream = (
-            ffmpeg.output(
-                video,
-                playlist_file,
-                vcodec="libx264",
-                preset="faster",
-                video_bitrate=bitrate,
-                format="hls",
-                hls_time=HLS_SEGMENT_TIME,
-                hls_playlist_type=HLS_PLAYLIST_TYPE,
-                hls_segment_filename=segment_pattern,
-                start_number=0,
-            )
-            .overwrite_output()
+        streams = [video]
+
+    stream = (
+        ffmpeg.output(
+            *streams, playlist_file, **_hls_output_args(output_dir, label, bitrate, has_audio)
         )
+        .overwrite_output()
+    )
 
     logging.info(f"Running ffmpeg HLS rendition: {label}")
     try:
-        out, err = ffmpeg.run(stream, capture_stdout=True, capture_stderr=True)
+        with stage("encode_hls", rendition=label):
+            out, err = run_ffmpeg(stream)
         logging.info(f"FFmpeg output for {label}: {err.decode('utf-8')[-500:]}")
     except ffmpeg.Error as e:
         logging.error(f"FFmpeg error for {label}: {e.stderr.decode('utf-8')}")
@@ -229,91 +444,848 @@ def generate_hls_rendition(
     return playlist_file, output_dir
 
 
-def create_master_playlist(
-        output_dir: str, renditions: Dict[str, Dict], base_name: str
+def remux_hls_rendition(
+        mp4_file: str, output_dir: str, label: str, video_only: bool = False
+) -> Tuple[str, str]:
+    """Package an already encoded MP4 rendition (or the shared audio track) as HLS by stream copy."""
+    playlist_file = os.path.join(output_dir, f"{label}.m3u8")
+
+    input_stream = ffmpeg.input(mp4_file)
+    stream = (
+        (input_stream['v:0'] if video_only else input_stream)
+        .output(playlist_file, codec="copy", **_hls_muxer_args(output_dir, label))
+        .overwrite_output()
+    )
+
+    logging.info(f"Remuxing {label} MP4 into HLS ({HLS_SEGMENT_TYPE})")
+    try:
+        with stage("package_hls", rendition=label):
+            out, err = run_ffmpeg(stream)
+        logging.info(f"FFmpeg output for {label}: {err.decode('utf-8')[-500:]}")
+    except ffmpeg.Error as e:
+        logging.error(f"FFmpeg error for {label}: {e.stderr.decode('utf-8')}")
+        raise
+
+    return playlist_file, output_dir
+
+
+def generate_ladder_single_decode(
+        src: str,
+        mp4_dir: str,
+        hls_dir: str | None,
+        base_name: str,
+        renditions: Dict[str, Dict],
+        has_audio: bool,
+        audio_file: str | None = None,
+        skip_mp4: set | frozenset = frozenset(),
+) -> List[Tuple[str, str]]:
+    """
+    Generate every MP4 (and HLS, if hls_dir is given) rendition from one ffmpeg process.
+
+    The source is decoded once and the frames are split inside a single filter
+    graph. Scaling cascades from the largest rung down (1080p -> 720p -> ...),
+    so each rung is scaled from the previous one instead of the full-size frame.
+    With a shared audio_file the MP4s copy it and the HLS rungs are video-only.
+    Rungs in skip_mp4 (already uploaded) only get their HLS output.
+    """
+    ordered = sorted(renditions.items(), key=lambda item: _rendition_height(item[1]), reverse=True)
+
+    input_stream = ffmpeg.input(src)
+    audio = input_stream['a:0'] if has_audio else None
+    if has_audio and audio_file:
+        audio = ffmpeg.input(audio_file)['a:0']
+    hls_audio = audio if audio_file is None else None
+    if not has_audio:
+        logging.info("Creating video-only renditions (no audio)")
+
+    current = input_stream['v:0']
+    outputs = []
+    mp4_paths = []
+    for index, (label, cfg) in enumerate(ordered):
+        width, height = map(int, cfg["size"].split(":"))
+        scaled = current.filter("scale", width, height)
+
+        # One branch per output of this rung, plus one feeding the next (smaller) rung
+        has_next = index < len(ordered) - 1
+        make_mp4 = label not in skip_mp4
+        branch_count = make_mp4 + (hls_dir is not None) + has_next
+        if branch_count > 1:
+            split = scaled.filter_multi_output("split", branch_count)
+            branches = [split.stream(i) for i in range(branch_count)]
+        else:
+            branches = [scaled]
+
+        if make_mp4:
+            mp4_file = os.path.join(mp4_dir, f"{base_name}_{label}.mp4")
+            streams = [branches.pop(0)] + ([audio] if audio is not None else [])
+            outputs.append(
+                ffmpeg.output(
+                    *streams, mp4_file,
+                    **_mp4_output_args(cfg["bitrate"], has_audio, copy_audio=audio_file is not None),
+                )
+            )
+            mp4_paths.append((label, mp4_file))
+
+        if hls_dir is not None:
+            playlist_file = os.path.join(hls_dir, f"{label}.m3u8")
+            streams = [branches.pop(0)] + ([hls_audio] if hls_audio is not None else [])
+            outputs.append(
+                ffmpeg.output(
+                    *streams, playlist_file,
+                    **_hls_output_args(hls_dir, label, cfg["bitrate"], hls_audio is not None),
+                )
+            )
+
+        if has_next:
+            current = branches.pop(0)
+
+    stream = ffmpeg.merge_outputs(*outputs).overwrite_output()
+
+    logging.info(f"Running single-decode ffmpeg ladder: {', '.join(label for label, _ in ordered)}")
+    try:
+        with stage("encode_ladder", renditions=[label for label, _ in ordered]):
+            out, err = run_ffmpeg(stream)
+        logging.info(f"FFmpeg stderr (last 500 chars): {err.decode('utf-8')[-500:]}")
+    except ffmpeg.Error as e:
+        logging.error(f"FFmpeg error: {e.stderr.decode('utf-8')}")
+        raise
+
+    return mp4_paths
+
+
+def plan_chunks(
+        duration: float, chunk_duration: int, frame_rate: Fraction | None = None
+) -> List[Tuple[float, float | None, int | None]]:
+    """
+    Split [0, duration) into (start, length, frames) chunks for parallel encoding.
+
+    Chunk boundaries are rounded to multiples of HLS_SEGMENT_TIME. Every chunk
+    starts a new GOP there, so the stitched output has keyframes on exactly the
+    same segment boundaries as a sequential encode. The last chunk has no length
+    and runs to the end of the source.
+
+    With a constant frame_rate the cuts are moved to the first frame at or after
+    each boundary (where a sequential encode forces its keyframe) and every chunk
+    is a whole number of frames, so fractional rates like 29.97 or 23.976 neither
+    drop nor repeat a frame at the seams. Without one (variable frame rate or an
+    unknown rate) chunks are cut by time and a seam may be off by one frame.
+    """
+    length = max(HLS_SEGMENT_TIME, chunk_duration // HLS_SEGMENT_TIME * HLS_SEGMENT_TIME)
+    cuts = [0]
+    while cuts[-1] + length < duration:
+        cuts.append(cuts[-1] + length)
+    if frame_rate is None:
+        return [(start, length, None) for start in cuts[:-1]] + [(cuts[-1], None, None)]
+
+    # Round the seek position down to the microsecond ffmpeg parses, so it never passes the cut frame
+    frames = [math.ceil(cut * frame_rate) for cut in cuts]
+    starts = [math.floor(frame / frame_rate * 1_000_000) / 1_000_000 for frame in frames]
+    chunks = [
+        (start, float((end - frame) / frame_rate), end - frame)
+        for start, frame, end in zip(starts, frames, frames[1:])
+    ]
+    chunks.append((starts[-1], None, None))
+    return chunks
+
+
+def _encode_chunk(
+        src: str, dst: str, start: float, length: float | None, frames: int | None, size: str, bitrate: str,
+        threads: int
 ) -> str:
-    """Create HLS master playlist that references all rendition playlists."""
-    master_file = os.path.join(output_dir, f"{base_name}_master.m3u8")
+    """Encode the video of one chunk (runs inside the process pool); frames, if set, is its exact length."""
+    width, height = map(int, size.split(":"))
 
-    with open(master_file, "w") as f:
-        f.write("#EXTM3U\n")
-        f.write("#EXT-X-VERSION:3\n\n")
+    input_args = {"ss": start}
+    output_args = {}
+    if frames is not None:
+        output_args["vframes"] = frames
+    elif length is not None:
+        input_args["t"] = length
+
+    video = ffmpeg.input(src, **input_args)['v:0'].filter("scale", width, height)
+    stream = (
+        ffmpeg.output(
+            video,
+            dst,
+            vcodec="libx264",
+            preset="faster",
+            video_bitrate=bitrate,
+            threads=threads,
+            **_keyframe_args(),
+            **output_args,
+        )
+        .overwrite_output()
+    )
+
+    try:
+        ffmpeg.run(stream, capture_stdout=True, capture_stderr=True)
+    except ffmpeg.Error as e:
+        # ffmpeg.Error cannot be pickled back to the parent process
+        raise RuntimeError(f"FFmpeg error for chunk {dst}: {e.stderr.decode('utf-8')[-500:]}") from None
+    return dst
+
+
+def _encode_audio(src: str, dst: str) -> str:
+    """Encode the audio track once for all chunked renditions (runs inside the process pool)."""
+    stream = (
+        ffmpeg.input(src)['a:0']
+        .output(dst, acodec="aac", audio_bitrate="128k", ar=48000, ac=2)
+        .overwrite_output()
+    )
 
+    try:
+        ffmpeg.run(stream, capture_stdout=True, capture_stderr=True)
+    except ffmpeg.Error as e:
+        raise RuntimeError(f"FFmpeg error for audio {dst}: {e.stderr.decode('utf-8')[-500:]}") from None
+    return dst
+
+
+def _stitch_chunks(chunk_files: List[str], audio_file: str | None, dst: str) -> None:
+    """Concatenate encoded chunks (and the shared audio track) into one MP4 by stream copy."""
+    list_file = f"{os.path.splitext(dst)[0]}_chunks.txt"
+    with open(list_file, "w") as f:
+        for path in chunk_files:
+            f.write(f"file '{path}'\n")
+
+    streams = [ffmpeg.input(list_file, format="concat", safe=0)['v:0']]
+    if audio_file:
+        streams.append(ffmpeg.input(audio_file)['a:0'])
+
+    stream = (
+        ffmpeg.output(*streams, dst, codec="copy", movflags="+faststart")
+        .overwrite_output()
+    )
+
+    logging.info(f"Stitching {len(chunk_files)} chunks into {dst}")
+    try:
+        out, err = ffmpeg.run(stream, capture_stdout=True, capture_stderr=True)
+        logging.info(f"FFmpeg stderr (last 500 chars): {err.decode('utf-8')[-500:]}")
+    except ffmpeg.Error as e:
+        logging.error(f"FFmpeg error: {e.stderr.decode('utf-8')}")
+        raise
+    finally:
+        os.remove(list_file)
+
+
+def generate_ladder_chunked(
+        src: str,
+        mp4_dir: str,
+        base_name: str,
+        renditions: Dict[str, Dict],
+        has_audio: bool,
+        duration: float,
+        chunk_duration: int = CHUNK_DURATION,
+        workers: int = CHUNK_WORKERS,
+        audio_file: str | None = None,
+        frame_rate: Fraction | None = None,
+) -> List[Tuple[str, str]]:
+    """
+    Generate every MP4 rendition by encoding chunks of the source in parallel.
+
+    All (rendition, chunk) encodes share one process pool. The audio track is
+    encoded once and muxed into every rendition while the chunks are stitched.
+    The resulting MP4s have keyframes on HLS segment boundaries and can be
+    packaged with remux_hls_rendition. A shared audio_file is used as is.
+    Pass the source's constant frame_rate to cut the chunks on frames.
+    """
+    chunks = plan_chunks(duration, chunk_duration, frame_rate)
+    chunk_dir = os.path.join(mp4_dir, "chunks")
+    os.makedirs(chunk_dir, exist_ok=True)
+
+    # Keep the total number of encoder threads close to the available cores
+    threads = max(1, (THREADS or os.cpu_count() or 1) // workers)
+
+    logging.info(
+        f"Encoding {len(renditions)} renditions in {len(chunks)} chunks "
+        f"with {workers} workers ({threads} threads each)"
+    )
+
+    chunk_files = {label: [] for label in renditions}
+    encode_audio = has_audio and audio_file is None
+    if encode_audio:
+        audio_file = os.path.join(chunk_dir, "audio.m4a")
+
+    with (
+        stage("encode_chunks", renditions=list(renditions), chunks=len(chunks)),
+        ProcessPoolExecutor(max_workers=workers) as pool,
+    ):
+        futures = []
+        if encode_audio:
+            futures.append(pool.submit(_encode_audio, src, audio_file))
         for label, cfg in renditions.items():
-            width, height = map(int, cfg["size"].split(":"))
-            bitrate_num = int(cfg["bitrate"].replace("k", "000"))
+            for index, (start, length, frames) in enumerate(chunks):
+                dst = os.path.join(chunk_dir, f"{label}_{index:05d}.mp4")
+                chunk_files[label].append(dst)
+                futures.append(
+                    pool.submit(
+                        _encode_chunk, src, dst, start, length, frames, cfg["size"], cfg["bitrate"], threads
+                    )
+                )
 
-            f.write(
+        try:
+            for future in as_completed(futures):
+                future.result()
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+
+    mp4_paths = []
+    for label in renditions:
+        out_file = os.path.join(mp4_dir, f"{base_name}_{label}.mp4")
+        _stitch_chunks(chunk_files[label], audio_file, out_file)
+        mp4_paths.append((label, out_file))
+
+    shutil.rmtree(chunk_dir)
+    return mp4_paths
+
+
+def fetch_rendition_mp4(minio: Minio, tmp_root: str, base_name: str, label: str) -> str:
+    """Download an MP4 rung uploaded by an earlier attempt, so only its HLS packaging is redone."""
+    out_file = os.path.join(tmp_root, f"{base_name}_{label}.mp4")
+    logging.info(f"Fetching already uploaded {label} MP4 for packaging...")
+    minio.fget_object(BUCKET, os.path.join(base_name, label, f"{label}.mp4"), out_file)
+    return out_file
+
+
+def prepare_shared_audio(src: str, tmp_root: str, video_info: Dict) -> str:
+    """
+    Produce the job's single AAC audio track.
+
+    AAC sources at 44.1/48 kHz with at most two channels are copied; anything
+    else is encoded once to AAC 128k stereo.
+    """
+    dst = os.path.join(tmp_root, f"{AUDIO_LABEL}.m4a")
+    reusable = (
+        video_info["audio_codec"] == "aac"
+        and video_info["audio_sample_rate"] in (44100, 48000)
+        and 0 < video_info["audio_channels"] <= 2
+    )
+    if not reusable:
+        logging.info(f"Encoding shared audio track ({video_info['audio_codec']} -> aac)")
+        with stage("encode_audio"):
+            return _encode_audio(src, dst)
+
+    logging.info("Copying shared AAC audio track from source")
+    stream = ffmpeg.input(src)['a:0'].output(dst, acodec="copy").overwrite_output()
+    try:
+        with stage("copy_audio"):
+            run_ffmpeg(stream)
+    except ffmpeg.Error as e:
+        logging.error(f"FFmpeg error for shared audio: {e.stderr.decode('utf-8')}")
+        raise
+    return dst
+
+
+def master_playlist(renditions: Dict[str, Dict], audio_group: bool = False) -> str:
+    """HLS master playlist that references all rendition playlists (and the shared audio)."""
+    lines = ["#EXTM3U\n", "#EXT-X-VERSION:3\n\n"]
+
+    if audio_group:
+        lines.append(
+            f'#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="{AUDIO_LABEL}",NAME="Default",DEFAULT=YES,'
+            f'AUTOSELECT=YES,URI="{AUDIO_LABEL}/{AUDIO_LABEL}.m3u8"\n\n'
+        )
+
+    for label, cfg in renditions.items():
+        width, height = map(int, cfg["size"].split(":"))
+        bitrate_num = int(cfg["bitrate"].replace("k", "000"))
+
+        if audio_group:
+            lines.append(
+                f'#EXT-X-STREAM-INF:BANDWIDTH={bitrate_num + AUDIO_BANDWIDTH},'
+                f'RESOLUTION={width}x{height},AUDIO="{AUDIO_LABEL}"\n'
+            )
+        else:
+            lines.append(
                 f'#EXT-X-STREAM-INF:BANDWIDTH={bitrate_num},'
                 f'RESOLUTION={width}x{height}\n'
             )
-            f.write(f"{label}/{label}.m3u8\n")
+        lines.append(f"{label}/{label}.m3u8\n")
+
+    return "".join(lines)
+
+
+def create_master_playlist(
+        output_dir: str, renditions: Dict[str, Dict], base_name: str, audio_group: bool = False
+) -> str:
+    """Write the master playlist into output_dir."""
+    master_file = os.path.join(output_dir, f"{base_name}_master.m3u8")
+
+    with open(master_file, "w") as f:
+        f.write(master_playlist(renditions, audio_group))
 
     logging.info(f"Created master playlist: {master_file}")
     return master_file
 
 
-def upload_hls_files(
-        minio: Minio, output_dir: str, base_name: str, renditions: Dict[str, Dict]
-) -> None:
-    """Upload all HLS files (.m3u8 and .ts) to MinIO with organized structure."""
-    # Upload master playlist to root
+def upload_master_playlist(minio: Minio, output_dir: str, base_name: str) -> None:
+    """Upload the master playlist; a single PUT, so readers see either the old or the new one."""
     master_file = os.path.join(output_dir, f"{base_name}_master.m3u8")
     if os.path.exists(master_file):
         object_path = os.path.join(base_name, "master.m3u8")
         logging.info(f"Uploading master playlist -> {BUCKET}/{object_path}")
         minio.fput_object(BUCKET, object_path, master_file)
 
-    # Upload each rendition's files to its own folder
-    for label in renditions.keys():
-        playlist_file = os.path.join(output_dir, f"{label}.m3u8")
 
-        # Upload playlist
-        if os.path.exists(playlist_file):
-            object_path = os.path.join(base_name, label, f"{label}.m3u8")
-            logging.info(f"Uploading {label} playlist -> {BUCKET}/{object_path}")
-            minio.fput_object(BUCKET, object_path, playlist_file)
-
-        # Upload all TS segments for this rendition
+def upload_rendition_files(minio: Minio, output_dir: str, base_name: str, label: str) -> None:
+    """Upload the segments of one rendition, then its playlist."""
+    with stage("upload_hls", rendition=label) as entry:
+        # Upload all segments (and the fMP4 init segment) for this rendition
+        uploaded = 0
         for file in os.listdir(output_dir):
-            if file.startswith(f"{label}_") and file.endswith(".ts"):
+            if file.startswith(f"{label}_") and file.endswith(HLS_SEGMENT_SUFFIXES):
                 local_path = os.path.join(output_dir, file)
                 segment_object_path = os.path.join(base_name, label, file)
 
                 logging.info(f"Uploading segment -> {BUCKET}/{segment_object_path}")
                 minio.fput_object(BUCKET, segment_object_path, local_path)
+                uploaded += os.path.getsize(local_path)
 
+        playlist_file = os.path.join(output_dir, f"{label}.m3u8")
+        if os.path.exists(playlist_file):
+            object_path = os.path.join(base_name, label, f"{label}.m3u8")
+            logging.info(f"Uploading {label} playlist -> {BUCKET}/{object_path}")
+            minio.fput_object(BUCKET, object_path, playlist_file)
+        entry["bytes"] = uploaded
 
-def main():
-    if not JOB_ID or not OBJECT_KEY:
-        logging.error("Missing JOB_ID or OBJECT_KEY environment variables")
-        sys.exit(1)
 
-    logging.info(f"Starting transcoding job {JOB_ID} for object {OBJECT_KEY}")
-    logging.info(f"Enabled renditions: {ENABLED_RENDITIONS}")
-    logging.info(f"HLS enabled: {HLS_ENABLED}")
+def upload_hls_files(
+        minio: Minio, output_dir: str, base_name: str, renditions: Dict[str, Dict]
+) -> None:
+    """Upload all HLS files (.m3u8 and segments) to MinIO with organized structure."""
+    # Upload each rendition's files to its own folder
+    for label in renditions.keys():
+        upload_rendition_files(minio, output_dir, base_name, label)
 
-    # Filter requested renditions
-    renditions = {
-        k: v for k, v in ALL_RENDITIONS.items() if k in ENABLED_RENDITIONS
-    }
+    # Upload master playlist to root
+    upload_master_playlist(minio, output_dir, base_name)
 
-    if not renditions:
-        logging.error(f"No valid renditions found in: {ENABLED_RENDITIONS}")
-        sys.exit(1)
 
-    minio = wait_for_minio()
+class HlsSegmentUploader:
+    """
+    Upload HLS segments to MinIO while ffmpeg is still writing them.
+
+    A background thread watches output_dir and hands every finished segment to
+    a bounded thread pool. ffmpeg runs with hls_flags=temp_file, so a segment
+    only shows up under its final name once it is closed. Playlists are
+    uploaded by finish(), after all segments, so readers never see a playlist
+    that references missing segments.
+    """
+
+    def __init__(
+            self,
+            minio: Minio,
+            output_dir: str,
+            base_name: str,
+            renditions: Dict[str, Dict],
+            max_workers: int = UPLOAD_CONCURRENCY,
+            poll_interval: float = UPLOAD_POLL_INTERVAL,
+    ):
+        self.minio = minio
+        self.output_dir = output_dir
+        self.base_name = base_name
+        self.labels = list(renditions.keys())
+        self.poll_interval = poll_interval
+
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = []
+        self._seen = set()
+        self._stop = threading.Event()
+        self._watcher = threading.Thread(target=self._watch, daemon=True)
+
+    def start(self) -> "HlsSegmentUploader":
+        self._watcher.start()
+        return self
+
+    def _label_for(self, file: str) -> str | None:
+        return next((label for label in self.labels if file.startswith(f"{label}_")), None)
+
+    def _upload(self, local_path: str, object_path: str) -> None:
+        logging.info(f"Uploading segment -> {BUCKET}/{object_path}")
+        self.minio.fput_object(BUCKET, object_path, local_path)
+
+    def _scan(self) -> None:
+        for file in sorted(os.listdir(self.output_dir)):
+            if file in self._seen or not file.endswith(HLS_SEGMENT_SUFFIXES) or file.endswith("_init.mp4"):
+                continue
+            label = self._label_for(file)
+            if label is None:
+                continue
+
+            self._seen.add(file)
+            local_path = os.path.join(self.output_dir, file)
+            object_path = os.path.join(self.base_name, label, file)
+            self._futures.append(self._pool.submit(self._upload, local_path, object_path))
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self._scan()
+            except Exception:
+                logging.exception("Segment watcher failed, remaining segments are uploaded by finish()")
+                return
+
+    def finish(self) -> None:
+        """Upload the remaining segments, then the rendition playlists, then the master playlist."""
+        self._stop.set()
+        self._watcher.join()
+        self._scan()
+
+        # Only the wait for uploads still in flight after the encode counts as upload time
+        with stage("upload_hls_tail", segments=len(self._seen)):
+            try:
+                for future in as_completed(self._futures):
+                    future.result()
+            finally:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+
+        logging.info(f"Uploaded {len(self._seen)} segments while encoding")
+
+        for label in self.labels:
+            for file in (f"{label}_init.mp4", f"{label}.m3u8"):
+                local_path = os.path.join(self.output_dir, file)
+                if os.path.exists(local_path):
+                    object_path = os.path.join(self.base_name, label, file)
+                    logging.info(f"Uploading {label} {file} -> {BUCKET}/{object_path}")
+                    self.minio.fput_object(BUCKET, object_path, local_path)
+
+        upload_master_playlist(self.minio, self.output_dir, self.base_name)
+
+    def close(self) -> None:
+        """Stop watching and drop pending uploads (used when the job fails)."""
+        self._stop.set()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def publish_progressively(
+        minio: Minio,
+        src: str,
+        tmp_root: str,
+        hls_dir: str,
+        base_name: str,
+        renditions: Dict[str, Dict],
+        video_info: Dict,
+        checkpoint: JobCheckpoint,
+        audio_file: str | None = None,
+) -> None:
+    """
+    Encode and publish one HLS rung at a time, lowest resolution first.
+
+    After each rung its segments and playlist are uploaded, then master.m3u8 is
+    rewritten to list exactly the finished rungs. The video is playable as
+    soon as the first rung is out; MP4 downloads that are not a by-product of
+    the HLS encode are produced last.
+    """
+    has_audio = video_info["has_audio"]
+    chunked = CHUNKED_ENCODING and video_info["duration"] > 0
+    audio_group = audio_file is not None
+    published = {}
+    mp4_paths = {}
+
+    for label, cfg in sorted(renditions.items(), key=lambda item: _rendition_height(item[1])):
+        if checkpoint.is_done(label, "hls"):
+            published[label] = cfg
+            continue
+
+        if chunked:
+            [(_, mp4_paths[label])] = generate_ladder_chunked(
+                src, tmp_root, base_name, {label: cfg}, has_audio, video_info["duration"], audio_file=audio_file,
+                frame_rate=video_info["frame_rate"],
+            )
+            remux_hls_rendition(mp4_paths[label], hls_dir, label, video_only=audio_group)
+        elif HLS_PACKAGING == "remux":
+            mp4_paths[label] = os.path.join(tmp_root, f"{base_name}_{label}.mp4")
+            generate_mp4_rendition(src, mp4_paths[label], cfg["size"], cfg["bitrate"], has_audio, audio_file)
+            remux_hls_rendition(mp4_paths[label], hls_dir, label, video_only=audio_group)
+        else:
+            generate_hls_rendition(src, hls_dir, label, cfg["size"], cfg["bitrate"], has_audio and not audio_group)
+
+        upload_rendition_files(minio, hls_dir, base_name, label)
+        checkpoint.mark(label, "hls")
+        published[label] = cfg
+        create_master_playlist(hls_dir, published, base_name, audio_group)
+        upload_master_playlist(minio, hls_dir, base_name)
+        logging.info(f"{label} is playable ({len(published)}/{len(renditions)} rungs published)")
+
+    # A previous attempt may have published every rung but failed before the last master upload
+    if not os.path.exists(os.path.join(hls_dir, f"{base_name}_master.m3u8")):
+        create_master_playlist(hls_dir, published, base_name, audio_group)
+        upload_master_playlist(minio, hls_dir, base_name)
+
+    for label, cfg in renditions.items():
+        if checkpoint.is_done(label, "mp4"):
+            continue
+        if label not in mp4_paths:
+            mp4_paths[label] = os.path.join(tmp_root, f"{base_name}_{label}.mp4")
+            logging.info(f"Creating {label} MP4 rendition...")
+            generate_mp4_rendition(src, mp4_paths[label], cfg["size"], cfg["bitrate"], has_audio, audio_file)
+
+        object_path = os.path.join(base_name, label, f"{label}.mp4")
+        logging.info(f"Uploading {label} MP4 -> {BUCKET}/{object_path}")
+        with stage("upload_mp4", rendition=label, bytes=os.path.getsize(mp4_paths[label])):
+            minio.fput_object(BUCKET, object_path, mp4_paths[label])
+        checkpoint.mark(label, "mp4")
+
+
+class _CountingReader:
+    """Read-only wrapper around ffmpeg's stdout that counts the bytes handed to put_object."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.raw.read(size)
+        self.bytes += len(data)
+        return data
+
+
+def stream_mp4_rendition(
+        minio: Minio, src: str, object_path: str, size: str, bitrate: str, has_audio: bool,
+        audio_file: str | None = None,
+) -> None:
+    """
+    Encode an MP4 rendition straight into a multipart upload, without a local file.
+
+    A pipe cannot be seeked back to write the moov atom, so the rendition is a
+    fragmented MP4; at most STREAM_PART_SIZE of it is held in memory.
+    """
+    width, height = map(int, size.split(":"))
+
+    input_stream = ffmpeg.input(src)
+    video = input_stream['v:0'].filter("scale", width, height)
+    if has_audio and audio_file:
+        streams = [video, ffmpeg.input(audio_file)['a:0']]
+    elif has_audio:
+        streams = [video, input_stream['a:0']]
+    else:
+        streams = [video]
+
+    args = _mp4_output_args(bitrate, has_audio, copy_audio=audio_file is not None)
+    args.update(format="mp4", movflags="frag_keyframe+empty_moov+default_base_moof")
+    process = ffmpeg.output(*streams, "pipe:1", **args).run_async(pipe_stdout=True, pipe_stderr=True)
+
+    # Drain stderr alongside, or ffmpeg blocks once the pipe buffer is full
+    stderr = []
+    reader = threading.Thread(target=lambda: stderr.append(process.stderr.read()), daemon=True)
+    reader.start()
+
+    logging.info(f"Streaming ffmpeg MP4 rendition -> {BUCKET}/{object_path}")
+    with stage("stream_mp4", size=size) as entry:
+        data = _CountingReader(process.stdout)
+        try:
+            minio.put_object(BUCKET, object_path, data, length=-1, part_size=STREAM_PART_SIZE, content_type="video/mp4")
+        except Exception:
+            process.kill()
+            raise
+        finally:
+            process.wait()
+            reader.join()
+        entry["bytes"] = data.bytes
+
+    err = stderr[0] if stderr else b""
+    if process.returncode != 0:
+        # ffmpeg closing its stdout early completes the upload with a truncated file
+        minio.remove_object(BUCKET, object_path)
+        logging.error(f"FFmpeg error: {err.decode('utf-8', 'replace')}")
+        raise ffmpeg.Error("ffmpeg", None, err)
+    logging.info(f"FFmpeg stderr (last 500 chars): {err.decode('utf-8', 'replace')[-500:]}")
+
+
+class _IngestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _read_body(self) -> bytes:
+        if "chunked" not in self.headers.get("Transfer-Encoding", ""):
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().split(b";")[0], 16)
+            if size == 0:
+                # Skip trailers up to the terminating empty line
+                while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                    pass
+                return b"".join(chunks)
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+
+    def do_PUT(self):
+        body = self._read_body()
+        try:
+            self.server.ingest.store(urlparse(self.path).path, body)
+            self.send_response(201)
+        except Exception as e:
+            logging.error(f"Could not store {self.path}: {e}")
+            self.server.ingest.record_failure(urlparse(self.path).path, e)
+            self.send_response(500)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    do_POST = do_PUT
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HlsIngestServer:
+    """
+    Local HTTP endpoint that ffmpeg's HLS muxer PUTs its playlists and segments to.
+
+    Pass url as the output directory of generate_hls_rendition / remux_hls_rendition.
+    Every file is held in memory only until it is stored under {base_name}/{label}/,
+    and ffmpeg gets its response after that, so a rendition playlist is never
+    stored before the segments it lists.
+
+    ffmpeg only warns about a failed upload and still exits 0, so failed stores
+    are recorded here and check() must be called after every ffmpeg run.
+    """
+
+    def __init__(self, minio: Minio, base_name: str):
+        self.minio = minio
+        self.base_name = base_name
+        self.bytes = 0
+        self._failures = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _IngestHandler)
+        self._server.daemon_threads = True
+        self._server.ingest = self
+        self.url = f"http://127.0.0.1:{self._server.server_port}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self) -> "HlsIngestServer":
+        self._thread.start()
+        return self
+
+    def store(self, path: str, body: bytes) -> None:
+        # Same names as in the scratch directory: {label}.m3u8, {label}_init.mp4, {label}_%03d.ts/.m4s
+        file = os.path.basename(path)
+        label = file[:-len(".m3u8")] if file.endswith(".m3u8") else file.split("_")[0]
+        object_path = os.path.join(self.base_name, label, file)
+        content_type = "application/vnd.apple.mpegurl" if file.endswith(".m3u8") else "application/octet-stream"
+        self.minio.put_object(BUCKET, object_path, io.BytesIO(body), len(body), content_type=content_type)
+        with self._lock:
+            self.bytes += len(body)
+            # ffmpeg retried the upload and this time it was stored
+            self._failures.pop(path, None)
+
+    def record_failure(self, path: str, error: Exception) -> None:
+        with self._lock:
+            self._failures[path] = str(error)
+
+    def check(self) -> None:
+        """Raise if a file ffmpeg uploaded since the last check could not be stored."""
+        with self._lock:
+            failures, self._failures = self._failures, {}
+        if failures:
+            path, error = next(iter(failures.items()))
+            raise RuntimeError(f"{len(failures)} HLS uploads could not be stored, e.g. {path}: {error}")
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def upload_master_text(minio: Minio, base_name: str, renditions: Dict[str, Dict], audio_group: bool) -> None:
+    """Upload a master playlist built in memory."""
+    body = master_playlist(renditions, audio_group).encode("utf-8")
+    object_path = os.path.join(base_name, "master.m3u8")
+    logging.info(f"Uploading master playlist -> {BUCKET}/{object_path}")
+    minio.put_object(
+        BUCKET, object_path, io.BytesIO(body), len(body), content_type="application/vnd.apple.mpegurl"
+    )
+
+
+def stream_ladder(
+        minio: Minio,
+        src: str,
+        base_name: str,
+        renditions: Dict[str, Dict],
+        video_info: Dict,
+        checkpoint: JobCheckpoint,
+        ingest: HlsIngestServer | None,
+        audio_file: str | None = None,
+) -> None:
+    """
+    Produce the ladder without scratch files, one rung at a time, lowest first.
+
+    MP4s are piped into multipart uploads. HLS rungs are encoded from the source,
+    or with HLS_PACKAGING=remux stream-copied from the uploaded MP4 through a
+    presigned URL, and written to the ingest server. With PROGRESSIVE_PUBLISH the
+    master playlist is updated after every rung, otherwise once at the end.
+    """
+    has_audio = video_info["has_audio"]
+    audio_group = ingest is not None and audio_file is not None
+    published = {}
+
+    for label, cfg in sorted(renditions.items(), key=lambda item: _rendition_height(item[1])):
+        object_path = os.path.join(base_name, label, f"{label}.mp4")
+        if not checkpoint.is_done(label, "mp4"):
+            logging.info(f"Creating {label} MP4 rendition...")
+            stream_mp4_rendition(minio, src, object_path, cfg["size"], cfg["bitrate"], has_audio, audio_file)
+            checkpoint.mark(label, "mp4")
+
+        if ingest is None:
+            continue
+        if not checkpoint.is_done(label, "hls"):
+            if HLS_PACKAGING == "remux":
+                url = minio.presigned_get_object(BUCKET, object_path, expires=timedelta(seconds=SOURCE_URL_EXPIRY))
+                remux_hls_rendition(url, ingest.url, label, video_only=audio_group)
+            else:
+                generate_hls_rendition(
+                    src, ingest.url, label, cfg["size"], cfg["bitrate"], has_audio and not audio_group
+                )
+            ingest.check()
+            checkpoint.mark(label, "hls")
+
+        published[label] = cfg
+        if PROGRESSIVE_PUBLISH:
+            upload_master_text(minio, base_name, published, audio_group)
+            logging.info(f"{label} is playable ({len(published)}/{len(renditions)} rungs published)")
+
+    if ingest is not None:
+        if not PROGRESSIVE_PUBLISH:
+            upload_master_text(minio, base_name, renditions, audio_group)
+        logging.info(f"Streamed {ingest.bytes} bytes of HLS output")
+
+
+def process_job(minio: Minio, job_id: str, object_key: str, renditions: Dict[str, Dict]) -> None:
+    """Transcode one source object into the rendition ladder and upload the results."""
+    logging.info(f"Starting transcoding job {job_id} for object {object_key}")
+
+    if DEDUP_ENABLED and not claim_job(minio, job_id):
+        return
+
     tmp_root = tempfile.mkdtemp()
-    original_file = os.path.join(tmp_root, os.path.basename(OBJECT_KEY))
+    uploader = None
+    ingest = None
+    source_lock = None
+    base_name = os.path.splitext(os.path.basename(object_key))[0]
+    content_key = None
+    report = JobReport(job_id, object_key)
+    report.document["outputs"] = {"prefix": base_name, "master": f"{base_name}/master.m3u8" if HLS_ENABLED else None}
+    status = "failed"
 
     try:
-        # Download original file
-        logging.info(f"Downloading {OBJECT_KEY} from bucket {BUCKET}...")
-        minio.fget_object(BUCKET, OBJECT_KEY, original_file)
-        logging.info("Download complete")
+        # Download original file (or stream it, depending on SOURCE_MODE)
+        if source_cache:
+            original_file, source_lock = source_cache.open(minio, object_key)
+        else:
+            original_file = open_source(minio, object_key, tmp_root)
+
+        # Identical source and settings processed before: copy the outputs server-side
+        if DEDUP_ENABLED:
+            content_key = dedup_key(hash_source(minio, object_key, original_file), renditions)
+            if reuse_outputs(minio, content_key, base_name):
+                complete_job(minio, job_id, content_key)
+                logging.info(f"Reused existing renditions for job {job_id}")
+                status = "reused"
+                return
 
         # Get video info and filter renditions
-        video_info = get_video_info(original_file)
+        video_info = get_video_info(original_file, minio, object_key)
+        report.document["source"] = video_info
         logging.info(
             f"Source video: {video_info['width']}x{video_info['height']}, "
             f"duration: {video_info['duration']}s, has_audio: {video_info['has_audio']}"
@@ -323,56 +1295,216 @@ def main():
 
         if not renditions:
             logging.warning("No suitable renditions after filtering by source resolution")
+            if DEDUP_ENABLED:
+                complete_job(minio, job_id, content_key)
+            status = "skipped"
             return
 
-        base_name = os.path.splitext(os.path.basename(OBJECT_KEY))[0]
-        base_object_path = os.path.splitext(OBJECT_KEY)[0]
+        report.document["renditions"] = list(renditions)
+        base_object_path = os.path.splitext(object_key)[0]
 
-        # Generate MP4 renditions
-        mp4_paths = []
-        for label, cfg in renditions.items():
-            out_file = os.path.join(tmp_root, f"{base_name}_{label}.mp4")
-            logging.info(f"Creating {label} MP4 rendition...")
-            generate_mp4_rendition(original_file, out_file, cfg["size"], cfg["bitrate"], video_info["has_audio"])
-            mp4_paths.append((label, out_file))
-            logging.info(f"{label} MP4 rendition saved to {out_file}")
-
-        # Upload MP4 renditions with new structure
-        for label, local_path in mp4_paths:
-            object_name = f"{label}.mp4"
-            object_path = os.path.join(base_name, label, object_name)
-            logging.info(f"Uploading {label} MP4 -> {BUCKET}/{object_path}")
-            minio.fput_object(BUCKET, object_path, local_path)
-            logging.info(f"{label} MP4 uploaded.")
-
-        # Generate HLS renditions if enabled
-        if HLS_ENABLED:
-            hls_dir = os.path.join(tmp_root, "hls")
+        # Rungs fully uploaded by an earlier attempt of this job are not produced again
+        checkpoint = JobCheckpoint(minio, job_id, object_key, base_name, renditions)
+        todo = {label: cfg for label, cfg in renditions.items() if not checkpoint.rung_done(label)}
+
+        # Single-decode and chunked ladders need their intermediate files
+        streaming = STREAMING_OUTPUT and not (SINGLE_DECODE or CHUNKED_ENCODING)
+        hls_dir = os.path.join(tmp_root, "hls")
+        if HLS_ENABLED and streaming:
+            ingest = HlsIngestServer(minio, base_name).start()
+        elif HLS_ENABLED:
             os.makedirs(hls_dir, exist_ok=True)
+            if PIPELINED_UPLOAD and not PROGRESSIVE_PUBLISH:
+                uploader = HlsSegmentUploader(minio, hls_dir, base_name, todo).start()
 
-            logging.info("Generating HLS renditions...")
-            for label, cfg in renditions.items():
-                generate_hls_rendition(
-                    original_file, hls_dir, label, cfg["size"], cfg["bitrate"], video_info["has_audio"]
-                )
+        # One audio track for all rungs; its HLS rendition goes up before any playlist references it
+        audio_file = None
+        if SHARED_AUDIO and video_info["has_audio"]:
+            audio_file = prepare_shared_audio(original_file, tmp_root, video_info)
+            if ingest:
+                remux_hls_rendition(audio_file, ingest.url, AUDIO_LABEL)
+                ingest.check()
+            elif HLS_ENABLED:
+                remux_hls_rendition(audio_file, hls_dir, AUDIO_LABEL)
+                upload_rendition_files(minio, hls_dir, base_name, AUDIO_LABEL)
+        audio_group = HLS_ENABLED and audio_file is not None
+
+        if streaming:
+            logging.info("Streaming renditions to MinIO without scratch files...")
+            stream_ladder(
+                minio, original_file, base_name, renditions, video_info, checkpoint, ingest, audio_file
+            )
+        elif PROGRESSIVE_PUBLISH and HLS_ENABLED:
+            logging.info("Publishing HLS renditions progressively, lowest rung first...")
+            publish_progressively(
+                minio, original_file, tmp_root, hls_dir, base_name, renditions, video_info, checkpoint, audio_file
+            )
+        else:
+            # Chunks are planned from the probed duration; chunked renditions are always packaged by remux
+            chunked = CHUNKED_ENCODING and video_info["duration"] > 0
+            encode_hls = HLS_ENABLED and HLS_PACKAGING != "remux" and not chunked
 
-            # Create master playlist
-            create_master_playlist(hls_dir, renditions, base_name)
+            # Rungs whose MP4 an earlier attempt uploaded are not encoded again
+            mp4_done = {label for label in todo if checkpoint.is_done(label, "mp4")}
+            encode = {label: cfg for label, cfg in todo.items() if label not in mp4_done}
 
-            # Upload all HLS files
-            upload_hls_files(minio, hls_dir, base_name, renditions)
-            logging.info("HLS renditions uploaded.")
+            # Generate MP4 renditions
+            if not todo:
+                mp4_paths = []
+            elif chunked:
+                logging.info("Creating all renditions with chunked parallel encoding...")
+                mp4_paths = generate_ladder_chunked(
+                    original_file,
+                    tmp_root,
+                    base_name,
+                    encode,
+                    video_info["has_audio"],
+                    video_info["duration"],
+                    audio_file=audio_file,
+                    frame_rate=video_info["frame_rate"],
+                ) if encode else []
+            elif SINGLE_DECODE:
+                # HLS encoded in the same pass: rungs that only miss their HLS still go through the ladder
+                ladder = todo if encode_hls else encode
+                logging.info("Creating all renditions from a single decode...")
+                mp4_paths = generate_ladder_single_decode(
+                    original_file,
+                    tmp_root,
+                    hls_dir if encode_hls else None,
+                    base_name,
+                    ladder,
+                    video_info["has_audio"],
+                    audio_file,
+                    skip_mp4=mp4_done,
+                ) if ladder else []
+            else:
+                mp4_paths = []
+                for label, cfg in encode.items():
+                    out_file = os.path.join(tmp_root, f"{base_name}_{label}.mp4")
+                    logging.info(f"Creating {label} MP4 rendition...")
+                    generate_mp4_rendition(
+                        original_file, out_file, cfg["size"], cfg["bitrate"], video_info["has_audio"], audio_file
+                    )
+                    logging.info(f"{label} MP4 rendition saved to {out_file}")
+                    mp4_paths.append((label, out_file))
+
+            # Only the HLS packaging is missing: fetch the MP4s instead of encoding them again
+            if HLS_ENABLED and not encode_hls:
+                mp4_paths += [(label, fetch_rendition_mp4(minio, tmp_root, base_name, label)) for label in mp4_done]
+
+            # Upload MP4 renditions with new structure
+            for label, local_path in mp4_paths:
+                if checkpoint.is_done(label, "mp4"):
+                    continue
+                object_name = f"{label}.mp4"
+                object_path = os.path.join(base_name, label, object_name)
+                logging.info(f"Uploading {label} MP4 -> {BUCKET}/{object_path}")
+                with stage("upload_mp4", rendition=label, bytes=os.path.getsize(local_path)):
+                    minio.fput_object(BUCKET, object_path, local_path)
+                checkpoint.mark(label, "mp4")
+                logging.info(f"{label} MP4 uploaded.")
+
+            # Generate HLS renditions if enabled
+            if HLS_ENABLED:
+                if not encode_hls:
+                    logging.info("Packaging HLS renditions from MP4 renditions...")
+                    for label, local_path in mp4_paths:
+                        remux_hls_rendition(local_path, hls_dir, label, video_only=audio_group)
+                elif not SINGLE_DECODE:
+                    logging.info("Generating HLS renditions...")
+                    for label, cfg in todo.items():
+                        generate_hls_rendition(
+                            original_file, hls_dir, label, cfg["size"], cfg["bitrate"],
+                            video_info["has_audio"] and not audio_group,
+                        )
+
+                # Create master playlist
+                create_master_playlist(hls_dir, renditions, base_name, audio_group)
+
+                # Upload all HLS files
+                if uploader:
+                    uploader.finish()
+                else:
+                    upload_hls_files(minio, hls_dir, base_name, todo)
+                for label in todo:
+                    checkpoint.mark(label, "hls")
+                logging.info("HLS renditions uploaded.")
 
-        logging.info(f"All renditions created successfully for job {JOB_ID}")
+        if DEDUP_ENABLED:
+            record_outputs(minio, content_key, base_name, list_outputs(minio, base_name, renditions))
+            complete_job(minio, job_id, content_key)
+        checkpoint.clear()
+        status = "ok"
+
+        logging.info(f"All renditions created successfully for job {job_id}")
 
     except Exception:
-        logging.exception(f"Job {JOB_ID} failed")
+        logging.exception(f"Job {job_id} failed")
+        if DEDUP_ENABLED:
+            release_job(minio, job_id)
         raise
     finally:
+        report.finish(minio, status)
+        if uploader:
+            uploader.close()
+        if ingest:
+            ingest.close()
+        if source_lock is not None:
+            SourceCache.release(source_lock)
         if os.path.exists(tmp_root):
             shutil.rmtree(tmp_root)
             logging.info("Cleaned up temporary files")
 
 
+def consume_jobs(minio: Minio, renditions: Dict[str, Dict]) -> None:
+    """
+    Take jobs directly from RabbitMQ until the worker is recycled or idle.
+
+    Used when the manager keeps a warm pool of workers: container start, imports
+    and MinIO readiness are paid once per worker instead of once per video.
+    """
+    def run_job(msg: Dict) -> None:
+        process_job(minio, str(msg["job_id"]), msg["object_key"], renditions)
+
+    # Retries are opt-in like in per-job mode; with CHECKPOINT_ENABLED the second attempt skips finished rungs
+    consume_queue(QUEUE, run_job, retry_failed=RETRY_FAILED_JOBS)
+
+
+def main():
+    logging.info(f"Enabled renditions: {ENABLED_RENDITIONS}")
+    logging.info(f"HLS enabled: {HLS_ENABLED}")
+    logging.info(f"HLS packaging: {HLS_PACKAGING} ({HLS_SEGMENT_TYPE})")
+    logging.info(f"Single decode: {SINGLE_DECODE}")
+    logging.info(f"Pipelined upload: {PIPELINED_UPLOAD} ({UPLOAD_CONCURRENCY} concurrent uploads)")
+    logging.info(f"Chunked encoding: {CHUNKED_ENCODING} ({CHUNK_DURATION}s chunks, {CHUNK_WORKERS} workers)")
+    logging.info(f"Progressive publish: {PROGRESSIVE_PUBLISH}")
+    logging.info(f"Shared audio: {SHARED_AUDIO}")
+    logging.info(f"Streaming output: {STREAMING_OUTPUT}")
+    if STREAMING_OUTPUT and (SINGLE_DECODE or CHUNKED_ENCODING):
+        logging.warning("Streaming output does not cover single-decode or chunked encoding, using scratch files")
+    logging.info(f"Job reports: {REPORTS_ENABLED}")
+    logging.info(f"Checkpointing: {CHECKPOINT_ENABLED}")
+
+    # Filter requested renditions
+    renditions = {
+        k: v for k, v in ALL_RENDITIONS.items() if k in ENABLED_RENDITIONS
+    }
+
+    if not renditions:
+        logging.error(f"No valid renditions found in: {ENABLED_RENDITIONS}")
+        sys.exit(1)
+
+    if WORKER_MODE == "consumer":
+        consume_jobs(wait_for_minio(), renditions)
+        return
+
+    if not JOB_ID or not OBJECT_KEY:
+        logging.error("Missing JOB_ID or OBJECT_KEY environment variables")
+        sys.exit(1)
+
+    minio = wait_for_minio()
+    process_job(minio, JOB_ID, OBJECT_KEY, renditions)
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,124 @@
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from queue import Empty
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+import ffmpeg  # noqa: E402
+
+# ------------------------------------------------------------------
+# Inputs: (label, duration in seconds)
+# ------------------------------------------------------------------
+INPUTS = [
+    ("10min", 10 * 60),
+    ("3h", 3 * 60 * 60),
+]
+
+
+def create_audio(path, duration):
+    """Generate a mono AAC test file of the given duration using ffmpeg lavfi."""
+    audio = ffmpeg.input(f"sine=frequency=440:sample_rate=48000:duration={duration}", format="lavfi")
+    ffmpeg.output(audio, path, acodec="aac", audio_bitrate="64k").overwrite_output().run(quiet=True)
+
+
+def _measure(mode, path, model_name, queue):
+    """Run one decode (or transcription) in a fresh process and report its peak RSS."""
+    import worker
+
+    start = time.monotonic()
+    if mode == "full":
+        audio = worker.whisper.load_audio(path)
+        samples = len(audio)
+        if model_name:
+            model, _ = worker.get_model(model_name)
+            model.transcribe(audio, verbose=None)
+    else:
+        samples = 0
+        if model_name:
+            model, lock = worker.get_model(model_name)
+            worker.transcribe_streaming(model, lock, path)
+        else:
+            window = worker.AUDIO_WINDOW_SECONDS * worker.SAMPLE_RATE
+            with worker.AudioStream(path) as stream:
+                while True:
+                    data = stream.read(window)
+                    if not len(data):
+                        break
+                    samples += len(data)
+
+    # ru_maxrss is reported in KiB on Linux
+    queue.put({
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "samples": samples,
+        "seconds": time.monotonic() - start,
+    })
+
+
+def wait_for_result(process, queue) -> dict:
+    """
+    Result the spawned process puts on queue.
+
+    A child that dies without a result (killed for running out of memory, a crash
+    in native code) is recorded as an error result instead of blocking forever.
+    """
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except Empty:
+            pass
+        if not process.is_alive():
+            # The result may have been put just before the child exited
+            try:
+                return queue.get(timeout=1)
+            except Empty:
+                return {"error": f"process died with exit code {process.exitcode}"}
+
+
+def measure(mode, path, model_name=None):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_measure, args=(mode, path, model_name, queue))
+    process.start()
+    result = wait_for_result(process, queue)
+    process.join()
+    return result
+
+
+def run_benchmark(model_name=None):
+    """
+    1. Generate 10-minute and 3-hour audio inputs
+    2. Decode each one fully (whisper.load_audio) and as a windowed AudioStream
+    3. Print the peak RSS of every run
+    """
+    what = f"transcription with {model_name}" if model_name else "audio decode"
+    print(f"Peak RSS for {what}")
+    print(f"{'input':<8}{'mode':<10}{'peak RSS':>12}{'samples':>14}{'time':>10}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for label, duration in INPUTS:
+            path = os.path.join(tmp_dir, f"{label}.m4a")
+            create_audio(path, duration)
+
+            for mode in ("full", "streaming"):
+                result = measure(mode, path, model_name)
+                if "error" in result:
+                    print(f"{label:<8}{mode:<10}  ERROR {result['error']}")
+                    continue
+                print(
+                    f"{label:<8}{mode:<10}{result['peak_rss_mb']:>9.1f} MB{result['samples']:>14}"
+                    f"{result['seconds']:>9.1f}s"
+                )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        print("Usage: python bench_audio_memory.py [whisper_model]")
+        print("Example: python bench_audio_memory.py tiny")
+        sys.exit(1)
+
+    run_benchmark(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,181 @@
+"""
+Compare the worker's Whisper inference backends on a fixed local audio set.
+
+Every audio/video file in the given directory is decoded once and then
+transcribed by each backend, each in a fresh process so model memory and
+torch/CTranslate2 thread pools do not leak between runs. Decoding is not
+timed; the real-time factor (RTF) is inference seconds per second of audio.
+
+Accuracy is the word error rate against {name}.txt reference transcripts
+next to the files, or against the first backend's output where a file has no
+reference.
+
+Usage:
+    python bench_whisper_backends.py audio_dir [--model small] [--threads 4]
+                                     [--backends openai,torch_int8,ctranslate2:int8]
+                                     [--language en]
+"""
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+import time
+from queue import Empty
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+EXTENSIONS = (".wav", ".mp3", ".m4a", ".aac", ".flac", ".ogg", ".opus", ".mp4", ".mkv", ".mov", ".webm")
+DEFAULT_BACKENDS = "openai,torch_int8,ctranslate2:int8"
+
+
+def _run_backend(backend, compute_type, model_name, threads, language, files, queue):
+    """Load the model for one backend and transcribe every file (runs in a spawned process)."""
+    os.environ.update(WHISPER_BACKEND=backend, THREADS=str(threads))
+    if compute_type:
+        os.environ["WHISPER_COMPUTE_TYPE"] = compute_type
+    import worker
+
+    if threads:
+        worker.torch.set_num_threads(threads)
+
+    start = time.monotonic()
+    model = worker.load_whisper(model_name, threads)
+    load_seconds = time.monotonic() - start
+
+    results = {}
+    for path in files:
+        audio = worker.whisper.load_audio(path)
+        start = time.monotonic()
+        result = model.transcribe(audio, verbose=None, language=language, task="transcribe")
+        results[path] = {
+            "seconds": time.monotonic() - start,
+            "audio_seconds": len(audio) / worker.SAMPLE_RATE,
+            "text": " ".join(segment["text"].strip() for segment in result["segments"]),
+        }
+    queue.put({"load_seconds": load_seconds, "results": results})
+
+
+def wait_for_result(process, queue) -> dict:
+    """
+    Result the spawned process puts on queue.
+
+    A child that dies without a result (killed for running out of memory, a crash
+    in native code) is recorded as an error result instead of blocking forever.
+    """
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except Empty:
+            pass
+        if not process.is_alive():
+            # The result may have been put just before the child exited
+            try:
+                return queue.get(timeout=1)
+            except Empty:
+                return {"error": f"process died with exit code {process.exitcode}"}
+
+
+def run_backend(backend, compute_type, model_name, threads, language, files):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(
+        target=_run_backend, args=(backend, compute_type, model_name, threads, language, files, queue)
+    )
+    process.start()
+    result = wait_for_result(process, queue)
+    process.join()
+    return result
+
+
+def words(text):
+    return re.findall(r"[\w']+", text.lower())
+
+
+def word_errors(reference, hypothesis):
+    """Word-level edit distance (substitutions + deletions + insertions)."""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_word != hyp_word),
+            ))
+        previous = current
+    return previous[-1]
+
+
+def run_benchmark(audio_dir, model_name, backends, threads, language):
+    """
+    1. Collect the audio set and its reference transcripts
+    2. Transcribe the set with every backend
+    3. Print load time, RTF, speedup over the first backend and WER per backend
+    """
+    files = sorted(
+        os.path.join(audio_dir, name) for name in os.listdir(audio_dir)
+        if name.lower().endswith(EXTENSIONS)
+    )
+    if not files:
+        print(f"No audio files in {audio_dir}")
+        sys.exit(1)
+
+    references = {}
+    for path in files:
+        reference = os.path.splitext(path)[0] + ".txt"
+        if os.path.isfile(reference):
+            with open(reference, encoding="utf-8") as f:
+                references[path] = words(f.read())
+    print(
+        f"{len(files)} files ({len(references)} with reference transcripts), "
+        f"model {model_name}, {threads or 'default'} threads"
+    )
+    print(f"{'backend':<24}{'load':>8}{'inference':>11}{'RTF':>8}{'speedup':>9}{'WER':>8}")
+
+    baseline_rtf = None
+    for spec in backends:
+        backend, _, compute_type = spec.partition(":")
+        result = run_backend(backend, compute_type, model_name, threads, language, files)
+        if "error" in result:
+            print(f"{spec:<24}  ERROR {result['error']}")
+            continue
+        load_seconds, results = result["load_seconds"], result["results"]
+
+        inference = sum(r["seconds"] for r in results.values())
+        rtf = inference / sum(r["audio_seconds"] for r in results.values())
+        if baseline_rtf is None:
+            baseline_rtf = rtf
+            for path in files:
+                references.setdefault(path, words(results[path]["text"]))
+
+        errors = sum(word_errors(references[path], words(results[path]["text"])) for path in files)
+        wer = errors / max(1, sum(len(references[path]) for path in files))
+        print(
+            f"{spec:<24}{load_seconds:>7.1f}s{inference:>10.1f}s{rtf:>8.3f}"
+            f"{baseline_rtf / rtf:>8.2f}x{wer:>8.1%}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare Whisper inference backends on local audio files")
+    parser.add_argument("audio_dir", help="directory with the audio set and optional {name}.txt references")
+    parser.add_argument("--model", default="small", help="Whisper model name")
+    parser.add_argument(
+        "--backends", default=DEFAULT_BACKENDS,
+        help="comma separated backend[:compute_type] list, the first one is the baseline",
+    )
+    parser.add_argument("--threads", type=int, default=0, help="CPU threads per backend (0: library default)")
+    parser.add_argument("--language", help="skip language detection, e.g. en")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.audio_dir):
+        print(f"{args.audio_dir} is not a directory")
+        sys.exit(1)
+
+    run_benchmark(args.audio_dir, args.model, args.backends.split(","), args.threads, args.language)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,80 @@
+import json
 import logging
+import math
+import multiprocessing
 import os
+import re
 import shutil
 import sys
 import tempfile
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Tuple
+from urllib.parse import urlparse
 
 import ffmpeg
+import numpy as np
+import torch
 import whisper
+from whisper.tokenizer import LANGUAGES, TO_LANGUAGE_CODE
 from minio import Minio
 
+import worker_common
+from worker_common import (
+    BUCKET, DEDUP_ENABLED, RETRY_FAILED_JOBS, JobReport, SourceCache, claim_job, complete_job, consume_queue,
+    hash_source, open_source, probe_source, record_outputs, release_job, reuse_outputs, source_cache, stage,
+    wait_for_minio,
+)
+
 # --- Config ---
-MINIO_EP = os.getenv("MINIO_ENDPOINT", "minio:9000")
-ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY", "minioadmin")
-SECRET_KEY = os.getenv("MINIO_SECRET_KEY", "minioadmin")
 JOB_ID = os.getenv("JOB_ID")
 OBJECT_KEY = os.getenv("OBJECT_KEY")
-BUCKET = "video"
+# Spoken language supplied by the uploader; Whisper's language detection is skipped when set
+JOB_LANGUAGE = os.getenv("JOB_LANGUAGE")
+
+# "job" processes JOB_ID/OBJECT_KEY once, "consumer" takes jobs from RabbitMQ (warm pool)
+WORKER_MODE = os.getenv("WORKER_MODE", "job").lower()
+QUEUE = "transcribe_jobs"
+
+# CPU threads granted by the manager (0 lets torch decide)
+THREADS = int(os.getenv("THREADS", "0"))
+
+# Whisper model, loaded once per worker process; jobs may request another size
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "small")
+WHISPER_MODEL_DIR = os.getenv("WHISPER_MODEL_DIR", "/app/models")
+# Concurrent jobs per consumer; with a shared model they share one copy of the weights
+TRANSCRIBE_CONCURRENCY = int(os.getenv("TRANSCRIBE_CONCURRENCY", "1"))
+WHISPER_SHARED_MODEL = os.getenv("WHISPER_SHARED_MODEL", "true").lower() == "true"
+# Inference backend: "openai" (whisper on PyTorch, full precision), "torch_int8" (the same model
+# with dynamically int8-quantized Linear layers, CPU only) or "ctranslate2" (faster-whisper with
+# WHISPER_COMPUTE_TYPE: int8, int8_float32, float32, ...)
+WHISPER_BACKEND = os.getenv("WHISPER_BACKEND", "openai").lower()
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+WHISPER_BACKENDS = ("openai", "torch_int8", "ctranslate2")
+
+# Voice-activity detection: skip silence and transcribe speech regions in parallel
+VAD_ENABLED = os.getenv("VAD_ENABLED", "false").lower() == "true"
+VAD_WORKERS = int(os.getenv("VAD_WORKERS", "2"))
+VAD_SILENCE_DB = int(os.getenv("VAD_SILENCE_DB", "-35"))
+VAD_MIN_SILENCE = float(os.getenv("VAD_MIN_SILENCE", "1.0"))
+VAD_PADDING = float(os.getenv("VAD_PADDING", "0.25"))
+VAD_MAX_REGION = float(os.getenv("VAD_MAX_REGION", "120"))
+# Shorter pauses are not region boundaries, but regions longer than VAD_MAX_REGION are split at one
+VAD_SPLIT_PAUSE = float(os.getenv("VAD_SPLIT_PAUSE", "0.2"))
+
+# Decode audio as a stream and transcribe it window by window (flat memory for long videos)
+AUDIO_STREAMING = os.getenv("AUDIO_STREAMING", "false").lower() == "true"
+AUDIO_WINDOW_SECONDS = int(os.getenv("AUDIO_WINDOW_SECONDS", "30"))
+
+# Audio pre-pass: sources without an audio track, or whose loudest sample stays below
+# SILENT_MAX_VOLUME_DB, are not transcribed at all. Opt-in: it decodes the audio track once more
+AUDIO_PREPASS = os.getenv("AUDIO_PREPASS", "false").lower() == "true"
+SILENT_MAX_VOLUME_DB = float(os.getenv("SILENT_MAX_VOLUME_DB", "-50"))
+
+PIPELINE = "subtitles"
+worker_common.set_pipeline(PIPELINE)
+
 
 # --- Logging ---
 logging.basicConfig(
@@ -25,26 +84,27 @@ logging.basicConfig(
 )
 
 
-def wait_for_minio(max_retries: int = 30, delay: int = 2) -> Minio:
-    """Wait for MinIO to be available with retries."""
-    client = Minio(MINIO_EP, ACCESS_KEY, SECRET_KEY, secure=False)
-
-    for attempt in range(max_retries):
-        try:
-            client.list_buckets()
-            logging.info("MinIO is ready")
-            return client
-        except Exception as e:
-            if attempt < max_retries - 1:
-                logging.warning(
-                    f"Waiting for MinIO at {MINIO_EP} "
-                    f"(attempt {attempt + 1}/{max_retries})..."
-                )
-                time.sleep(delay)
-            else:
-                raise RuntimeError(
-                    f"MinIO not available after {max_retries} attempts: {e}"
-                )
+def dedup_key(
+        source_hash: str, model_name: str, language: str | None = None,
+        backend: str = WHISPER_BACKEND, compute_type: str = WHISPER_COMPUTE_TYPE,
+) -> str:
+    """
+    Content key: the source hash plus the Whisper model, inference backend and compute
+    type (and forced language) that produced the subtitles.
+
+    Quantized backends produce slightly different text, so their subtitles are not
+    reused for jobs running another backend.
+    """
+    key = f"{source_hash}-{model_name}-{backend}-{compute_type}"
+    return key + (f"-{language}" if language else "")
+
+
+def list_outputs(minio: Minio, job_id: str) -> List[str]:
+    """Names of all uploaded subtitle objects, relative to the job prefix."""
+    return [
+        obj.object_name[len(job_id) + 1:]
+        for obj in minio.list_objects(BUCKET, prefix=f"{job_id}/subtitles/", recursive=True)
+    ]
 
 
 def format_timestamp(seconds):
@@ -69,108 +129,653 @@ def write_srt(segments, output_path):
             f.write(f"{text}\n\n")
 
 
-def run_whisper(input_file: str, output_dir: str) -> str:
-    """Run Whisper transcription using Python API and return path to generated SRT."""
-    try:
-        logging.info("Loading Whisper model (small)...")
-        model = whisper.load_model("small", download_root="/app/models")
-
-        # Transcribe
-        logging.info(f"Transcribing audio from {input_file}...")
-        result = model.transcribe(
-            input_file,
-            verbose=False,
-            language=None,
-            task="transcribe",
+SAMPLE_RATE = 16000
+_SILENCE_RE = re.compile(r"silence_(start|end): (-?[0-9.]+)")
+_MAX_VOLUME_RE = re.compile(r"max_volume: (-?[0-9.]+|-inf) dB")
+
+# ISO 639-2 codes (as found in container language tags) of languages Whisper knows, both B and T forms
+ISO_639_2 = {
+    "ara": "ar", "ces": "cs", "cze": "cs", "chi": "zh", "zho": "zh", "dan": "da", "deu": "de", "ger": "de",
+    "ell": "el", "gre": "el", "eng": "en", "fas": "fa", "per": "fa", "fin": "fi", "fra": "fr", "fre": "fr",
+    "heb": "he", "hin": "hi", "hun": "hu", "ind": "id", "ita": "it", "jpn": "ja", "kor": "ko", "nld": "nl",
+    "dut": "nl", "nor": "no", "pol": "pl", "por": "pt", "ron": "ro", "rum": "ro", "rus": "ru", "slk": "sk",
+    "slo": "sk", "spa": "es", "swe": "sv", "tha": "th", "tur": "tr", "ukr": "uk", "vie": "vi",
+}
+
+
+def whisper_language(value: str | None) -> str | None:
+    """Whisper language code for a language name, ISO 639-1 or ISO 639-2 code; None if unknown ("und")."""
+    if not value:
+        return None
+    value = value.strip().lower().replace("_", "-").split("-")[0]
+    if value in LANGUAGES:
+        return value
+    return TO_LANGUAGE_CODE.get(value) or ISO_639_2.get(value)
+
+
+def audio_prepass(src: str, probe: Dict) -> Dict:
+    """
+    Cheap look at the audio before Whisper runs: is there a track, how loud is it, is its language tagged.
+
+    The track is found like the Resolution worker's get_video_info does (first
+    audio stream of the probe); volumedetect decodes only that stream, which is
+    a small fraction of the cost of transcribing it.
+    """
+    audio_stream = next((s for s in probe.get("streams", []) if s.get("codec_type") == "audio"), None)
+    info = {"has_audio": audio_stream is not None, "silent": True, "max_volume": None, "language": None}
+    if audio_stream is None:
+        return info
+
+    info["language"] = whisper_language(
+        (audio_stream.get("tags") or {}).get("language") or (probe["format"].get("tags") or {}).get("language")
+    )
+    _, err = (
+        ffmpeg.input(src)
+        .output("-", format="null", map="0:a:0", af="volumedetect")
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+    match = _MAX_VOLUME_RE.search(err.decode("utf-8", errors="replace"))
+    max_volume = float(match.group(1)) if match else None
+    # -inf is digital silence; it is kept out of the report, which must stay valid JSON
+    info["max_volume"] = max_volume if max_volume is not None and math.isfinite(max_volume) else None
+    info["silent"] = max_volume is not None and max_volume < SILENT_MAX_VOLUME_DB
+    return info
+
+
+def detect_speech_regions(input_file: str, duration: float) -> List[Tuple[float, float]]:
+    """
+    Find the non-silent regions of the audio track with ffmpeg's silencedetect.
+
+    duration is the source's probed duration (from the probe sidecar), which
+    closes a trailing silence and bounds the last region.
+
+    Regions are padded by VAD_PADDING, merged when they overlap and then packed
+    into (start, end) tasks of at most VAD_MAX_REGION seconds. Longer regions are
+    split at a pause between words (see split_point), not at a fixed offset.
+    """
+    min_pause = min(VAD_SPLIT_PAUSE, VAD_MIN_SILENCE)
+    _, err = (
+        ffmpeg.input(input_file)
+        .output("-", format="null", vn=None, af=f"silencedetect=noise={VAD_SILENCE_DB}dB:d={min_pause}")
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+
+    silences = []
+    silence_start = None
+    for kind, value in _SILENCE_RE.findall(err.decode("utf-8", errors="replace")):
+        if kind == "start":
+            silence_start = float(value)
+        elif silence_start is not None:
+            silences.append((silence_start, float(value)))
+            silence_start = None
+    if silence_start is not None:
+        silences.append((silence_start, duration))
+
+    # Speech is everything between the end of one long silence and the start of the next;
+    # the short pauses inside it are only used as split points
+    regions, pauses = [], []
+    speech_start = 0.0
+    for start, end in silences:
+        if end - start < VAD_MIN_SILENCE:
+            pauses.append((start, end))
+            continue
+        regions.append((speech_start, start))
+        speech_start = end
+    if speech_start < duration:
+        regions.append((speech_start, duration))
+
+    merged = []
+    for start, end in regions:
+        start, end = max(0.0, start - VAD_PADDING), min(duration, end + VAD_PADDING)
+        if end - start <= 2 * VAD_PADDING:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    # Pack regions separated by short pauses together and split long ones, so every task is a useful size
+    tasks = []
+    for start, end in merged:
+        if tasks and end - tasks[-1][0] <= VAD_MAX_REGION and start - tasks[-1][1] < VAD_MIN_SILENCE * 4:
+            tasks[-1] = (tasks[-1][0], end)
+            continue
+        while end - start > VAD_MAX_REGION:
+            cut = split_point(pauses, start, start + VAD_MAX_REGION)
+            tasks.append((start, cut))
+            start = cut
+        tasks.append((start, end))
+    return tasks
+
+
+def split_point(pauses: List[Tuple[float, float]], start: float, limit: float) -> float:
+    """
+    Where to split a region that runs past limit: the middle of the longest pause in
+    the second half of [start, limit], or limit itself when the speech never pauses.
+
+    silencedetect only reports pauses below VAD_SILENCE_DB, so the longest one is the
+    quietest stretch it can vouch for.
+    """
+    middle = start + (limit - start) / 2
+    candidates = [
+        (end - begin, (begin + end) / 2) for begin, end in pauses if middle < (begin + end) / 2 <= limit
+    ]
+    return max(candidates)[1] if candidates else limit
+
+
+def load_audio_region(input_file: str, start: float, duration: float) -> np.ndarray:
+    """Decode part of the audio track to 16 kHz mono float32, like whisper.load_audio."""
+    out, _ = (
+        ffmpeg.input(input_file, ss=start, t=duration, threads=0)
+        .output("-", format="s16le", acodec="pcm_s16le", ac=1, ar=SAMPLE_RATE)
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+    return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+
+
+class AudioStream:
+    """
+    16 kHz mono float32 audio decoded by ffmpeg and read incrementally from its stdout.
+
+    Unlike whisper.load_audio, the decoded track is never held in memory as a
+    whole; only the samples returned by read() are.
+    """
+
+    def __init__(self, input_file: str):
+        self.process = (
+            ffmpeg.input(input_file, threads=0)
+            .output("-", format="f32le", acodec="pcm_f32le", ac=1, ar=SAMPLE_RATE)
+            .global_args("-nostdin", "-loglevel", "error")
+            .run_async(pipe_stdout=True)
         )
 
+    def read(self, samples: int) -> np.ndarray:
+        """Return up to `samples` samples; an empty array means the end of the stream."""
+        data = self.process.stdout.read(samples * 4)
+        return np.frombuffer(data[:len(data) // 4 * 4], np.float32)
+
+    def __enter__(self) -> "AudioStream":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self.process.kill()
+        self.process.stdout.close()
+        if self.process.wait() != 0 and exc_type is None:
+            raise RuntimeError(f"ffmpeg failed to decode audio (exit code {self.process.returncode})")
+
+
+def transcribe_streaming(
+        model: whisper.Whisper, model_lock: threading.Lock, input_file: str, language: str | None = None
+) -> Dict:
+    """
+    Transcribe the input in AUDIO_WINDOW_SECONDS windows read from an AudioStream.
+
+    Peak memory stays flat whatever the video length. The last segment of a
+    window may be cut off, so it is dropped and the next window starts at its
+    beginning (the same way whisper seeks between its own 30 second windows).
+    The tail of each window's text is passed on as the prompt of the next one.
+    Without a language, the one detected in the first window is used for the rest.
+    """
+    window_samples = AUDIO_WINDOW_SECONDS * SAMPLE_RATE
+    buffer = np.zeros(0, dtype=np.float32)
+    offset = 0.0
+    prompt = None
+    segments = []
+
+    with AudioStream(input_file) as stream:
+        eof = False
+        while True:
+            if not eof and len(buffer) < window_samples:
+                data = stream.read(window_samples - len(buffer))
+                eof = len(data) < window_samples - len(buffer)
+                buffer = np.concatenate([buffer, data])
+            if not len(buffer):
+                break
+
+            with model_lock:
+                result = model.transcribe(
+                    buffer,
+                    verbose=None,
+                    language=language,
+                    task="transcribe",
+                    initial_prompt=prompt,
+                )
+            language = language or result.get("language")
+
+            window_segments = result["segments"]
+            consumed = len(buffer)
+            if not eof and len(window_segments) > 1:
+                cut = int(window_segments[-1]["start"] * SAMPLE_RATE)
+                if 0 < cut < len(buffer):
+                    window_segments = window_segments[:-1]
+                    consumed = cut
+
+            for segment in window_segments:
+                segments.append({
+                    "start": segment["start"] + offset,
+                    "end": segment["end"] + offset,
+                    "text": segment["text"],
+                })
+            if window_segments:
+                prompt = " ".join(segment["text"].strip() for segment in window_segments)[-200:]
+
+            buffer = buffer[consumed:].copy()
+            offset += consumed / SAMPLE_RATE
+
+    return {"segments": segments, "language": language}
+
+
+class CTranslate2Whisper:
+    """
+    faster-whisper (CTranslate2) model behind whisper's transcribe() interface.
+
+    Model names are whisper's ("small", "medium", ...); the converted weights are
+    looked up in WHISPER_MODEL_DIR/ctranslate2. Decoding is greedy like whisper's
+    transcribe() defaults, so both backends produce comparable output.
+    """
+
+    def __init__(self, name: str, threads: int = 0):
+        # Imported here so the other backends never load CTranslate2
+        from faster_whisper import WhisperModel
+
+        self.model = WhisperModel(
+            name,
+            device="cpu",
+            compute_type=WHISPER_COMPUTE_TYPE,
+            cpu_threads=threads,
+            download_root=os.path.join(WHISPER_MODEL_DIR, "ctranslate2"),
+        )
+
+    def transcribe(self, audio, verbose=None, language=None, task="transcribe", initial_prompt=None) -> Dict:
+        segments, info = self.model.transcribe(
+            audio, language=language, task=task, initial_prompt=initial_prompt, beam_size=1
+        )
+        # segments is a generator: the audio is only decoded while it is consumed
+        return {
+            "segments": [{"start": s.start, "end": s.end, "text": s.text} for s in segments],
+            "language": info.language,
+        }
+
+    def detect_language(self, audio) -> str:
+        # transcribe() detects the language eagerly; the segments generator is never consumed
+        _, info = self.model.transcribe(audio, beam_size=1)
+        return info.language
+
+
+def quantize_int8(model: whisper.Whisper) -> whisper.Whisper:
+    """
+    Dynamic int8 quantization of the model's Linear layers (attention projections and MLPs).
+
+    Weights are stored as int8 and activations quantized on the fly; convolutions,
+    embeddings and layer norms stay float32.
+    """
+    # whisper's Linear only adds an fp16 cast, but quantize_dynamic matches exact module types
+    for module in model.modules():
+        if type(module) is whisper.model.Linear:
+            module.__class__ = torch.nn.Linear
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def load_whisper(name: str, threads: int = THREADS):
+    """
+    Load a model for WHISPER_BACKEND.
+
+    Every backend's model has whisper's transcribe() signature and result shape
+    (segments with start, end and text, and the language), so the transcription
+    modes do not depend on the backend.
+    """
+    if WHISPER_BACKEND == "ctranslate2":
+        return CTranslate2Whisper(name, threads)
+    if WHISPER_BACKEND == "torch_int8":
+        return quantize_int8(whisper.load_model(name, device="cpu", download_root=WHISPER_MODEL_DIR))
+    return whisper.load_model(name, download_root=WHISPER_MODEL_DIR)
+
+
+_region_model = None
+_region_pools: Dict[str, ProcessPoolExecutor] = {}
+_region_pools_lock = threading.Lock()
+
+
+def _init_region_worker(model_name: str, threads: int) -> None:
+    """Load the model once per pool process; the pool outlives single jobs in consumer mode."""
+    global _region_model
+    torch.set_num_threads(threads)
+    _region_model = load_whisper(model_name, threads)
+
+
+def detect_language(model, audio: np.ndarray) -> str:
+    """Detect the spoken language from the first 30 seconds of audio, like whisper's transcribe()."""
+    if isinstance(model, CTranslate2Whisper):
+        return model.detect_language(audio)
+    mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), model.dims.n_mels).to(model.device)
+    _, probs = model.detect_language(mel)
+    return max(probs, key=probs.get)
+
+
+def _detect_region_language(input_file: str, start: float, end: float) -> str:
+    """Detect the language of one speech region (runs inside the process pool)."""
+    audio = load_audio_region(input_file, start, min(end - start, whisper.audio.CHUNK_LENGTH))
+    return detect_language(_region_model, audio)
+
+
+def _transcribe_region(input_file: str, start: float, end: float, language: str) -> List[Dict]:
+    """Transcribe one speech region (runs inside the process pool) with source timestamps."""
+    audio = load_audio_region(input_file, start, end - start)
+    result = _region_model.transcribe(audio, verbose=None, language=language, task="transcribe")
+
+    return [
+        {"start": segment["start"] + start, "end": segment["end"] + start, "text": segment["text"]}
+        for segment in result["segments"]
+    ]
+
+
+def _get_region_pool(model_name: str) -> ProcessPoolExecutor:
+    """Return the process pool for a model, started on first use and kept for later jobs."""
+    with _region_pools_lock:
+        if model_name not in _region_pools:
+            threads = max(1, (THREADS or os.cpu_count() or 1) // VAD_WORKERS)
+            logging.info(f"Starting {VAD_WORKERS} transcription processes for model {model_name}")
+            # spawn: forking a process that already runs torch threads can deadlock
+            _region_pools[model_name] = ProcessPoolExecutor(
+                max_workers=VAD_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_region_worker,
+                initargs=(model_name, threads),
+            )
+        return _region_pools[model_name]
+
+
+def transcribe_speech_regions(
+        input_file: str, duration: float, model_name: str, language: str | None = None
+) -> Dict:
+    """
+    Transcribe only the speech regions of the input, in parallel across a process pool.
+
+    Returns a dict shaped like whisper's transcribe() result: the segments of all
+    regions in source order, and their language. Without a language it is detected
+    once, on the longest region, and every region is transcribed in it.
+    """
+    regions = detect_speech_regions(input_file, duration)
+    speech = sum(end - start for start, end in regions)
+    logging.info(f"VAD found {len(regions)} speech regions ({speech:.1f}s of speech)")
+    if not regions:
+        return {"segments": [], "language": language}
+
+    pool = _get_region_pool(model_name)
+    if language is None:
+        start, end = max(regions, key=lambda region: region[1] - region[0])
+        language = pool.submit(_detect_region_language, input_file, start, end).result()
+        logging.info(f"Detected language {language} on the speech region at {start:.1f}s")
+
+    futures = [pool.submit(_transcribe_region, input_file, start, end, language) for start, end in regions]
+    segments = []
+    for future in as_completed(futures):
+        segments.extend(future.result())
+
+    segments.sort(key=lambda segment: segment["start"])
+    return {"segments": segments, "language": language}
+
+
+_shared_models: Dict[str, Tuple[whisper.Whisper, threading.Lock]] = {}
+_shared_models_lock = threading.Lock()
+_thread_models = threading.local()
+
+
+def _load_model(name: str) -> Tuple[whisper.Whisper, threading.Lock]:
+    logging.info(f"Loading Whisper model ({name}, {WHISPER_BACKEND} backend)...")
+    with stage("whisper_load", model=name, backend=WHISPER_BACKEND):
+        return load_whisper(name), threading.Lock()
+
+
+def get_model(name: str) -> Tuple[whisper.Whisper, threading.Lock]:
+    """
+    Return a resident Whisper model and the lock guarding its inference.
+
+    Models are loaded on first use and kept for the lifetime of the worker.
+    A shared model is used by every job thread; whisper installs its KV-cache
+    hooks on the model itself, so inference on a shared model is serialized
+    while download, audio decoding and upload of other jobs keep running.
+    Without WHISPER_SHARED_MODEL each job thread loads its own copy.
+    """
+    if WHISPER_SHARED_MODEL:
+        with _shared_models_lock:
+            if name not in _shared_models:
+                _shared_models[name] = _load_model(name)
+            return _shared_models[name]
+
+    models = getattr(_thread_models, "models", None)
+    if models is None:
+        models = _thread_models.models = {}
+    if name not in models:
+        models[name] = _load_model(name)
+    return models[name]
+
+
+def write_subtitles_playlist(vtt_name: str, duration: float, output_path: str) -> None:
+    """Write a single-segment HLS playlist that references a WebVTT file."""
+    target_duration = max(1, math.ceil(duration))
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write("#EXTM3U\n")
+        f.write("#EXT-X-VERSION:3\n")
+        f.write(f"#EXT-X-TARGETDURATION:{target_duration}\n")
+        f.write("#EXT-X-MEDIA-SEQUENCE:0\n")
+        f.write("#EXT-X-PLAYLIST-TYPE:VOD\n")
+        f.write(f"#EXTINF:{duration:.3f},\n")
+        f.write(f"{vtt_name}\n")
+        f.write("#EXT-X-ENDLIST\n")
+
+
+def run_whisper(
+        input_file: str, output_dir: str, duration: float, model_name: str = WHISPER_MODEL,
+        language: str | None = None,
+) -> Tuple[str, str | None]:
+    """
+    Run Whisper transcription using Python API and return the generated SRT and its language.
+
+    With a known language Whisper skips its language detection pass. duration is
+    the probed duration of the input, used by the VAD mode.
+    """
+    try:
+        if VAD_ENABLED:
+            logging.info(f"Transcribing speech regions with Whisper model ({model_name})...")
+            result = transcribe_speech_regions(input_file, duration, model_name, language)
+        elif AUDIO_STREAMING:
+            model, model_lock = get_model(model_name)
+            logging.info(
+                f"Transcribing audio stream in {AUDIO_WINDOW_SECONDS}s windows "
+                f"with Whisper model ({model_name})..."
+            )
+            result = transcribe_streaming(model, model_lock, input_file, language)
+        else:
+            model, model_lock = get_model(model_name)
+
+            logging.info(f"Decoding audio from {input_file}...")
+            audio = whisper.load_audio(input_file)
+
+            # Transcribe
+            logging.info(f"Transcribing audio with Whisper model ({model_name})...")
+            with model_lock:
+                result = model.transcribe(
+                    audio,
+                    verbose=False,
+                    language=language,
+                    task="transcribe",
+                )
+
         # Generate SRT file
-        stem = os.path.splitext(os.path.basename(input_file))[0]
+        stem = os.path.splitext(os.path.basename(urlparse(input_file).path))[0]
         srt_path = os.path.join(output_dir, f"{stem}.srt")
 
         logging.info(f"Writing SRT to {srt_path}...")
         write_srt(result["segments"], srt_path)
 
-        logging.info(f"Transcription complete. Detected language: {result.get('language', 'unknown')}")
-        return srt_path, result.get('language')
+        language = language or result.get("language")
+        logging.info(f"Transcription complete. Language: {language or 'unknown'}")
+        return srt_path, language
 
     except Exception as e:
         logging.error(f"Whisper transcription failed: {e}")
         raise
 
 
-def main():
-    if not JOB_ID or not OBJECT_KEY:
-        logging.error("Missing JOB_ID or OBJECT_KEY environment variables")
-        sys.exit(1)
+def process_job(
+        minio: Minio, job_id: str, object_key: str, model_name: str = WHISPER_MODEL, language: str | None = None
+) -> None:
+    """
+    Transcribe one source object and upload the subtitles.
 
-    logging.info(f"Starting transcription for job {JOB_ID}, object {OBJECT_KEY}")
-    minio = wait_for_minio()
+    language is the spoken language supplied with the job (the uploader's
+    choice); it takes precedence over the language tag of the audio track.
+    """
+    logging.info(f"Starting transcription for job {job_id}, object {object_key}")
+    language = whisper_language(language)
+
+    if DEDUP_ENABLED and not claim_job(minio, job_id):
+        return
 
     tmp_dir = tempfile.mkdtemp()
-    local_in = os.path.join(tmp_dir, os.path.basename(OBJECT_KEY))
-    local_srt = os.path.join(tmp_dir, f"{JOB_ID}.srt")
-    local_vtt = os.path.join(tmp_dir, f"{JOB_ID}.vtt")
+    local_srt = os.path.join(tmp_dir, f"{job_id}.srt")
+    local_vtt = os.path.join(tmp_dir, f"{job_id}.vtt")
+    local_subs_m3u8 = os.path.join(tmp_dir, f"{job_id}.m3u8")
+    content_key = None
+    source_lock = None
+    report = JobReport(job_id, object_key)
+    status = "failed"
 
     try:
-        logging.info(f"Downloading {OBJECT_KEY} from bucket {BUCKET}...")
-        minio.fget_object(BUCKET, OBJECT_KEY, local_in)
-        logging.info(f"Downloaded to {local_in}")
+        if source_cache:
+            local_in, source_lock = source_cache.open(minio, object_key)
+        else:
+            local_in = open_source(minio, object_key, tmp_dir)
+
+        # Identical source transcribed before with the same model: copy the subtitles server-side
+        if DEDUP_ENABLED:
+            content_key = dedup_key(hash_source(minio, object_key, local_in), model_name, language)
+            if reuse_outputs(minio, content_key, job_id):
+                complete_job(minio, job_id, content_key)
+                playlists = [name for name in list_outputs(minio, job_id) if name.endswith(".m3u8")]
+                if playlists:
+                    report.document["outputs"] = {
+                        "prefix": f"{job_id}/subtitles",
+                        "language": playlists[0][len("subtitles/subs_"):-len(".m3u8")],
+                        "playlist": f"{job_id}/{playlists[0]}",
+                    }
+                logging.info(f"Reused existing subtitles for job {job_id}")
+                status = "reused"
+                return
 
-        logging.info("Running Whisper transcription...")
-        generated_srt, language = run_whisper(local_in, tmp_dir)
+        with stage("probe"):
+            probe = probe_source(minio, object_key, local_in)
+        duration = float(probe["format"].get("duration", 0))
+        report.document["duration"] = duration
+
+        if AUDIO_PREPASS:
+            with stage("audio_prepass") as prepass:
+                prepass.update(audio_prepass(local_in, probe))
+            if prepass["silent"]:
+                logging.info(
+                    f"Source of job {job_id} has no audible audio "
+                    f"(audio track: {prepass['has_audio']}, max volume: {prepass['max_volume']} dB), "
+                    f"skipping transcription"
+                )
+                if DEDUP_ENABLED:
+                    complete_job(minio, job_id, content_key)
+                status = "skipped"
+                return
+            language = language or prepass["language"]
+
+        logging.info(f"Running Whisper transcription (language: {language or 'auto-detect'})...")
+        mode = "vad" if VAD_ENABLED else "streaming" if AUDIO_STREAMING else "full"
+        with stage(
+                "transcribe", model=model_name, backend=WHISPER_BACKEND, mode=mode, language=language
+        ) as transcribe:
+            generated_srt, language = run_whisper(local_in, tmp_dir, duration, model_name, language)
+        # Real-time factor: seconds of compute per second of audio (model load included on first use)
+        if duration:
+            transcribe["rtf"] = round(transcribe["seconds"] / duration, 4)
+            logging.info(f"Transcription real-time factor: {transcribe['rtf']}")
 
         shutil.move(generated_srt, local_srt)
 
         logging.info("Converting SRT to WebVTT...")
-        ffmpeg.input(local_srt).output(local_vtt, format="webvtt").run(quiet=True, overwrite_output=True)
+        with stage("convert_vtt"):
+            ffmpeg.input(local_srt).output(local_vtt, format="webvtt").run(quiet=True, overwrite_output=True)
         logging.info(f"VTT file prepared at {local_vtt}")
 
-        subs_prefix = f"{JOB_ID}/subtitles"
-        minio.fput_object(BUCKET, f"{subs_prefix}/subs_{language}.vtt", local_vtt)
-        minio.fput_object(BUCKET, f"{subs_prefix}/subs_{language}.m3u8", local_subs_m3u8)
+        write_subtitles_playlist(f"subs_{language}.vtt", duration, local_subs_m3u8)
+
+        subs_prefix = f"{job_id}/subtitles"
+        with stage("upload", bytes=os.path.getsize(local_vtt) + os.path.getsize(local_subs_m3u8)):
+            minio.fput_object(BUCKET, f"{subs_prefix}/subs_{language}.vtt", local_vtt)
+            minio.fput_object(BUCKET, f"{subs_prefix}/subs_{language}.m3u8", local_subs_m3u8)
         logging.info("Uploaded VTT and subtitles playlist to MinIO")
+        report.document["outputs"] = {
+            "prefix": subs_prefix,
+            "language": language,
+            "playlist": f"{subs_prefix}/subs_{language}.m3u8",
+        }
 
-    # master_local = os.path.join(tmp_dir, "master.m3u8")
-    # master_key = f"{JOB_ID}/master.m3u8"
-    # while True:
-    #	try:
-    #		minio.fget_object(BUCKET, master_key, master_local)
-    #		logging.info("Downloaded existing master.m3u8")
-    #		break
-    #	except Exception:
-    #		pass
-    #
-    # subtitle_entry = (
-    #	'#EXT-X-MEDIA:TYPE=SUBTITLES,GROUP-ID="subs",NAME="{language}",'
-    #	'DEFAULT=YES,AUTOSELECT=YES,LANGUAGE="{language}",'
-    #	f'URI="subtitles/subs_en.m3u8"\n'
-    # )
-    #
-    # with open(master_local, "r+", encoding="utf-8") as f:
-    #	content = f.read()
-    #	if "TYPE=SUBTITLES" not in content:
-    #		idx = content.find("#EXT-X-STREAM-INF")
-    #		if idx != -1:
-    #			content = content[:idx] + subtitle_entry + content[idx:]
-    #		else:
-    #			content += subtitle_entry
-    #		f.seek(0)
-    #		f.write(content)
-    #		f.truncate()
-    #		logging.info("Added subtitles entry to master.m3u8")
-    #
-    # minio.fput_object(BUCKET, master_key, master_local)
-    # logging.info(f"Uploaded updated master.m3u8 to {BUCKET}/{master_key}")
+        if DEDUP_ENABLED:
+            record_outputs(minio, content_key, job_id, list_outputs(minio, job_id))
+            complete_job(minio, job_id, content_key)
+        status = "ok"
 
     except Exception:
-        logging.exception(f"Job {JOB_ID} failed")
-        sys.exit(1)
+        logging.exception(f"Job {job_id} failed")
+        if DEDUP_ENABLED:
+            release_job(minio, job_id)
+        raise
     finally:
+        report.finish(minio, status)
+        if source_lock is not None:
+            SourceCache.release(source_lock)
         if os.path.exists(tmp_dir):
             shutil.rmtree(tmp_dir)
             logging.info("Cleaned up temporary files")
 
 
+def consume_jobs(minio: Minio) -> None:
+    """
+    Take jobs directly from RabbitMQ until the worker is recycled or idle.
+
+    Used when the manager keeps a warm pool of workers: container start, imports,
+    MinIO readiness and the Whisper model load are paid once per worker instead of
+    once per video. Up to TRANSCRIBE_CONCURRENCY jobs run at the same time, and a
+    job is acked only after it finished.
+    """
+    get_model(WHISPER_MODEL)
+
+    def run_job(msg: Dict) -> None:
+        process_job(
+            minio, str(msg["job_id"]), msg["object_key"], msg.get("model") or WHISPER_MODEL, msg.get("language")
+        )
+
+    consume_queue(QUEUE, run_job, TRANSCRIBE_CONCURRENCY, retry_failed=RETRY_FAILED_JOBS)
+
+
+def main():
+    if THREADS:
+        torch.set_num_threads(THREADS)
+
+    if WHISPER_BACKEND not in WHISPER_BACKENDS:
+        logging.error(f"Unknown WHISPER_BACKEND {WHISPER_BACKEND}, expected one of {', '.join(WHISPER_BACKENDS)}")
+        sys.exit(1)
+
+    if WORKER_MODE == "consumer":
+        consume_jobs(wait_for_minio())
+        return
+
+    if not JOB_ID or not OBJECT_KEY:
+        logging.error("Missing JOB_ID or OBJECT_KEY environment variables")
+        sys.exit(1)
+
+    minio = wait_for_minio()
+    try:
+        process_job(minio, JOB_ID, OBJECT_KEY, language=JOB_LANGUAGE)
+    except Exception:
+        sys.exit(1)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,425 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import signal
+import sys
+import threading
+import time
+
+import aio_pika
+import docker
+from prometheus_client import start_http_server
+
+from manager_common import (
+    CONTAINER_START,
+    CPU_BUDGET,
+    JOB_DURATION,
+    JOBS,
+    JOBS_RUNNING,
+    JOBS_WAITING,
+    MEMORY_BUDGET,
+    METRICS_PORT,
+    PREFETCH_COUNT,
+    QUEUE_WAIT,
+    RABBIT_HOST,
+    RABBIT_PASS,
+    RABBIT_PORT,
+    RABBIT_USER,
+    SCHEDULING_POLICY,
+    SJF_AGING,
+    cache_volumes,
+    job_cost,
+    parse_size,
+    worker_env,
+)
+
+# --- Configuration ---
+# Queues driven by this manager; both pipelines share one CPU/memory budget
+QUEUES = [q.strip() for q in os.getenv("QUEUES", "resolution_jobs,transcribe_jobs").split(",") if q.strip()]
+
+# CPU/memory budget, prefetch, SJF and metrics settings are read by manager_common
+# How many containers.run calls may be in flight at once (image pulls, slow daemon)
+DISPATCH_CONCURRENCY = int(os.getenv("DISPATCH_CONCURRENCY", "4"))
+# Fallback reconciliation in case the Docker event stream misses an exit
+RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", "30"))
+
+# Jobs that fit may start ahead of the next job in order that does not (e.g. resolution jobs next to a
+# waiting transcription job), until that job has waited this long; then the budget is kept free for it
+BACKFILL_MAX_WAIT = float(os.getenv("BACKFILL_MAX_WAIT", "600"))
+
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "small")
+WHISPER_BACKEND = os.getenv("WHISPER_BACKEND", "openai")
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+JOB_LABEL = "myfairpipe.job"
+
+# Per-queue worker settings, same defaults as the single-queue managers
+PIPELINES = {
+    "resolution_jobs": {
+        "name": "resolution",
+        "image": "resolution-worker:latest",
+        "cpus": float(os.getenv("RESOLUTION_JOB_CPUS", "2")),
+        "memory": os.getenv("RESOLUTION_JOB_MEMORY", "2g"),
+    },
+    "transcribe_jobs": {
+        "name": "transcription",
+        "image": "transcription-worker:latest",
+        "cpus": float(os.getenv("TRANSCRIPTION_JOB_CPUS", "2")),
+        "memory": os.getenv("TRANSCRIPTION_JOB_MEMORY", "3g"),
+    },
+}
+
+# --- Logging setup ---
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    stream=sys.stdout,
+)
+
+# --- Global clients (reused across jobs, created in main) ---
+docker_client = None
+
+def admission_order(pending, now: float, policy: str = SCHEDULING_POLICY) -> list:
+    """Indices of the (message, msg, received_at, queue) entries in pending, in the order to start them."""
+    if policy != "sjf":
+        return list(range(len(pending)))
+    return sorted(
+        range(len(pending)),
+        key=lambda i: job_cost(pending[i][1]) - SJF_AGING * (now - pending[i][2]),
+    )
+
+
+def job_env(queue: str, msg: dict) -> dict:
+    """Environment for a per-job worker container."""
+    env = worker_env(
+        JOB_ID=msg["job_id"],
+        OBJECT_KEY=msg["object_key"],
+        THREADS=str(max(1, math.ceil(PIPELINES[queue]["cpus"]))),
+    )
+    if queue == "transcribe_jobs":
+        env["WHISPER_MODEL"] = msg.get("model") or WHISPER_MODEL
+        env.update(WHISPER_BACKEND=WHISPER_BACKEND, WHISPER_COMPUTE_TYPE=WHISPER_COMPUTE_TYPE)
+        if msg.get("language"):
+            env["JOB_LANGUAGE"] = msg["language"]
+    return env
+
+
+def container_name(queue: str, job_id: str) -> str:
+    return f"worker-{PIPELINES[queue]['name']}-{job_id}"
+
+
+def run_container(queue: str, msg: dict) -> str:
+    """Blocking containers.run; called from a worker thread. Returns the container name."""
+    pipeline = PIPELINES[queue]
+    name = container_name(queue, msg["job_id"])
+    try:
+        container = docker_client.containers.run(
+            image=pipeline["image"],
+            environment=job_env(queue, msg),
+            network="internal-network",
+            name=name,
+            labels={JOB_LABEL: queue},
+            detach=True,
+            nano_cpus=int(pipeline["cpus"] * 1e9),
+            mem_limit=pipeline["memory"],
+            volumes=cache_volumes(),
+        )
+        logging.info(f"Started {pipeline['name']} container {container.id[:12]} for job {msg['job_id']}")
+    except docker.errors.APIError as e:
+        if e.status_code != 409:
+            raise
+        # A container for this job already exists (e.g. started before a manager restart)
+        logging.info(f"Container {name} already exists, adopting it")
+    return name
+
+
+class AsyncScheduler:
+    """
+    Admit jobs from several queues into one CPU/memory budget without blocking the event loop.
+
+    Docker calls run in threads, so a slow containers.run never stalls AMQP
+    heartbeats and up to DISPATCH_CONCURRENCY launches proceed in parallel.
+    Container exits arrive through the Docker event stream. Running jobs are
+    keyed by container name, not by delivery tag, so they survive a broker
+    reconnect: the redelivered message is attached to the job that is already
+    running (or acked right away if it finished meanwhile).
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.pending = []
+        # container name -> {"queue", "message", "cpus", "memory", "started"}
+        self.running = {}
+        # container name -> exit code, for jobs that finished while their message was not held
+        self.finished = {}
+        self.memory_budget = parse_size(MEMORY_BUDGET)
+        self.launches = asyncio.Semaphore(DISPATCH_CONCURRENCY)
+
+    def reserved(self):
+        cpus = sum(job["cpus"] for job in self.running.values())
+        memory = sum(job["memory"] for job in self.running.values())
+        return cpus, memory
+
+    def _fits(self, queue: str) -> bool:
+        if not self.running:
+            # Always let one job run, even if it exceeds the budget on its own
+            return True
+        cpus, memory = self.reserved()
+        pipeline = PIPELINES[queue]
+        return (
+            cpus + pipeline["cpus"] <= CPU_BUDGET
+            and memory + parse_size(pipeline["memory"]) <= self.memory_budget
+        )
+
+    async def submit(self, queue: str, message) -> None:
+        try:
+            msg = json.loads(message.body)
+            logging.info(f"Received job on {queue}: {msg}")
+            name = container_name(queue, msg["job_id"])
+        except (ValueError, KeyError) as e:
+            logging.error(f"Invalid message on {queue}: {e}")
+            await message.nack(requeue=False)
+            return
+
+        if name in self.finished:
+            await self._settle(message, msg["job_id"], self.finished.pop(name))
+            return
+        if name in self.running:
+            # Redelivery after a reconnect, or a duplicate upload of a running job
+            previous = self.running[name]["message"]
+            self.running[name]["message"] = message
+            if previous is not None and previous.channel is message.channel:
+                await previous.ack()
+            return
+
+        self.pending.append((message, msg, time.monotonic(), queue))
+        self.admit()
+
+    def admit(self) -> None:
+        """
+        Start waiting jobs in admission order, skipping the ones that do not fit.
+
+        A job that does not fit only blocks the jobs behind it once it has waited
+        BACKFILL_MAX_WAIT seconds, so a large transcription job cannot hold up
+        resolution jobs that fit, and is not starved by them either.
+        """
+        now = time.monotonic()
+        started = []
+        blocked = False
+        for index in admission_order(self.pending, now):
+            message, msg, received, queue = self.pending[index]
+            if not self._fits(queue):
+                if not blocked and now - received >= BACKFILL_MAX_WAIT:
+                    break
+                blocked = True
+                continue
+            started.append(index)
+
+            pipeline = PIPELINES[queue]
+            name = container_name(queue, msg["job_id"])
+            self.running[name] = {
+                "queue": queue,
+                "message": message,
+                "cpus": pipeline["cpus"],
+                "memory": parse_size(pipeline["memory"]),
+                "started": time.monotonic(),
+            }
+            asyncio.create_task(self._launch(queue, msg, name, received))
+
+        for index in sorted(started, reverse=True):
+            del self.pending[index]
+        self.update_gauges()
+        if self.pending:
+            cpus, memory = self.reserved()
+            logging.info(
+                f"{len(self.running)} jobs running ({cpus} CPUs), {len(self.pending)} waiting for "
+                f"CPU/memory budget ({CPU_BUDGET} CPUs, {MEMORY_BUDGET})"
+            )
+
+    def update_gauges(self) -> None:
+        for queue, pipeline in PIPELINES.items():
+            JOBS_RUNNING.labels(pipeline["name"]).set(sum(job["queue"] == queue for job in self.running.values()))
+            JOBS_WAITING.labels(pipeline["name"]).set(sum(entry[3] == queue for entry in self.pending))
+
+    async def _launch(self, queue: str, msg: dict, name: str, received: float) -> None:
+        pipeline = PIPELINES[queue]["name"]
+        async with self.launches:
+            try:
+                started = time.monotonic()
+                await asyncio.to_thread(run_container, queue, msg)
+                CONTAINER_START.labels(pipeline).observe(time.monotonic() - started)
+                if name in self.running:
+                    self.running[name]["started"] = time.monotonic()
+                # The backend stamps submitted_at, so the wait includes time spent in the broker queue
+                if msg.get("submitted_at"):
+                    QUEUE_WAIT.labels(pipeline).observe(max(0.0, time.time() - float(msg["submitted_at"])))
+                else:
+                    QUEUE_WAIT.labels(pipeline).observe(time.monotonic() - received)
+            except Exception as e:
+                logging.error(f"Could not start container for job {msg['job_id']}: {e}")
+                job = self.running.pop(name, None)
+                if job and job["message"] is not None:
+                    await self._reject(job["message"])
+                self.admit()
+
+    def adopt(self) -> None:
+        """Track worker containers that were started by a previous manager process."""
+        for container in docker_client.containers.list(all=True, filters={"label": JOB_LABEL}):
+            queue = container.labels.get(JOB_LABEL)
+            if queue not in PIPELINES:
+                continue
+            pipeline = PIPELINES[queue]
+            self.running[container.name] = {
+                "queue": queue,
+                "message": None,
+                "cpus": pipeline["cpus"],
+                "memory": parse_size(pipeline["memory"]),
+                "started": time.monotonic(),
+            }
+            logging.info(f"Adopted running container {container.name}")
+
+    def on_reconnect(self, *_) -> None:
+        # Unacked messages are redelivered on the new channel; running jobs are kept
+        logging.warning(f"RabbitMQ reconnected, dropping {len(self.pending)} waiting deliveries until redelivery")
+        self.pending.clear()
+
+    async def on_exit(self, name: str) -> None:
+        """Ack or nack the job of an exited container and free its budget."""
+        job = self.running.get(name)
+        if job is None:
+            return
+        try:
+            exit_code = await asyncio.to_thread(self._remove, name)
+        except docker.errors.NotFound:
+            exit_code = None
+        except Exception as e:
+            logging.warning(f"Could not inspect {name}: {e}")
+            return
+        if name not in self.running:
+            return
+        del self.running[name]
+        status = "ok" if exit_code == 0 else "failed"
+        pipeline = PIPELINES[job["queue"]]["name"]
+        JOB_DURATION.labels(pipeline, status).observe(time.monotonic() - job["started"])
+        JOBS.labels(pipeline, status).inc()
+
+        job_id = name.split("-", 2)[-1]
+        if job["message"] is None:
+            # Message not (yet) redelivered to us; settle it when it arrives
+            self.finished[name] = exit_code
+        else:
+            await self._settle(job["message"], job_id, exit_code)
+        self.admit()
+
+    @staticmethod
+    def _remove(name: str):
+        container = docker_client.containers.get(name)
+        container.reload()
+        if container.status not in ("exited", "dead"):
+            raise RuntimeError(f"{name} is still {container.status}")
+        exit_code = container.attrs["State"]["ExitCode"]
+        container.remove()
+        return exit_code
+
+    async def _settle(self, message, job_id: str, exit_code) -> None:
+        if exit_code == 0:
+            logging.info(f"Job {job_id} finished")
+            try:
+                await message.ack()
+            except Exception as e:
+                logging.warning(f"Could not ack job {job_id}, it will be redelivered: {e}")
+        else:
+            logging.error(f"Job {job_id} failed (exit code {exit_code})")
+            await self._reject(message)
+
+    @staticmethod
+    async def _reject(message) -> None:
+        try:
+            await message.nack(requeue=False)
+        except Exception as e:
+            logging.warning(f"Could not nack message, it will be redelivered: {e}")
+
+    async def reconcile(self) -> None:
+        """Catch exits the event stream missed (e.g. while it was reconnecting)."""
+        while True:
+            await asyncio.sleep(RECONCILE_INTERVAL)
+            for name in list(self.running):
+                try:
+                    container = await asyncio.to_thread(docker_client.containers.get, name)
+                except docker.errors.NotFound:
+                    continue
+                if container.status in ("exited", "dead"):
+                    await self.on_exit(name)
+
+    def watch_events(self) -> None:
+        """Forward container die events to the loop; runs in a daemon thread."""
+        while True:
+            try:
+                events = docker_client.events(
+                    decode=True, filters={"type": "container", "event": "die", "label": JOB_LABEL}
+                )
+                for event in events:
+                    name = event["Actor"]["Attributes"].get("name")
+                    asyncio.run_coroutine_threadsafe(self.on_exit(name), self.loop)
+            except Exception as e:
+                logging.warning(f"Docker event stream interrupted: {e}")
+                time.sleep(5)
+
+
+async def run():
+    unknown = set(QUEUES) - set(PIPELINES)
+    if unknown:
+        raise ValueError(f"No pipeline configured for queues: {', '.join(sorted(unknown))}")
+
+    loop = asyncio.get_running_loop()
+    # Cancel this task on SIGINT/SIGTERM; leaving the `async with` below closes the connection cleanly
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, asyncio.current_task().cancel)
+
+    scheduler = AsyncScheduler(loop)
+    await asyncio.to_thread(scheduler.adopt)
+    threading.Thread(target=scheduler.watch_events, daemon=True).start()
+
+    # connect_robust retries the initial connection and restores channels and consumers on failure
+    connection = await aio_pika.connect_robust(
+        host=RABBIT_HOST, port=RABBIT_PORT, login=RABBIT_USER, password=RABBIT_PASS,
+    )
+    connection.reconnect_callbacks.add(scheduler.on_reconnect)
+
+    async with connection:
+        channel = await connection.channel()
+        await channel.set_qos(prefetch_count=PREFETCH_COUNT)
+        for queue_name in QUEUES:
+            queue = await channel.declare_queue(queue_name, durable=True)
+            await queue.consume(lambda message, q=queue_name: scheduler.submit(q, message))
+
+        logging.info(
+            f"Manager started on {', '.join(QUEUES)} with a budget of {CPU_BUDGET} CPUs / {MEMORY_BUDGET} "
+            f"({SCHEDULING_POLICY} scheduling, {DISPATCH_CONCURRENCY} concurrent launches). Waiting for messages..."
+        )
+        await scheduler.reconcile()
+
+
+def main():
+    global docker_client
+
+    logging.info("Starting async manager...")
+    docker_client = docker.from_env()
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+        logging.info(f"Serving Prometheus metrics on :{METRICS_PORT}")
+
+    try:
+        asyncio.run(run())
+    except asyncio.CancelledError:
+        logging.info("Stopping manager...")
+    except Exception:
+        logging.exception("Fatal error in manager loop")
+        sys.exit(1)
+    finally:
+        docker_client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+"""
+Reproducible benchmark for the Resolution and Subtitles workers.
+
+Sources are generated offline with ffmpeg lavfi, so every run encodes the
+same frames. Each case runs in a fresh process (the workers read their
+configuration at import time) and reports wall time, frames/s, speed
+relative to realtime, peak RSS of the process and its ffmpeg children, and
+bytes written. The full Resolution flow runs worker.main() against a local
+MinIO server started from the `minio` binary (or BENCH_MINIO_ENDPOINT).
+
+Usage:
+    python bench_pipes.py [--quick] [--only encode,hls,flow,whisper]
+                          [--save results.json] [--baseline baseline.json]
+"""
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from queue import Empty
+
+import ffmpeg
+
+PIPES_DIR = os.path.dirname(os.path.abspath(__file__))
+RESOLUTION_WORKER = os.path.join(PIPES_DIR, "Resolution", "worker", "worker.py")
+SUBTITLES_WORKER = os.path.join(PIPES_DIR, "Subtitles", "worker", "worker.py")
+# Helpers both workers import; spawned case processes inherit sys.path
+sys.path.insert(0, os.path.join(PIPES_DIR, "common"))
+
+# Fixed thread count so numbers are comparable across machines with different core counts
+THREADS = os.getenv("BENCH_THREADS", "2")
+WHISPER_MODEL = os.getenv("BENCH_WHISPER_MODEL", "tiny")
+# A case still running after this many seconds is stopped and recorded as an error (0: no limit)
+CASE_TIMEOUT = float(os.getenv("BENCH_CASE_TIMEOUT", "0"))
+MINIO_BIN = os.getenv("MINIO_BIN", "minio")
+MINIO_USER = "benchadmin"
+MINIO_PASSWORD = "benchadmin"
+# A case is a regression when it is this much slower (or uses this much more memory) than the baseline
+TOLERANCE = float(os.getenv("BENCH_TOLERANCE", "0.10"))
+
+# ------------------------------------------------------------------
+# Sources: (name, size, rate, duration, audio)
+# audio is None, "tone" (sine) or "speech" (syllable-like bursts with pauses)
+# ------------------------------------------------------------------
+SOURCES = [
+    ("360p_30s_tone", "640x360", 30, 30, "tone"),
+    ("720p_60s_speech", "1280x720", 30, 60, "speech"),
+    ("1080p_30s_silent", "1920x1080", 30, 30, None),
+]
+QUICK_SOURCES = ["360p_30s_tone"]
+
+# Pitch-modulated tone gated at ~4 syllables/s, with a pause every 3 seconds
+SPEECH_EXPR = (
+    "0.6*sin(2*PI*(180+60*sin(2*PI*5*t))*t)"
+    "*gt(sin(2*PI*4*t),0)*gt(mod(t,3),0.6)"
+)
+
+
+def create_source(path, size, rate, duration, audio):
+    """Generate a deterministic H.264/AAC source with ffmpeg lavfi."""
+    video = ffmpeg.input(f"testsrc2=size={size}:rate={rate}:duration={duration}", format="lavfi")
+    streams = [video]
+    if audio == "tone":
+        streams.append(ffmpeg.input(f"sine=frequency=440:sample_rate=48000:duration={duration}", format="lavfi"))
+    elif audio == "speech":
+        streams.append(ffmpeg.input(f"aevalsrc='{SPEECH_EXPR}':s=48000:d={duration}", format="lavfi"))
+
+    args = {"vcodec": "libx264", "pix_fmt": "yuv420p", "preset": "veryfast", "g": rate * 2}
+    if audio:
+        args["acodec"] = "aac"
+    ffmpeg.output(*streams, path, **args).overwrite_output().run(quiet=True)
+
+
+def load_worker(path, name, env):
+    """Import a worker file under its own module name after applying its environment."""
+    os.environ.update(env)
+    sys.modules.pop("worker_common", None)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def dir_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files
+    )
+
+
+def peak_rss_mb():
+    """Peak RSS of this process or any of its finished children (ffmpeg), in MiB."""
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(self_rss, child_rss) / 1024
+
+
+# ------------------------------------------------------------------
+# Cases (run inside a fresh spawned process)
+# ------------------------------------------------------------------
+def case_encode(src, out_dir, env, label):
+    worker = load_worker(RESOLUTION_WORKER, "resolution_worker", env)
+    cfg = worker.ALL_RENDITIONS[label]
+    dst = os.path.join(out_dir, f"{label}.mp4")
+    worker.generate_mp4_rendition(src, dst, cfg["size"], cfg["bitrate"], worker.get_video_info(src)["has_audio"])
+    return os.path.getsize(dst)
+
+
+def case_hls(src, out_dir, env, label):
+    worker = load_worker(RESOLUTION_WORKER, "resolution_worker", env)
+    cfg = worker.ALL_RENDITIONS[label]
+    worker.generate_hls_rendition(
+        src, out_dir, label, cfg["size"], cfg["bitrate"], worker.get_video_info(src)["has_audio"]
+    )
+    return dir_size(out_dir)
+
+
+def case_flow(src, out_dir, env, object_key):
+    worker = load_worker(RESOLUTION_WORKER, "resolution_worker", env)
+    worker.main()
+    minio = worker.wait_for_minio()
+    prefix = os.path.splitext(os.path.basename(object_key))[0]
+    return sum(obj.size for obj in minio.list_objects(worker.BUCKET, prefix=f"{prefix}/", recursive=True))
+
+
+def case_whisper(src, out_dir, env, model_name):
+    worker = load_worker(SUBTITLES_WORKER, "subtitles_worker", env)
+    duration = float(worker.ffmpeg.probe(src)["format"].get("duration", 0))
+    srt_path, _ = worker.run_whisper(src, out_dir, duration, model_name)
+    return os.path.getsize(srt_path)
+
+
+CASES = {
+    "encode": case_encode,
+    "hls": case_hls,
+    "flow": case_flow,
+    "whisper": case_whisper,
+}
+
+
+def _run_case(kind, src, out_dir, env, arg, queue):
+    try:
+        start = time.monotonic()
+        written = CASES[kind](src, out_dir, env, arg)
+        queue.put({"seconds": time.monotonic() - start, "bytes": written, "peak_rss_mb": peak_rss_mb()})
+    except BaseException as e:
+        # Also catches the sys.exit() of a worker that rejects its configuration
+        queue.put({"error": f"{type(e).__name__}: {e}"})
+
+
+def run_case(kind, src, env, arg):
+    """
+    Run one case in a spawned process and return its result.
+
+    A child that dies without a result (killed for running out of memory, a crash
+    in native code) or runs past CASE_TIMEOUT is recorded as an error result.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    with tempfile.TemporaryDirectory() as out_dir:
+        process = ctx.Process(target=_run_case, args=(kind, src, out_dir, env, arg, queue))
+        process.start()
+        started = time.monotonic()
+        while True:
+            try:
+                result = queue.get(timeout=1)
+                break
+            except Empty:
+                pass
+            if not process.is_alive():
+                # The result may have been put just before the child exited
+                try:
+                    result = queue.get(timeout=1)
+                except Empty:
+                    result = {"error": f"case process died with exit code {process.exitcode}"}
+                break
+            if CASE_TIMEOUT and time.monotonic() - started > CASE_TIMEOUT:
+                process.kill()
+                result = {"error": f"case timed out after {CASE_TIMEOUT:.0f}s"}
+                break
+        process.join()
+    return result
+
+
+# ------------------------------------------------------------------
+# Local MinIO
+# ------------------------------------------------------------------
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_minio(data_dir):
+    """Start a throwaway MinIO server; returns (endpoint, process or None)."""
+    endpoint = os.getenv("BENCH_MINIO_ENDPOINT")
+    if endpoint:
+        return endpoint, None
+    if not shutil.which(MINIO_BIN):
+        return None, None
+
+    endpoint = f"127.0.0.1:{_free_port()}"
+    env = dict(os.environ, MINIO_ROOT_USER=MINIO_USER, MINIO_ROOT_PASSWORD=MINIO_PASSWORD)
+    process = subprocess.Popen(
+        [MINIO_BIN, "server", data_dir, "--address", endpoint, "--quiet"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    return endpoint, process
+
+
+def minio_env(endpoint):
+    return {
+        "MINIO_ENDPOINT": endpoint,
+        "MINIO_ACCESS_KEY": os.getenv("BENCH_MINIO_ACCESS_KEY", MINIO_USER),
+        "MINIO_SECRET_KEY": os.getenv("BENCH_MINIO_SECRET_KEY", MINIO_PASSWORD),
+    }
+
+
+def upload_source(endpoint, path, object_key):
+    from minio import Minio
+
+    env = minio_env(endpoint)
+    client = Minio(endpoint, env["MINIO_ACCESS_KEY"], env["MINIO_SECRET_KEY"], secure=False)
+    for _ in range(30):
+        try:
+            if not client.bucket_exists("video"):
+                client.make_bucket("video")
+            break
+        except Exception:
+            time.sleep(1)
+    client.fput_object("video", object_key, path)
+
+
+# ------------------------------------------------------------------
+# Reporting
+# ------------------------------------------------------------------
+def describe(name, duration, rate, result):
+    if "error" in result:
+        return {"case": name, "error": result["error"]}
+    seconds = result["seconds"]
+    return {
+        "case": name,
+        "seconds": round(seconds, 3),
+        "fps": round(duration * rate / seconds, 1) if rate else None,
+        "x_realtime": round(duration / seconds, 3),
+        "peak_rss_mb": round(result["peak_rss_mb"], 1),
+        "bytes": result["bytes"],
+    }
+
+
+def print_results(results):
+    print(f"{'case':<40}{'time':>9}{'fps':>9}{'x rt':>8}{'peak RSS':>12}{'bytes':>14}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['case']:<40}  ERROR {r['error']}")
+            continue
+        fps = f"{r['fps']:.1f}" if r["fps"] else "-"
+        print(
+            f"{r['case']:<40}{r['seconds']:>8.2f}s{fps:>9}{r['x_realtime']:>8.2f}"
+            f"{r['peak_rss_mb']:>9.1f} MB{r['bytes']:>14}"
+        )
+
+
+def compare(results, baseline_path):
+    """Print the change against a stored baseline; returns the number of regressions."""
+    with open(baseline_path) as f:
+        baseline = {r["case"]: r for r in json.load(f)["results"] if "error" not in r}
+
+    regressions = 0
+    print(f"\nCompared with {baseline_path} (tolerance {TOLERANCE:.0%})")
+    for r in results:
+        before = baseline.get(r["case"])
+        if before is None or "error" in r:
+            continue
+        time_change = r["seconds"] / before["seconds"] - 1
+        rss_change = r["peak_rss_mb"] / before["peak_rss_mb"] - 1
+        regressed = time_change > TOLERANCE or rss_change > TOLERANCE
+        regressions += regressed
+        print(
+            f"{r['case']:<40} time {time_change:+7.1%}  RSS {rss_change:+7.1%}  "
+            f"bytes {r['bytes'] - before['bytes']:+d}{'  REGRESSION' if regressed else ''}"
+        )
+    return regressions
+
+
+def run_benchmark(quick=False, only=None, save=None, baseline=None):
+    """
+    1. Generate the lavfi sources
+    2. Run rendition encodes, HLS encodes, the full Resolution flow and Whisper on them
+    3. Print the results, optionally store them and compare them with a baseline
+    """
+    kinds = only or list(CASES)
+    sources = [s for s in SOURCES if not quick or s[0] in QUICK_SOURCES]
+    labels = ["240p"] if quick else ["240p", "720p"]
+    base_env = {"THREADS": THREADS, "HLS_ENABLED": "true", "REPORTS_ENABLED": "false", "EVENTS_ENABLED": "false"}
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        minio_process = None
+        endpoint = None
+        if "flow" in kinds:
+            endpoint, minio_process = start_minio(os.path.join(tmp_dir, "minio"))
+            if endpoint is None:
+                print(f"Skipping the full flow: no `{MINIO_BIN}` binary and no BENCH_MINIO_ENDPOINT")
+
+        try:
+            for name, size, rate, duration, audio in sources:
+                src = os.path.join(tmp_dir, f"{name}.mp4")
+                create_source(src, size, rate, duration, audio)
+                height = int(size.split("x")[1])
+                rungs = [label for label in labels if int(label[:-1]) <= height]
+
+                for label in rungs:
+                    if "encode" in kinds:
+                        result = run_case("encode", src, base_env, label)
+                        results.append(describe(f"encode/{name}/{label}", duration, rate, result))
+                    if "hls" in kinds:
+                        result = run_case("hls", src, base_env, label)
+                        results.append(describe(f"hls/{name}/{label}", duration, rate, result))
+
+                if "flow" in kinds and endpoint:
+                    object_key = f"{name}/{name}.mp4"
+                    upload_source(endpoint, src, object_key)
+                    env = dict(
+                        base_env, **minio_env(endpoint),
+                        JOB_ID=name, OBJECT_KEY=object_key, RENDITIONS=",".join(rungs),
+                    )
+                    result = run_case("flow", src, env, object_key)
+                    results.append(describe(f"flow/{name}", duration, rate, result))
+
+                if "whisper" in kinds and audio == "speech":
+                    result = run_case("whisper", src, base_env, WHISPER_MODEL)
+                    results.append(describe(f"whisper/{name}/{WHISPER_MODEL}", duration, None, result))
+        finally:
+            if minio_process:
+                minio_process.terminate()
+                minio_process.wait()
+
+    print_results(results)
+
+    document = {
+        "host": {
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "threads": THREADS,
+            "python": platform.python_version(),
+        },
+        "results": results,
+    }
+    if save:
+        with open(save, "w") as f:
+            json.dump(document, f, indent=2)
+        print(f"\nSaved results to {save}")
+
+    if baseline:
+        return compare(results, baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the media pipes on synthetic sources")
+    parser.add_argument("--quick", action="store_true", help="only the smallest source and 240p")
+    parser.add_argument("--only", help=f"comma separated subset of: {', '.join(CASES)}")
+    parser.add_argument("--save", help="write the results as JSON (e.g. to use as a baseline)")
+    parser.add_argument("--baseline", help="compare with a previously saved results file")
+    args = parser.parse_args()
+
+    only = args.only.split(",") if args.only else None
+    if only and set(only) - set(CASES):
+        parser.error(f"unknown cases: {', '.join(sorted(set(only) - set(CASES)))}")
+
+    sys.exit(1 if run_benchmark(args.quick, only, args.save, args.baseline) else 0)
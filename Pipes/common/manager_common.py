@@ -0,0 +1,640 @@
+"""
+Scheduler, executors, metrics and worker environment shared by the pipe managers.
+
+docker-compose.yaml mounts this file next to manager.py in every manager
+service; to run a manager from the repository, put Pipes/common on PYTHONPATH.
+A pipe's manager.py only describes its pipe (queue, worker image and
+environment) and calls main() with it.
+"""
+import importlib.util
+import json
+import logging
+import math
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import docker
+import pika
+from pika.exceptions import AMQPConnectionError
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+# --- Configuration ---
+RABBIT_HOST = os.getenv("RABBIT_HOST", "rabbitmq")
+RABBIT_PORT = int(os.getenv("RABBIT_PORT", 5672))
+RABBIT_USER = os.getenv("RABBIT_USER", "guest")
+RABBIT_PASS = os.getenv("RABBIT_PASS", "guest")
+
+# Host directory bind-mounted (at the same path) into every worker as the source cache both pipes share
+SOURCE_CACHE_DIR = os.getenv("SOURCE_CACHE_DIR", "")
+SOURCE_CACHE_SIZE = os.getenv("SOURCE_CACHE_SIZE", str(20 * 1024 ** 3))
+
+# How per-job workers are started: "docker" (a container per job), "subprocess" (worker.py as a
+# local process) or "process_pool" (the worker's main() in a pool of warm Python processes).
+# The last two need no Docker socket; CPU/memory limits are then only enforced by admission.
+# They are for local development: they run the pipe's worker.py with the manager's own Python, which
+# needs the worker's dependencies (ffmpeg, and whisper/torch for transcription). The pipe-manager image
+# has neither the worker nor those dependencies, so under docker compose only "docker" works.
+# Put Pipes/common on PYTHONPATH: the manager and the worker import their shared helpers from it.
+EXECUTOR = os.getenv("EXECUTOR", "docker").lower()
+
+# "per_job" starts one container per message, "pool" keeps warm workers consuming the queue
+EXECUTION_MODE = os.getenv("EXECUTION_MODE", "per_job").lower()
+POOL_SIZE = int(os.getenv("POOL_SIZE", "2"))
+POOL_MIN_SIZE = int(os.getenv("POOL_MIN_SIZE", "1"))
+POOL_CHECK_INTERVAL = int(os.getenv("POOL_CHECK_INTERVAL", "5"))
+MAX_JOBS_PER_WORKER = int(os.getenv("MAX_JOBS_PER_WORKER", "50"))
+WORKER_IDLE_TIMEOUT = int(os.getenv("WORKER_IDLE_TIMEOUT", "300"))
+POOL_LABEL = "myfairpipe.pool"
+
+# Admission control: jobs only start while they fit into the CPU/memory budget; the per-job
+# share (JOB_CPUS / JOB_MEMORY) is part of each pipe's description
+CPU_BUDGET = float(os.getenv("CPU_BUDGET", str(os.cpu_count() or 1)))
+MEMORY_BUDGET = os.getenv("MEMORY_BUDGET", "8g")
+PREFETCH_COUNT = int(os.getenv("PREFETCH_COUNT", "10"))
+SCHEDULER_INTERVAL = float(os.getenv("SCHEDULER_INTERVAL", "1"))
+# Requeue a failed job once; with CHECKPOINT_ENABLED on the Resolution workers the retry skips rungs
+# that were already uploaded
+RETRY_FAILED_JOBS = os.getenv("RETRY_FAILED_JOBS", "false").lower() == "true"
+
+# Order in which waiting jobs are admitted: "fifo", or "sjf" (shortest job first with aging).
+# Jobs are reordered within the PREFETCH_COUNT messages the manager holds.
+SCHEDULING_POLICY = os.getenv("SCHEDULING_POLICY", "fifo").lower()
+# Every second a job waits makes it look SJF_AGING seconds shorter, so long jobs cannot starve
+SJF_AGING = float(os.getenv("SJF_AGING", "10"))
+# Estimates for messages without a probed duration
+SJF_BYTES_PER_SECOND = float(os.getenv("SJF_BYTES_PER_SECOND", str(500 * 1024)))
+SJF_DEFAULT_DURATION = float(os.getenv("SJF_DEFAULT_DURATION", "600"))
+
+# Prometheus metrics are served on this port (0 disables them)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# --- Global clients (reused across jobs, created in main) ---
+docker_client = None
+executor = None
+# Description of the pipe this manager runs, passed to main(): {"name", "queue", "image",
+# "worker_path", "cpus", "memory", "env"}, where env(msg, **extra) builds a worker's environment
+# (msg is None for pool workers)
+pipe = None
+
+# --- Metrics ---
+DURATION_BUCKETS = (5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400)
+QUEUE_WAIT = Histogram(
+    "pipe_queue_wait_seconds", "Time from upload (or receipt) until the worker container started",
+    ["pipeline"], buckets=DURATION_BUCKETS,
+)
+CONTAINER_START = Histogram(
+    "pipe_container_start_seconds", "Latency of starting a worker container", ["pipeline"],
+)
+JOB_DURATION = Histogram(
+    "pipe_job_duration_seconds", "Run time of worker containers", ["pipeline", "status"], buckets=DURATION_BUCKETS,
+)
+JOBS = Counter("pipe_jobs_total", "Finished jobs", ["pipeline", "status"])
+JOBS_RUNNING = Gauge("pipe_jobs_running", "Worker containers currently running", ["pipeline"])
+JOBS_WAITING = Gauge("pipe_jobs_waiting", "Jobs held by the manager until they fit the budget", ["pipeline"])
+
+
+def worker_env(**extra) -> dict:
+    """Environment shared by every worker container."""
+    env = {
+        "RABBIT_HOST": RABBIT_HOST,
+        "RABBIT_PORT": str(RABBIT_PORT),
+        # Every worker publishes a completion event, not only pool workers talk to RabbitMQ
+        "RABBIT_USER": RABBIT_USER,
+        "RABBIT_PASS": RABBIT_PASS,
+        "MINIO_ENDPOINT": os.getenv("MINIO_ENDPOINT", "minio:9000"),
+        "MINIO_ACCESS_KEY": os.getenv("MINIO_ACCESS_KEY", "minioadmin"),
+        "MINIO_SECRET_KEY": os.getenv("MINIO_SECRET_KEY", "minioadmin"),
+    }
+    if SOURCE_CACHE_DIR:
+        env.update(SOURCE_CACHE_DIR=SOURCE_CACHE_DIR, SOURCE_CACHE_SIZE=SOURCE_CACHE_SIZE)
+    env.update(extra)
+    return env
+
+
+def cache_volumes() -> dict:
+    """Bind mount of the shared source cache, if one is configured."""
+    if not SOURCE_CACHE_DIR:
+        return {}
+    return {SOURCE_CACHE_DIR: {"bind": SOURCE_CACHE_DIR, "mode": "rw"}}
+
+
+def wait_for_rabbitmq(max_retries: int = 60, delay: int = 5):
+    """Wait for RabbitMQ to be available with retries."""
+    logging.info(f"🔍 Using RabbitMQ host: {RABBIT_HOST}:{RABBIT_PORT} with user {RABBIT_USER}")
+    credentials = pika.PlainCredentials(RABBIT_USER, RABBIT_PASS)
+
+    for attempt in range(max_retries):
+        try:
+            conn = pika.BlockingConnection(
+                pika.ConnectionParameters(host=RABBIT_HOST, port=RABBIT_PORT, credentials=credentials)
+            )
+            conn.close()
+            logging.info("RabbitMQ is ready")
+            return
+        except AMQPConnectionError as e:
+            logging.warning(
+                f"Waiting for RabbitMQ at {RABBIT_HOST}:{RABBIT_PORT} "
+                f"(attempt {attempt + 1}/{max_retries})... {e}"
+            )
+            time.sleep(delay)
+
+    raise RuntimeError("RabbitMQ not available after max retries")
+
+
+def worker_name(job_id: str) -> str:
+    return f"worker-{pipe['name']}-{job_id}"
+
+
+def start_worker(name: str, msg: dict, retry: bool = False) -> None:
+    """Start the worker of a job (or adopt the one a previous manager process started)."""
+    # JOB_RETRY tells the worker's report that a failure will be retried
+    env = pipe["env"](
+        msg,
+        JOB_ID=msg["job_id"],
+        OBJECT_KEY=msg["object_key"],
+        THREADS=worker_threads(),
+        JOB_RETRY=str(retry).lower(),
+    )
+    executor.start(name, env)
+
+
+class DockerBackend:
+    """One worker container per job, with the per-job CPU and memory limits."""
+
+    def start(self, name: str, env: dict) -> None:
+        try:
+            docker_client.containers.get(name)
+            # Started before a manager restart: track it like a new one, poll() settles the job from its exit code
+            logging.info(f"Worker {name} already exists, adopting it")
+            return
+        except docker.errors.NotFound:
+            pass
+
+        try:
+            container = docker_client.containers.run(
+                image=pipe["image"],
+                environment=env,
+                network="internal-network",
+                name=name,
+                detach=True,
+                volumes=cache_volumes(),
+                **resource_limits(),
+            )
+        except docker.errors.APIError as e:
+            logging.error(f"Docker error for {name}: {e.explanation}")
+            raise
+        logging.info(f"Started {pipe['name']} container {container.id[:12]} ({name})")
+
+    def poll(self, name: str) -> int | None:
+        """Exit code of a finished worker (which is removed), None while it runs."""
+        try:
+            container = docker_client.containers.get(name)
+            if container.status not in ("exited", "dead"):
+                return None
+            exit_code = container.attrs["State"]["ExitCode"]
+            container.remove()
+            return exit_code
+        except docker.errors.NotFound:
+            return -1
+
+    def close(self) -> None:
+        pass
+
+
+class SubprocessBackend:
+    """Run worker.py as a local child process with the job's environment."""
+
+    def __init__(self):
+        self.procs = {}
+
+    def start(self, name: str, env: dict) -> None:
+        self.procs[name] = subprocess.Popen([sys.executable, pipe["worker_path"]], env={**os.environ, **env})
+        logging.info(f"Started {pipe['name']} process {self.procs[name].pid} ({name})")
+
+    def poll(self, name: str) -> int | None:
+        exit_code = self.procs[name].poll()
+        if exit_code is not None:
+            del self.procs[name]
+        return exit_code
+
+    def close(self) -> None:
+        for proc in self.procs.values():
+            proc.terminate()
+        # Reap the children so none is left behind as a zombie
+        for proc in self.procs.values():
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+
+
+# Worker module loaded in a pool process, and the configuration it was loaded with
+_worker = None
+_worker_config = None
+# Environment of the pool process before its first job
+_base_environ = None
+# Variables that differ per job; the worker module is reused across jobs that only differ in these
+JOB_ENV_KEYS = ("JOB_ID", "OBJECT_KEY", "JOB_RETRY", "JOB_LANGUAGE")
+
+
+def _run_in_process(path: str, env: dict) -> int:
+    """
+    Pool process entry point: run the worker's main() for one job and return its exit code.
+
+    The worker reads its configuration at import time, so it is imported once per
+    process and only re-imported when the job needs a different configuration;
+    heavy imports (and loaded models) stay warm between jobs.
+    """
+    global _worker, _worker_config, _base_environ
+
+    # Start every job from the process's own environment, so no variable of an earlier job leaks in
+    if _base_environ is None:
+        _base_environ = dict(os.environ)
+    os.environ.clear()
+    os.environ.update(_base_environ)
+    os.environ.update(env)
+    config = {k: v for k, v in env.items() if k not in JOB_ENV_KEYS}
+    if _worker is None or config != _worker_config:
+        # The shared helpers read their configuration at import time too
+        sys.modules.pop("worker_common", None)
+        spec = importlib.util.spec_from_file_location("worker", path)
+        _worker = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(_worker)
+        _worker_config = config
+    _worker.JOB_ID = env["JOB_ID"]
+    _worker.OBJECT_KEY = env["OBJECT_KEY"]
+    _worker.JOB_LANGUAGE = env.get("JOB_LANGUAGE")
+
+    try:
+        _worker.main()
+        return 0
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else 1
+    except Exception:
+        logging.exception(f"Job {env['JOB_ID']} failed")
+        return 1
+
+
+class ProcessPoolBackend:
+    """
+    Call the worker's main() in a pool of spawned Python processes.
+
+    Dispatch takes milliseconds instead of a container start. There is one process
+    per job slot of the budget, and processes are recycled after MAX_JOBS_PER_WORKER jobs.
+
+    A pool process that dies abruptly (e.g. killed for running out of memory) breaks
+    the whole executor: all its in-flight jobs fail with BrokenProcessPool and it
+    accepts no new ones. Those jobs are reported as failed and a new executor is
+    started, so one crash does not take down every later job.
+    """
+
+    def __init__(self):
+        self.pool = self._new_pool()
+        self.futures = {}
+
+    @staticmethod
+    def _new_pool() -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=max(1, int(CPU_BUDGET // pipe["cpus"])),
+            mp_context=multiprocessing.get_context("spawn"),
+            max_tasks_per_child=MAX_JOBS_PER_WORKER or None,
+        )
+
+    def _replace_pool(self, broken: ProcessPoolExecutor) -> None:
+        """Start a new executor if `broken` is still the current one."""
+        if self.pool is not broken:
+            return
+        logging.warning("A pool process died, replacing the broken process pool")
+        broken.shutdown(wait=False, cancel_futures=True)
+        self.pool = self._new_pool()
+
+    def start(self, name: str, env: dict) -> None:
+        try:
+            future = self.pool.submit(_run_in_process, pipe["worker_path"], env)
+        except BrokenProcessPool:
+            # Broken since the last poll: its failed futures are reported when they are polled
+            self._replace_pool(self.pool)
+            future = self.pool.submit(_run_in_process, pipe["worker_path"], env)
+        self.futures[name] = (future, self.pool)
+        logging.info(f"Dispatched {name} to the process pool")
+
+    def poll(self, name: str) -> int | None:
+        future, pool = self.futures[name]
+        if not future.done():
+            return None
+        del self.futures[name]
+        try:
+            return future.result()
+        except BrokenProcessPool as e:
+            logging.error(f"Pool process for {name} died: {e}")
+            self._replace_pool(pool)
+            return -1
+        except Exception as e:
+            logging.error(f"Pool process for {name} failed: {e}")
+            return -1
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+EXECUTORS = {
+    "docker": DockerBackend,
+    "subprocess": SubprocessBackend,
+    "process_pool": ProcessPoolBackend,
+}
+
+
+def parse_size(value: str) -> int:
+    """Parse a Docker-style memory size ("512m", "2g") into bytes."""
+    units = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+    value = value.strip().lower()
+    if value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def resource_limits() -> dict:
+    """Per-container CPU and memory limits matching the admission budget."""
+    return {"nano_cpus": int(pipe["cpus"] * 1e9), "mem_limit": pipe["memory"]}
+
+
+def worker_threads() -> str:
+    """Thread count for ffmpeg -threads / torch.set_num_threads inside a worker."""
+    return str(max(1, math.ceil(pipe["cpus"])))
+
+
+def job_cost(msg: dict) -> float:
+    """Estimated length of a job in seconds of video, from its probed duration or size."""
+    if msg.get("duration"):
+        return float(msg["duration"])
+    if msg.get("size"):
+        return float(msg["size"]) / SJF_BYTES_PER_SECOND
+    return SJF_DEFAULT_DURATION
+
+
+def pick_next(pending, now: float, policy: str = SCHEDULING_POLICY) -> int:
+    """Index of the (delivery_tag, msg, received_at) entry in pending to start next."""
+    if policy != "sjf":
+        return 0
+    return min(
+        range(len(pending)),
+        key=lambda i: job_cost(pending[i][1]) - SJF_AGING * (now - pending[i][2]),
+    )
+
+
+class Scheduler:
+    """
+    Admit jobs only within the CPU and memory budget and ack them on completion.
+
+    Messages stay unacked while they wait for a slot or run, so prefetch_count
+    bounds how many jobs the manager holds. Every running worker reserves the
+    pipe's per-job CPUs and memory of the budget until it exits. Waiting jobs are
+    admitted in SCHEDULING_POLICY order.
+    """
+
+    def __init__(self, ch):
+        self.ch = ch
+        self.pending = deque()
+        self.running = {}
+        self.job_memory = parse_size(pipe["memory"])
+        self.memory_budget = parse_size(MEMORY_BUDGET)
+        # Delivery tags of first deliveries, which are requeued once if the job fails
+        self.retryable = set()
+
+    def submit(self, delivery_tag: int, msg: dict, redelivered: bool = False) -> None:
+        if RETRY_FAILED_JOBS and not redelivered:
+            self.retryable.add(delivery_tag)
+        self.pending.append((delivery_tag, msg, time.monotonic()))
+        self.admit()
+
+    def _fits(self) -> bool:
+        if not self.running:
+            # Always let one job run, even if it exceeds the budget on its own
+            return True
+        cpus = (len(self.running) + 1) * pipe["cpus"]
+        memory = (len(self.running) + 1) * self.job_memory
+        return cpus <= CPU_BUDGET and memory <= self.memory_budget
+
+    def admit(self) -> None:
+        while self.pending and self._fits():
+            index = pick_next(self.pending, time.monotonic())
+            delivery_tag, msg, received = self.pending[index]
+            del self.pending[index]
+            try:
+                name = worker_name(msg["job_id"])
+                duplicate = name in self.running
+                if not duplicate:
+                    started = time.monotonic()
+                    start_worker(name, msg, delivery_tag in self.retryable)
+                    CONTAINER_START.labels(pipe["name"]).observe(time.monotonic() - started)
+            except Exception as e:
+                logging.error(f"Error processing job: {e}")
+                self.retryable.discard(delivery_tag)
+                self.ch.basic_nack(delivery_tag, requeue=False)
+                continue
+
+            if duplicate:
+                # Duplicate message for a job this manager is running: drop it instead of clashing on the name
+                logging.info(f"Worker {name} already running, dropping duplicate job {msg['job_id']}")
+                self.retryable.discard(delivery_tag)
+                self.ch.basic_ack(delivery_tag)
+                continue
+            self.running[name] = (delivery_tag, msg["job_id"], time.monotonic())
+
+            # The backend stamps submitted_at, so the wait includes time spent in the broker queue
+            if msg.get("submitted_at"):
+                QUEUE_WAIT.labels(pipe["name"]).observe(max(0.0, time.time() - float(msg["submitted_at"])))
+            else:
+                QUEUE_WAIT.labels(pipe["name"]).observe(time.monotonic() - received)
+
+        JOBS_RUNNING.labels(pipe["name"]).set(len(self.running))
+        JOBS_WAITING.labels(pipe["name"]).set(len(self.pending))
+        if self.pending:
+            logging.info(
+                f"{len(self.running)} jobs running, {len(self.pending)} waiting for "
+                f"CPU/memory budget ({CPU_BUDGET} CPUs, {MEMORY_BUDGET})"
+            )
+
+    def poll(self) -> None:
+        """Ack finished jobs (nack failed ones) and admit waiting jobs into the freed budget."""
+        for name, (delivery_tag, job_id, started) in list(self.running.items()):
+            exit_code = executor.poll(name)
+            if exit_code is None:
+                continue
+
+            del self.running[name]
+            status = "ok" if exit_code == 0 else "failed"
+            JOB_DURATION.labels(pipe["name"], status).observe(time.monotonic() - started)
+            JOBS.labels(pipe["name"], status).inc()
+            retry = delivery_tag in self.retryable
+            self.retryable.discard(delivery_tag)
+            if exit_code == 0:
+                logging.info(f"Job {job_id} finished")
+                self.ch.basic_ack(delivery_tag)
+            else:
+                logging.error(f"Job {job_id} failed (exit code {exit_code}){', retrying' if retry else ''}")
+                self.ch.basic_nack(delivery_tag, requeue=retry)
+
+        self.admit()
+
+
+def start_pool_worker(index: int):
+    """Start a long-lived worker container that consumes the job queue itself."""
+    # The first POOL_MIN_SIZE workers stay warm, the others stop when idle
+    idle_timeout = 0 if index < POOL_MIN_SIZE else WORKER_IDLE_TIMEOUT
+    env = pipe["env"](
+        None,
+        WORKER_MODE="consumer",
+        MAX_JOBS_PER_WORKER=str(MAX_JOBS_PER_WORKER),
+        WORKER_IDLE_TIMEOUT=str(idle_timeout),
+        RETRY_FAILED_JOBS=str(RETRY_FAILED_JOBS).lower(),
+        THREADS=worker_threads(),
+    )
+
+    container = docker_client.containers.run(
+        image=pipe["image"],
+        environment=env,
+        network="internal-network",
+        name=f"worker-{pipe['name']}-pool-{index}",
+        labels={POOL_LABEL: pipe["queue"]},
+        detach=True,
+        remove=True,
+        volumes=cache_volumes(),
+        **resource_limits(),
+    )
+    logging.info(f"Started pool worker {index} ({container.id[:12]}), idle timeout {idle_timeout or 'none'}")
+    return container
+
+
+def maintain_pool(ch):
+    """
+    Keep between POOL_MIN_SIZE and POOL_SIZE pool workers running.
+
+    Workers exit on their own after MAX_JOBS_PER_WORKER jobs or WORKER_IDLE_TIMEOUT
+    seconds without a message; free slots are refilled while there is a backlog.
+    """
+    running = {
+        c.name for c in docker_client.containers.list(filters={"label": f"{POOL_LABEL}={pipe['queue']}"})
+    }
+    backlog = ch.queue_declare(queue=pipe["queue"], durable=True, passive=True).method.message_count
+    JOBS_RUNNING.labels(pipe["name"]).set(len(running))
+    JOBS_WAITING.labels(pipe["name"]).set(backlog)
+    wanted = POOL_SIZE if backlog else POOL_MIN_SIZE
+
+    for index in range(POOL_SIZE):
+        if len(running) >= wanted:
+            break
+        if f"worker-{pipe['name']}-pool-{index}" in running:
+            continue
+        try:
+            running.add(start_pool_worker(index).name)
+        except docker.errors.APIError as e:
+            # The previous container with this name may still be being removed
+            logging.warning(f"Could not start pool worker {index}: {e.explanation}")
+
+
+def stop_pool():
+    for container in docker_client.containers.list(filters={"label": f"{POOL_LABEL}={pipe['queue']}"}):
+        logging.info(f"Stopping pool worker {container.name}")
+        container.stop()
+
+
+def run_pool(conn, ch):
+    logging.info(
+        f"Manager started in pool mode ({POOL_MIN_SIZE}-{POOL_SIZE} workers, "
+        f"{MAX_JOBS_PER_WORKER} jobs per worker, {WORKER_IDLE_TIMEOUT}s idle timeout)"
+    )
+    while True:
+        try:
+            maintain_pool(ch)
+        except docker.errors.APIError as e:
+            logging.error(f"Docker error while maintaining pool: {e.explanation}")
+        conn.sleep(POOL_CHECK_INTERVAL)
+
+
+def main(pipeline: dict):
+    """Run the manager of one pipe until SIGINT/SIGTERM."""
+    global docker_client, executor, pipe
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        stream=sys.stdout,
+    )
+    pipe = pipeline
+    if EXECUTOR not in EXECUTORS:
+        raise ValueError(f"Unknown EXECUTOR {EXECUTOR!r}, expected one of: {', '.join(EXECUTORS)}")
+
+    logging.info(f"Starting {pipe['name']} manager ({EXECUTOR} executor)...")
+    # Warm pool workers are always containers
+    if EXECUTOR == "docker" or EXECUTION_MODE == "pool":
+        docker_client = docker.from_env()
+    executor = EXECUTORS[EXECUTOR]()
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+        logging.info(f"Serving Prometheus metrics on :{METRICS_PORT}")
+
+    # Wait for RabbitMQ to be ready
+    wait_for_rabbitmq()
+
+    # Connect to RabbitMQ
+    credentials = pika.PlainCredentials(RABBIT_USER, RABBIT_PASS)
+    conn = pika.BlockingConnection(
+        pika.ConnectionParameters(host=RABBIT_HOST, port=RABBIT_PORT, credentials=credentials)
+    )
+    ch = conn.channel()
+    ch.queue_declare(queue=pipe["queue"], durable=True)
+    ch.basic_qos(prefetch_count=PREFETCH_COUNT)
+
+    def shutdown(*_):
+        logging.info("Stopping manager...")
+        if EXECUTION_MODE == "pool":
+            stop_pool()
+        conn.close()
+        executor.close()
+        if docker_client:
+            docker_client.close()
+        sys.exit(0)
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    if EXECUTION_MODE == "pool":
+        try:
+            run_pool(conn, ch)
+        except Exception:
+            logging.exception("Fatal error in manager loop")
+            shutdown()
+
+    scheduler = Scheduler(ch)
+
+    def callback(ch, method, props, body):
+        try:
+            msg = json.loads(body)
+            logging.info(f"Received job: {msg}")
+            scheduler.submit(method.delivery_tag, msg, method.redelivered)
+        except Exception as e:
+            logging.error(f"Error processing job: {e}")
+            ch.basic_nack(method.delivery_tag, requeue=False)
+
+    ch.basic_consume(pipe["queue"], callback)
+    logging.info(
+        f"Manager started with a budget of {CPU_BUDGET} CPUs / {MEMORY_BUDGET} "
+        f"({pipe['cpus']} CPUs / {pipe['memory']} per job, {SCHEDULING_POLICY} scheduling). Waiting for messages..."
+    )
+
+    try:
+        while True:
+            conn.process_data_events(time_limit=SCHEDULER_INTERVAL)
+            scheduler.poll()
+    except Exception:
+        logging.exception("Fatal error in manager loop")
+        shutdown()
@@ -0,0 +1,604 @@
+"""
+Helpers shared by the resolution and transcription workers: source input and
+cache, the ffprobe sidecar, the dedup index, job reports and completion events.
+
+worker.Dockerfile and transcriber.Dockerfile copy this file next to worker.py;
+to run a worker from the repository, put Pipes/common on PYTHONPATH. Reports,
+events and the dedup index are kept per pipe, named by the worker with
+set_pipeline() before it runs a job.
+"""
+import fcntl
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import partial
+from typing import Dict, List, Tuple
+
+import ffmpeg
+import pika
+from minio import Minio
+from minio.commonconfig import CopySource
+from minio.error import S3Error
+
+# --- Config ---
+MINIO_EP = os.getenv("MINIO_ENDPOINT", "minio:9000")
+ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY", "minioadmin")
+SECRET_KEY = os.getenv("MINIO_SECRET_KEY", "minioadmin")
+BUCKET = "video"
+
+RABBIT_HOST = os.getenv("RABBIT_HOST", "rabbitmq")
+RABBIT_PORT = int(os.getenv("RABBIT_PORT", 5672))
+RABBIT_USER = os.getenv("RABBIT_USER", "guest")
+RABBIT_PASS = os.getenv("RABBIT_PASS", "guest")
+# Consumer mode (warm pool): recycle the worker after this many jobs / stop it after this long idle
+MAX_JOBS_PER_WORKER = int(os.getenv("MAX_JOBS_PER_WORKER", "0"))
+WORKER_IDLE_TIMEOUT = int(os.getenv("WORKER_IDLE_TIMEOUT", "0"))
+# Consumer mode: requeue a failed job once (passed on from the manager's RETRY_FAILED_JOBS)
+RETRY_FAILED_JOBS = os.getenv("RETRY_FAILED_JOBS", "false").lower() == "true"
+
+# "resolution" or "subtitles", see set_pipeline()
+PIPELINE = None
+
+# Content-addressed dedup: reuse outputs of identical sources and drop duplicate job messages
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "false").lower() == "true"
+DEDUP_LEASE = int(os.getenv("DEDUP_LEASE", str(6 * 3600)))
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+INDEX_PREFIX = "_index"
+
+# JSON report with per-stage timings, written to {REPORT_PREFIX}/{PIPELINE}/{job_id}.json
+REPORTS_ENABLED = os.getenv("REPORTS_ENABLED", "true").lower() == "true"
+REPORT_PREFIX = "_reports"
+
+# Completion/failure events go to this topic exchange with routing key "{PIPELINE}.{status}"
+EVENTS_ENABLED = os.getenv("EVENTS_ENABLED", "true").lower() == "true"
+RESULTS_EXCHANGE = os.getenv("RESULTS_EXCHANGE", "job_results")
+# Durable queue of the coordinator; declared here too so events published before it first started are kept
+COORDINATOR_QUEUE = os.getenv("COORDINATOR_QUEUE", "subtitle_coordinator")
+
+# Source input: "download" fetches the object first, "url" streams it via a presigned URL
+SOURCE_MODE = os.getenv("SOURCE_MODE", "download").lower()
+SOURCE_URL_EXPIRY = int(os.getenv("SOURCE_URL_EXPIRY", str(6 * 3600)))
+RANGED_FETCH_THRESHOLD = int(os.getenv("RANGED_FETCH_THRESHOLD", str(256 * 1024 * 1024)))
+RANGED_FETCH_PART_SIZE = int(os.getenv("RANGED_FETCH_PART_SIZE", str(32 * 1024 * 1024)))
+RANGED_FETCH_WORKERS = int(os.getenv("RANGED_FETCH_WORKERS", "8"))
+
+# Node-local source cache shared with the other pipe (mount the same directory into both workers)
+SOURCE_CACHE_DIR = os.getenv("SOURCE_CACHE_DIR", "")
+SOURCE_CACHE_SIZE = int(os.getenv("SOURCE_CACHE_SIZE", str(20 * 1024 ** 3)))
+# ffprobe output is stored next to the source, so only the first pipe probes it
+PROBE_SUFFIX = ".probe.json"
+
+
+# Stages timed outside of a job (MinIO wait at startup) are attached to the next job's report
+_startup_stages = []
+_local = threading.local()
+
+
+def set_pipeline(name: str) -> None:
+    """Name the pipe whose jobs this process runs."""
+    global PIPELINE
+    PIPELINE = name
+
+
+def current_stage() -> Dict | None:
+    """The entry of the innermost stage() running in this thread, or None."""
+    return getattr(_local, "stage", None)
+
+
+class JobReport:
+    """
+    Per-stage durations and byte counts of one job.
+
+    Stages are recorded by stage() in the thread that runs the job and the
+    report is uploaded as JSON to {REPORT_PREFIX}/{PIPELINE}/{job_id}.json
+    when the job ends, whether it succeeded or not.
+    """
+
+    def __init__(self, job_id: str, object_key: str):
+        # Whether a failure of this attempt is requeued: set per message by consume_queue(),
+        # or by the manager through JOB_RETRY for a per-job worker
+        retry = getattr(_local, "retry", None)
+        if retry is None:
+            retry = os.getenv("JOB_RETRY", "false").lower() == "true"
+
+        self.job_id = job_id
+        self.document = {
+            "job_id": job_id,
+            "pipeline": PIPELINE,
+            "object_key": object_key,
+            "retry": retry,
+            "started": time.time(),
+            "stages": list(_startup_stages),
+        }
+        _startup_stages.clear()
+        self._start = time.perf_counter()
+        _local.report = self
+
+    def finish(self, minio: Minio, status: str) -> None:
+        _local.report = None
+        self.document.update(status=status, seconds=round(time.perf_counter() - self._start, 3))
+        body = json.dumps(self.document).encode("utf-8")
+        publish_event(body, status)
+        if not REPORTS_ENABLED:
+            return
+
+        try:
+            minio.put_object(
+                BUCKET, f"{REPORT_PREFIX}/{PIPELINE}/{self.job_id}.json", io.BytesIO(body), len(body),
+                content_type="application/json",
+            )
+        except S3Error as e:
+            logging.warning(f"Could not upload report for job {self.job_id}: {e}")
+
+
+def publish_event(body: bytes, status: str) -> None:
+    """
+    Announce the end of a job (its report, with outputs and stage durations) on RESULTS_EXCHANGE.
+
+    A short-lived connection is used so job-mode workers need no consumer connection
+    and pool workers do not share theirs across threads. A broker outage only loses
+    the event, never the job.
+    """
+    if not EVENTS_ENABLED:
+        return
+
+    try:
+        conn = pika.BlockingConnection(
+            pika.ConnectionParameters(
+                host=RABBIT_HOST, port=RABBIT_PORT, credentials=pika.PlainCredentials(RABBIT_USER, RABBIT_PASS)
+            )
+        )
+    except pika.exceptions.AMQPError as e:
+        logging.warning(f"Could not connect to RabbitMQ to publish the job event: {e}")
+        return
+
+    try:
+        ch = conn.channel()
+        ch.exchange_declare(RESULTS_EXCHANGE, exchange_type="topic", durable=True)
+        ch.queue_declare(queue=COORDINATOR_QUEUE, durable=True)
+        ch.queue_bind(COORDINATOR_QUEUE, RESULTS_EXCHANGE, routing_key=f"{PIPELINE}.*")
+        ch.basic_publish(
+            RESULTS_EXCHANGE,
+            f"{PIPELINE}.{status}",
+            body,
+            properties=pika.BasicProperties(delivery_mode=2, content_type="application/json"),
+        )
+    except pika.exceptions.AMQPError as e:
+        logging.warning(f"Could not publish the job event: {e}")
+    finally:
+        if conn.is_open:
+            conn.close()
+
+
+@contextmanager
+def stage(name: str, **fields):
+    """Time one stage of the current job; the yielded dict takes extra fields (bytes, fps, ...)."""
+    entry = {"stage": name, **fields}
+    parent = getattr(_local, "stage", None)
+    _local.stage = entry
+    start = time.perf_counter()
+    try:
+        yield entry
+    finally:
+        entry["seconds"] = round(time.perf_counter() - start, 3)
+        _local.stage = parent
+        report = getattr(_local, "report", None)
+        if report is not None:
+            report.document["stages"].append(entry)
+        elif threading.current_thread() is threading.main_thread():
+            _startup_stages.append(entry)
+
+
+def wait_for_minio(max_retries: int = 30, delay: int = 2) -> Minio:
+    """Wait for MinIO to be available with retries."""
+    client = Minio(MINIO_EP, ACCESS_KEY, SECRET_KEY, secure=False)
+    start = time.perf_counter()
+
+    for attempt in range(max_retries):
+        try:
+            client.list_buckets()
+            logging.info("MinIO is ready")
+            _startup_stages.append(
+                {"stage": "wait_for_minio", "seconds": round(time.perf_counter() - start, 3), "attempts": attempt + 1}
+            )
+            return client
+        except Exception as e:
+            if attempt < max_retries - 1:
+                logging.warning(
+                    f"Waiting for MinIO at {MINIO_EP} "
+                    f"(attempt {attempt + 1}/{max_retries})..."
+                )
+                time.sleep(delay)
+            else:
+                raise RuntimeError(
+                    f"MinIO not available after {max_retries} attempts: {e}"
+                )
+
+
+def _fetch_range(minio: Minio, object_key: str, fd: int, offset: int, length: int) -> None:
+    """Download one byte range of an object into an open file descriptor."""
+    response = minio.get_object(BUCKET, object_key, offset=offset, length=length)
+    try:
+        position = offset
+        for chunk in response.stream(1024 * 1024):
+            os.pwrite(fd, chunk, position)
+            position += len(chunk)
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def fetch_source(minio: Minio, object_key: str, dst: str) -> None:
+    """Download the source object, using parallel ranged GETs for large files."""
+    size = minio.stat_object(BUCKET, object_key).size
+
+    if size < RANGED_FETCH_THRESHOLD or RANGED_FETCH_WORKERS <= 1:
+        minio.fget_object(BUCKET, object_key, dst)
+        return
+
+    ranges = [
+        (offset, min(RANGED_FETCH_PART_SIZE, size - offset))
+        for offset in range(0, size, RANGED_FETCH_PART_SIZE)
+    ]
+    logging.info(
+        f"Fetching {size} bytes in {len(ranges)} ranges "
+        f"with {RANGED_FETCH_WORKERS} parallel requests"
+    )
+
+    fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(fd, size)
+        with ThreadPoolExecutor(max_workers=RANGED_FETCH_WORKERS) as pool:
+            futures = [
+                pool.submit(_fetch_range, minio, object_key, fd, offset, length)
+                for offset, length in ranges
+            ]
+            for future in as_completed(futures):
+                future.result()
+    finally:
+        os.close(fd)
+
+
+def open_source(minio: Minio, object_key: str, tmp_root: str) -> str:
+    """
+    Return the input ffmpeg should read the source from.
+
+    In "url" mode this is a presigned GET URL, so decoding starts on the first
+    bytes and nothing is written to scratch disk. Otherwise the object is
+    downloaded into tmp_root first.
+    """
+    if SOURCE_MODE == "url":
+        logging.info(f"Streaming {object_key} from bucket {BUCKET} via presigned URL")
+        return minio.presigned_get_object(
+            BUCKET, object_key, expires=timedelta(seconds=SOURCE_URL_EXPIRY)
+        )
+
+    local_path = os.path.join(tmp_root, os.path.basename(object_key))
+    logging.info(f"Downloading {object_key} from bucket {BUCKET}...")
+    with stage("download") as entry:
+        fetch_source(minio, object_key, local_path)
+        entry["bytes"] = os.path.getsize(local_path)
+    logging.info("Download complete")
+    return local_path
+
+
+class SourceCache:
+    """
+    Node-local, size-bounded cache of source objects, shared by both pipes.
+
+    Both workers mount the same directory, so whichever pipe gets to an upload
+    second reads the file the first one downloaded. Every entry has a lock file:
+    the download holds it exclusively, jobs reading the entry hold it shared,
+    and eviction (least recently used first) only removes entries it can lock
+    exclusively without waiting.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, object_key: str, etag: str) -> str:
+        # The ETag is part of the key, so a re-uploaded object is never served stale
+        digest = hashlib.sha256(f"{object_key}\0{etag}".encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.root, digest + os.path.splitext(object_key)[1])
+
+    def open(self, minio: Minio, object_key: str) -> Tuple[str, int]:
+        """Path of the cached source and a lock fd that keeps it from being evicted; release() it after the job."""
+        stat = minio.stat_object(BUCKET, object_key)
+        path = self._path(object_key, stat.etag)
+        fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+
+        try:
+            with stage("source_cache") as entry:
+                fcntl.flock(fd, fcntl.LOCK_SH)
+                entry["hit"] = os.path.exists(path)
+                if entry["hit"]:
+                    os.utime(path)
+                    logging.info(f"Source cache hit for {object_key}")
+                    return path, fd
+
+                # Not atomic: another job may have fetched the source in between
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                if not os.path.exists(path):
+                    self._evict(stat.size)
+                    logging.info(f"Downloading {object_key} from bucket {BUCKET} into the source cache...")
+                    with stage("download", bytes=stat.size):
+                        fetch_source(minio, object_key, f"{path}.part")
+                    os.replace(f"{path}.part", path)
+                fcntl.flock(fd, fcntl.LOCK_SH)
+                return path, fd
+        except Exception:
+            if os.path.exists(f"{path}.part"):
+                os.remove(f"{path}.part")
+            os.close(fd)
+            raise
+
+    def _evict(self, incoming: int) -> None:
+        entries = []
+        for name in os.listdir(self.root):
+            # Lock files and downloads in progress (.part, and fget_object's .part.minio)
+            if name.endswith(".lock") or ".part" in name:
+                continue
+            try:
+                st = os.stat(os.path.join(self.root, name))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total + incoming <= self.max_bytes:
+                return
+            path = os.path.join(self.root, name)
+            fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # A job is reading this entry
+                os.close(fd)
+                continue
+            try:
+                os.remove(path)
+                total -= size
+                logging.info(f"Evicted {name} ({size} bytes) from the source cache")
+            finally:
+                os.close(fd)
+
+    @staticmethod
+    def release(fd: int) -> None:
+        os.close(fd)
+
+
+source_cache = (
+    SourceCache(SOURCE_CACHE_DIR, SOURCE_CACHE_SIZE) if SOURCE_CACHE_DIR and SOURCE_MODE != "url" else None
+)
+
+
+def probe_source(minio: Minio, object_key: str, src: str) -> Dict:
+    """
+    ffprobe output for the source, shared by both pipes through a sidecar object.
+
+    The sidecar is stored as {object_key}{PROBE_SUFFIX} together with the source
+    ETag, so a re-uploaded object is probed again.
+    """
+    sidecar = f"{object_key}{PROBE_SUFFIX}"
+    etag = minio.stat_object(BUCKET, object_key).etag
+    try:
+        response = minio.get_object(BUCKET, sidecar)
+        try:
+            document = json.loads(response.read())
+        finally:
+            response.close()
+            response.release_conn()
+        if document.get("etag") == etag:
+            logging.info(f"Using cached probe {sidecar}")
+            return document["probe"]
+    except (S3Error, ValueError, KeyError):
+        pass
+
+    probe = ffmpeg.probe(src)
+    body = json.dumps({"etag": etag, "probe": probe}).encode("utf-8")
+    try:
+        minio.put_object(BUCKET, sidecar, io.BytesIO(body), len(body), content_type="application/json")
+    except S3Error as e:
+        logging.warning(f"Could not store probe sidecar {sidecar}: {e}")
+    return probe
+
+
+def read_index(minio: Minio, key: str) -> Dict | None:
+    """Read a JSON document from the dedup index, or None if it does not exist."""
+    try:
+        response = minio.get_object(BUCKET, f"{INDEX_PREFIX}/{PIPELINE}/{key}")
+    except S3Error as e:
+        if e.code == "NoSuchKey":
+            return None
+        raise
+    try:
+        return json.loads(response.read())
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def write_index(minio: Minio, key: str, document: Dict) -> None:
+    body = json.dumps(document).encode("utf-8")
+    minio.put_object(
+        BUCKET, f"{INDEX_PREFIX}/{PIPELINE}/{key}", io.BytesIO(body), len(body),
+        content_type="application/json",
+    )
+
+
+def hash_source(minio: Minio, object_key: str, local_path: str | None = None) -> str:
+    """SHA-256 of the source, read in chunks from the local copy or streamed from MinIO."""
+    digest = hashlib.sha256()
+    with stage("hash"):
+        if local_path and os.path.exists(local_path):
+            with open(local_path, "rb") as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+            return digest.hexdigest()
+
+        response = minio.get_object(BUCKET, object_key)
+        try:
+            for chunk in response.stream(HASH_CHUNK_SIZE):
+                digest.update(chunk)
+        finally:
+            response.close()
+            response.release_conn()
+        return digest.hexdigest()
+
+
+def claim_job(minio: Minio, job_id: str) -> bool:
+    """
+    Mark job_id as running; False if it is already done or running elsewhere.
+
+    Duplicate messages for one job are dropped here instead of processing the
+    same upload twice. A running claim older than DEDUP_LEASE seconds is
+    treated as abandoned by a crashed worker.
+
+    This is best effort: the claim is read and then written, which is not atomic,
+    so two workers that get the same job at the same moment can both claim it.
+    Concurrent duplicates are stopped by the managers, which run at most one
+    worker per job_id (the worker name is derived from it); the claim catches
+    duplicates that arrive after the job finished or while it is still running.
+    Pool workers consume the queue without a manager and rely on this claim alone.
+    """
+    claim = read_index(minio, f"jobs/{job_id}.json")
+    if claim and claim["state"] == "done":
+        logging.info(f"Job {job_id} was already processed, dropping duplicate message")
+        return False
+    if claim and claim["state"] == "running" and time.time() - claim["updated"] < DEDUP_LEASE:
+        logging.info(f"Job {job_id} is already running, dropping duplicate message")
+        return False
+
+    write_index(minio, f"jobs/{job_id}.json", {"state": "running", "updated": time.time()})
+    return True
+
+
+def release_job(minio: Minio, job_id: str) -> None:
+    """Drop the running claim of a failed job so it can be retried."""
+    minio.remove_object(BUCKET, f"{INDEX_PREFIX}/{PIPELINE}/jobs/{job_id}.json")
+
+
+def complete_job(minio: Minio, job_id: str, content_key: str) -> None:
+    write_index(
+        minio, f"jobs/{job_id}.json",
+        {"state": "done", "content_key": content_key, "updated": time.time()},
+    )
+
+
+def reuse_outputs(minio: Minio, content_key: str, prefix: str) -> bool:
+    """
+    Copy the outputs recorded for content_key to prefix with server-side copies.
+
+    Returns False if the content has not been processed before or one of its
+    outputs no longer exists, in which case the job runs normally.
+    """
+    entry = read_index(minio, f"content/{content_key}.json")
+    if not entry:
+        return False
+
+    try:
+        for name in entry["objects"]:
+            minio.stat_object(BUCKET, f"{entry['prefix']}/{name}")
+    except S3Error as e:
+        logging.warning(f"Outputs for {content_key} are incomplete ({e.code}), processing again")
+        return False
+
+    # Same job processed again: its outputs are already in place
+    if entry["prefix"] == prefix:
+        return True
+
+    logging.info(f"Source already processed as {entry['prefix']}, copying {len(entry['objects'])} outputs")
+    for name in entry["objects"]:
+        minio.copy_object(BUCKET, f"{prefix}/{name}", CopySource(BUCKET, f"{entry['prefix']}/{name}"))
+    return True
+
+
+def record_outputs(minio: Minio, content_key: str, prefix: str, objects: List[str]) -> None:
+    """Store which objects (relative to prefix) were produced for content_key."""
+    write_index(minio, f"content/{content_key}.json", {"prefix": prefix, "objects": objects})
+
+
+def consume_queue(queue: str, run_job, concurrency: int = 1, retry_failed: bool = False) -> None:
+    """
+    Take jobs directly from RabbitMQ until the worker is recycled or idle.
+
+    Each message is passed as a dict to run_job, which runs in a pool of
+    `concurrency` threads while this thread keeps servicing the connection, so
+    heartbeats are sent during long jobs. A job is acked (or nacked) from the
+    connection thread via add_callback_threadsafe once it finished; a failed job
+    is requeued once with retry_failed and dropped otherwise.
+    """
+    credentials = pika.PlainCredentials(RABBIT_USER, RABBIT_PASS)
+    conn = pika.BlockingConnection(
+        pika.ConnectionParameters(host=RABBIT_HOST, port=RABBIT_PORT, credentials=credentials)
+    )
+    ch = conn.channel()
+    ch.queue_declare(queue=queue, durable=True)
+    ch.basic_qos(prefetch_count=concurrency)
+
+    logging.info(
+        f"Consuming {queue} with {concurrency} concurrent jobs "
+        f"(max jobs: {MAX_JOBS_PER_WORKER or 'unlimited'}, idle timeout: {WORKER_IDLE_TIMEOUT or 'none'})"
+    )
+
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    state = {"received": 0, "in_flight": 0, "last_activity": time.monotonic()}
+
+    def run(msg, retry):
+        # Recorded in the job report, so a failed attempt that is retried is not taken as final
+        _local.retry = retry
+        run_job(msg)
+
+    def finish(method, future):
+        # Runs on the connection thread via add_callback_threadsafe
+        state["in_flight"] -= 1
+        state["last_activity"] = time.monotonic()
+        if future.exception():
+            logging.error(f"Error processing job: {future.exception()}")
+            ch.basic_nack(method.delivery_tag, requeue=retry_failed and not method.redelivered)
+        else:
+            ch.basic_ack(method.delivery_tag)
+
+    def callback(ch, method, props, body):
+        state["received"] += 1
+        state["last_activity"] = time.monotonic()
+        if MAX_JOBS_PER_WORKER and state["received"] >= MAX_JOBS_PER_WORKER:
+            ch.basic_cancel(consumer_tag)
+
+        try:
+            msg = json.loads(body)
+            logging.info(f"Received job: {msg}")
+        except ValueError as e:
+            logging.error(f"Dropping malformed job message: {e}")
+            ch.basic_nack(method.delivery_tag, requeue=False)
+            return
+
+        state["in_flight"] += 1
+        future = pool.submit(run, msg, retry_failed and not method.redelivered)
+        future.add_done_callback(lambda f: conn.add_callback_threadsafe(partial(finish, method, f)))
+
+    consumer_tag = ch.basic_consume(queue, callback)
+
+    while True:
+        conn.process_data_events(time_limit=1)
+        if state["in_flight"]:
+            continue
+        if MAX_JOBS_PER_WORKER and state["received"] >= MAX_JOBS_PER_WORKER:
+            logging.info(f"Processed {state['received']} jobs, recycling worker")
+            break
+        if WORKER_IDLE_TIMEOUT and time.monotonic() - state["last_activity"] >= WORKER_IDLE_TIMEOUT:
+            logging.info(f"No job for {WORKER_IDLE_TIMEOUT}s, stopping idle worker")
+            break
+
+    pool.shutdown()
+    conn.close()
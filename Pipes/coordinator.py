@@ -0,0 +1,220 @@
+import io
+import json
+import logging
+import os
+import posixpath
+import re
+import signal
+import sys
+import time
+
+import pika
+from minio import Minio
+from minio.error import S3Error
+from pika.exceptions import AMQPChannelError, AMQPConnectionError
+
+# --- Configuration ---
+RABBIT_HOST = os.getenv("RABBIT_HOST", "rabbitmq")
+RABBIT_PORT = int(os.getenv("RABBIT_PORT", 5672))
+RABBIT_USER = os.getenv("RABBIT_USER", "guest")
+RABBIT_PASS = os.getenv("RABBIT_PASS", "guest")
+MINIO_EP = os.getenv("MINIO_ENDPOINT", "minio:9000")
+ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY", "minioadmin")
+SECRET_KEY = os.getenv("MINIO_SECRET_KEY", "minioadmin")
+BUCKET = "video"
+
+# Topic exchange the workers publish their completion events to ("{pipeline}.{status}")
+RESULTS_EXCHANGE = os.getenv("RESULTS_EXCHANGE", "job_results")
+# The workers declare and bind this queue as well, so no event is lost before the coordinator first runs
+QUEUE = os.getenv("COORDINATOR_QUEUE", "subtitle_coordinator")
+PIPELINES = ("resolution", "subtitles")
+# Seconds to wait before reconnecting after the connection to RabbitMQ was lost
+RECONNECT_DELAY = float(os.getenv("RECONNECT_DELAY", "5"))
+DONE_STATUSES = ("ok", "reused")
+
+# What each pipeline reported for a job is kept here until (and after) the playlist is spliced
+STATE_PREFIX = "_index/coordinator"
+SUBTITLES_GROUP = "subs"
+
+# --- Logging setup ---
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    stream=sys.stdout,
+)
+
+
+def wait_for_rabbitmq(max_retries: int = 60, delay: int = 5) -> pika.BlockingConnection:
+    """Connect to RabbitMQ with retries."""
+    credentials = pika.PlainCredentials(RABBIT_USER, RABBIT_PASS)
+
+    for attempt in range(max_retries):
+        try:
+            conn = pika.BlockingConnection(
+                pika.ConnectionParameters(host=RABBIT_HOST, port=RABBIT_PORT, credentials=credentials)
+            )
+            logging.info("RabbitMQ is ready")
+            return conn
+        except AMQPConnectionError as e:
+            logging.warning(
+                f"Waiting for RabbitMQ at {RABBIT_HOST}:{RABBIT_PORT} "
+                f"(attempt {attempt + 1}/{max_retries})... {e}"
+            )
+            time.sleep(delay)
+
+    raise RuntimeError("RabbitMQ not available after max retries")
+
+
+def read_object(minio: Minio, object_key: str) -> bytes | None:
+    try:
+        response = minio.get_object(BUCKET, object_key)
+    except S3Error as e:
+        if e.code == "NoSuchKey":
+            return None
+        raise
+    try:
+        return response.read()
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def write_object(minio: Minio, object_key: str, body: bytes, content_type: str) -> None:
+    minio.put_object(BUCKET, object_key, io.BytesIO(body), len(body), content_type=content_type)
+
+
+def splice_subtitles(master: str, language: str, uri: str) -> str | None:
+    """
+    Master playlist with a subtitles rendition group added, or None if it already has one.
+
+    The #EXT-X-MEDIA entry goes before the first variant and every variant
+    references the group, which players need to offer the track.
+    """
+    if "TYPE=SUBTITLES" in master:
+        return None
+
+    entry = (
+        f'#EXT-X-MEDIA:TYPE=SUBTITLES,GROUP-ID="{SUBTITLES_GROUP}",NAME="{language}",'
+        f'DEFAULT=YES,AUTOSELECT=YES,LANGUAGE="{language}",URI="{uri}"\n'
+    )
+    idx = master.find("#EXT-X-STREAM-INF")
+    if idx == -1:
+        return master + entry
+    master = master[:idx] + entry + "\n" + master[idx:]
+    return re.sub(r"^(#EXT-X-STREAM-INF:.*)$", rf'\1,SUBTITLES="{SUBTITLES_GROUP}"', master, flags=re.MULTILINE)
+
+
+def try_splice(minio: Minio, job_id: str, state: dict) -> None:
+    """Add the job's subtitles to its master playlist once both pipelines are done."""
+    resolution = state["resolution"].get("outputs") or {}
+    subtitles = state["subtitles"].get("outputs") or {}
+    master_key = resolution.get("master")
+    if not master_key or not subtitles.get("playlist"):
+        logging.info(f"Job {job_id} has no master playlist or subtitles playlist, nothing to splice")
+        return
+
+    body = read_object(minio, master_key)
+    if body is None:
+        logging.warning(f"Master playlist {master_key} of job {job_id} does not exist")
+        return
+
+    uri = posixpath.relpath(subtitles["playlist"], posixpath.dirname(master_key))
+    spliced = splice_subtitles(body.decode("utf-8"), subtitles["language"], uri)
+    if spliced is None:
+        logging.info(f"{master_key} already references subtitles")
+        return
+
+    write_object(minio, master_key, spliced.encode("utf-8"), "application/vnd.apple.mpegurl")
+    logging.info(f"Added {subtitles['language']} subtitles to {BUCKET}/{master_key}")
+
+
+def handle_event(minio: Minio, event: dict) -> None:
+    """
+    Record one pipeline's completion and splice the playlist when the other one is done too.
+
+    The per-job state lives in MinIO so a restarted coordinator still pairs events
+    that arrived before the restart; the message is acked only after it was stored.
+    A resolution job that runs again rewrites master.m3u8, so every completion
+    re-checks the playlist and splicing stays idempotent.
+    """
+    pipeline, job_id, status = event.get("pipeline"), event.get("job_id"), event.get("status")
+    if pipeline not in PIPELINES or not job_id:
+        return
+    if status not in DONE_STATUSES:
+        logging.info(f"{pipeline} job {job_id} finished with status {status}")
+        return
+
+    state_key = f"{STATE_PREFIX}/{job_id}.json"
+    body = read_object(minio, state_key)
+    state = json.loads(body) if body else {}
+    state[pipeline] = {"status": status, "outputs": event.get("outputs"), "finished": time.time()}
+    write_object(minio, state_key, json.dumps(state).encode("utf-8"), "application/json")
+    logging.info(f"{pipeline} job {job_id} done ({status})")
+
+    if all(name in state for name in PIPELINES):
+        try_splice(minio, job_id, state)
+
+
+def consume(minio: Minio, conn: pika.BlockingConnection) -> None:
+    """Declare the coordinator queue and handle events until the connection or channel fails."""
+    ch = conn.channel()
+    ch.exchange_declare(RESULTS_EXCHANGE, exchange_type="topic", durable=True)
+    ch.queue_declare(queue=QUEUE, durable=True)
+    for pipeline in PIPELINES:
+        ch.queue_bind(QUEUE, RESULTS_EXCHANGE, routing_key=f"{pipeline}.*")
+    # One event at a time: the read-modify-write of the job state and the playlist never races
+    ch.basic_qos(prefetch_count=1)
+
+    def callback(ch, method, props, body):
+        try:
+            event = json.loads(body)
+        except ValueError as e:
+            logging.error(f"Dropping malformed event: {e}")
+            ch.basic_nack(method.delivery_tag, requeue=False)
+            return
+
+        try:
+            handle_event(minio, event)
+            ch.basic_ack(method.delivery_tag)
+        except Exception as e:
+            # Most likely a MinIO hiccup: retry once instead of losing the splice
+            logging.error(f"Error handling event for job {event.get('job_id')}: {e}")
+            ch.basic_nack(method.delivery_tag, requeue=not method.redelivered)
+
+    ch.basic_consume(QUEUE, callback)
+    logging.info(f"Coordinator consuming {RESULTS_EXCHANGE} events. Waiting for messages...")
+    ch.start_consuming()
+
+
+def main():
+    logging.info("Starting coordinator...")
+    minio = Minio(MINIO_EP, access_key=ACCESS_KEY, secret_key=SECRET_KEY, secure=False)
+    conn = None
+
+    def shutdown(*_):
+        logging.info("Stopping coordinator...")
+        if conn is not None and conn.is_open:
+            conn.close()
+        sys.exit(0)
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    # Reconnect after a broker restart or a dropped connection; the unacked event is redelivered
+    # and handle_event stores state and splices idempotently
+    while True:
+        conn = wait_for_rabbitmq()
+        try:
+            consume(minio, conn)
+        except (AMQPConnectionError, AMQPChannelError) as e:
+            logging.warning(f"Lost the connection to RabbitMQ, reconnecting in {RECONNECT_DELAY:.0f}s: {e!r}")
+            if conn.is_open:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            time.sleep(RECONNECT_DELAY)
+
+
+if __name__ == "__main__":
+    main()
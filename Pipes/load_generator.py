@@ -0,0 +1,299 @@
+"""
+End-to-end load generator for the Resolution and Subtitles pipes.
+
+Uploads N copies of the given videos under unique object keys, then publishes
+one message per job to resolution_jobs and/or transcribe_jobs at the
+requested arrival rate (Poisson arrivals by default), exactly like the
+backend does. Completion is detected by polling MinIO for the final objects:
+{base_name}/master.m3u8 for time-to-playable and {job_id}/subtitles/*.vtt for
+time-to-subtitles. A failed job report in _reports/ ends the wait early, as
+does a skipped one (a source without audible audio gets no subtitles), unless
+the report says the failed attempt is retried: then the wait goes on for the
+retry, and the job is counted as retried whatever its final status.
+
+Prints throughput and p50/p95/p99 latencies per pipe; --save writes the raw
+per-job timings as JSON so runs with different manager/worker settings can be
+compared.
+
+Usage:
+    python load_generator.py video.mp4 [more.mp4 ...] [--jobs 50] [--rate 0.5]
+                        [--pipes resolution,transcription] [--fixed]
+                        [--timeout 3600] [--save run.json]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import ffmpeg
+import pika
+from minio import Minio
+from minio.error import S3Error
+
+# ------------------------------------------------------------------
+# Local stack (adjust if your compose env vars are different)
+# ------------------------------------------------------------------
+MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT", "localhost:9000")
+MINIO_ACCESS = os.getenv("MINIO_ACCESS_KEY", "minioadmin")
+MINIO_SECRET = os.getenv("MINIO_SECRET_KEY", "minioadmin")
+RABBIT_HOST = os.getenv("RABBIT_HOST", "localhost")
+RABBIT_PORT = int(os.getenv("RABBIT_PORT", 5672))
+RABBIT_USER = os.getenv("RABBIT_USER", "admin")
+RABBIT_PASS = os.getenv("RABBIT_PASS", "admin")
+BUCKET = "video"
+REPORT_PREFIX = "_reports"
+
+# pipe name -> queue, the PIPELINE name the worker writes its reports under and the metric it measures
+PIPES = {
+    "resolution": {"queue": "resolution_jobs", "report": "resolution", "metric": "time_to_playable"},
+    "transcription": {"queue": "transcribe_jobs", "report": "subtitles", "metric": "time_to_subtitles"},
+}
+UPLOAD_CONCURRENCY = int(os.getenv("LOAD_UPLOAD_CONCURRENCY", "8"))
+POLL_INTERVAL = float(os.getenv("LOAD_POLL_INTERVAL", "1.0"))
+
+
+def probe_duration(path):
+    """Duration in seconds, sent with the message so the managers can schedule by job size."""
+    try:
+        return float(ffmpeg.probe(path)["format"]["duration"])
+    except (ffmpeg.Error, KeyError, ValueError):
+        return None
+
+
+def stage_uploads(minio, files, n):
+    """Upload n jobs (cycling through files) under unique keys before the clock starts."""
+    if not minio.bucket_exists(BUCKET):
+        minio.make_bucket(BUCKET)
+
+    durations = {path: probe_duration(path) for path in files}
+    jobs = []
+    for i in range(n):
+        path = files[i % len(files)]
+        job_id = str(uuid.uuid4())
+        ext = os.path.splitext(path)[1]
+        jobs.append({
+            "job_id": job_id,
+            "object_key": f"load-{job_id}{ext}",
+            "path": path,
+            "duration": durations[path],
+            "size": os.path.getsize(path),
+        })
+
+    def upload(job):
+        minio.fput_object(BUCKET, job["object_key"], job["path"])
+
+    print(f"Uploading {n} sources to {BUCKET}/ ...")
+    with ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY) as pool:
+        list(pool.map(upload, jobs))
+    return jobs
+
+
+def output_ready(minio, pipe, job):
+    """True when the object that makes the job's output usable exists."""
+    if pipe == "resolution":
+        base_name = os.path.splitext(job["object_key"])[0]
+        try:
+            minio.stat_object(BUCKET, f"{base_name}/master.m3u8")
+            return True
+        except S3Error:
+            return False
+
+    return any(
+        obj.object_name.endswith(".vtt")
+        for obj in minio.list_objects(BUCKET, prefix=f"{job['job_id']}/subtitles/", recursive=True)
+    )
+
+
+def job_ended_without_output(minio, pipe, job):
+    """
+    Status of the job report if the worker ended the job without outputs ("failed", "skipped"),
+    "retrying" if an attempt failed but the job is requeued, else None.
+    """
+    try:
+        response = minio.get_object(BUCKET, f"{REPORT_PREFIX}/{PIPES[pipe]['report']}/{job['job_id']}.json")
+    except S3Error:
+        return None
+    try:
+        document = json.loads(response.read())
+        if document.get("status") == "failed" and document.get("retry"):
+            return "retrying"
+        return document.get("status") if document.get("status") in ("failed", "skipped") else None
+    except ValueError:
+        return None
+    finally:
+        response.close()
+        response.release_conn()
+
+
+class Watcher(threading.Thread):
+    """Polls MinIO for every submitted (pipe, job) until it completes, fails or times out."""
+
+    def __init__(self, minio, timeout):
+        super().__init__(daemon=True)
+        self.minio = minio
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.waiting = []
+        self.results = []
+        self.submitting = True
+        # (pipe, job_id) of jobs with a failed attempt that was retried
+        self.retried = set()
+
+    def add(self, pipe, job):
+        with self.lock:
+            self.waiting.append((pipe, job))
+
+    def run(self):
+        while True:
+            with self.lock:
+                waiting = list(self.waiting)
+            if not waiting and not self.submitting:
+                return
+
+            for pipe, job in waiting:
+                now = time.time()
+                status = None
+                if output_ready(self.minio, pipe, job):
+                    status = "ok"
+                else:
+                    status = job_ended_without_output(self.minio, pipe, job)
+                if status == "retrying":
+                    # The report of the retry replaces this one when it ends
+                    self.retried.add((pipe, job["job_id"]))
+                    status = None
+                if status is None and now - job["submitted_at"] > self.timeout:
+                    status = "timeout"
+
+                if status is not None:
+                    with self.lock:
+                        self.waiting.remove((pipe, job))
+                    self.results.append({
+                        "pipe": pipe,
+                        "job_id": job["job_id"],
+                        "status": status,
+                        "retried": (pipe, job["job_id"]) in self.retried,
+                        "submitted_at": job["submitted_at"],
+                        "completed_at": now,
+                        "latency": now - job["submitted_at"],
+                    })
+            time.sleep(POLL_INTERVAL)
+
+
+def percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def report(results, pipes, started):
+    print()
+    for pipe in pipes:
+        rows = [r for r in results if r["pipe"] == pipe]
+        done = [r for r in rows if r["status"] == "ok"]
+        failed = sum(1 for r in rows if r["status"] == "failed")
+        skipped = sum(1 for r in rows if r["status"] == "skipped")
+        timeouts = sum(1 for r in rows if r["status"] == "timeout")
+        retried = sum(1 for r in rows if r["retried"])
+        print(
+            f"{pipe}: {len(done)}/{len(rows)} ok, {failed} failed, {skipped} skipped, {timeouts} timed out "
+            f"({retried} retried after a failed attempt)"
+        )
+        if not done:
+            continue
+
+        span = max(r["completed_at"] for r in done) - started
+        latencies = [r["latency"] for r in done]
+        print(f"  throughput        {len(done) / span * 3600:8.1f} jobs/h")
+        print(
+            f"  {PIPES[pipe]['metric']:<17} p50 {percentile(latencies, 50):7.1f}s  "
+            f"p95 {percentile(latencies, 95):7.1f}s  p99 {percentile(latencies, 99):7.1f}s  "
+            f"max {max(latencies):7.1f}s"
+        )
+
+
+def run_load(files, n, rate, pipes, fixed=False, timeout=3600, save=None, seed=1):
+    minio = Minio(MINIO_ENDPOINT, access_key=MINIO_ACCESS, secret_key=MINIO_SECRET, secure=False)
+    jobs = stage_uploads(minio, files, n)
+
+    connection = pika.BlockingConnection(
+        pika.ConnectionParameters(
+            host=RABBIT_HOST,
+            port=RABBIT_PORT,
+            credentials=pika.PlainCredentials(RABBIT_USER, RABBIT_PASS)
+        )
+    )
+    channel = connection.channel()
+    for pipe in pipes:
+        channel.queue_declare(queue=PIPES[pipe]["queue"], durable=True)
+
+    watcher = Watcher(minio, timeout)
+    watcher.start()
+    rng = random.Random(seed)
+    started = time.time()
+    next_at = started
+    print(f"Submitting {n} jobs at {rate} jobs/s to {', '.join(pipes)} ({'fixed' if fixed else 'poisson'} arrivals)")
+
+    for job in jobs:
+        delay = next_at - time.time()
+        if delay > 0:
+            # Keep the connection's heartbeats going between arrivals
+            connection.sleep(delay)
+
+        job["submitted_at"] = time.time()
+        message = json.dumps({
+            "job_id": job["job_id"],
+            "object_key": job["object_key"],
+            "duration": job["duration"],
+            "size": job["size"],
+            "submitted_at": job["submitted_at"],
+        })
+        for pipe in pipes:
+            channel.basic_publish(
+                exchange="",
+                routing_key=PIPES[pipe]["queue"],
+                body=message,
+                properties=pika.BasicProperties(delivery_mode=2)
+            )
+            watcher.add(pipe, job)
+        next_at += 1 / rate if fixed else rng.expovariate(rate)
+
+    connection.close()
+    watcher.submitting = False
+    print(f"All jobs submitted after {time.time() - started:.0f}s, waiting for outputs...")
+    watcher.join()
+
+    report(watcher.results, pipes, started)
+    if save:
+        with open(save, "w") as f:
+            json.dump({"jobs": n, "rate": rate, "pipes": pipes, "results": watcher.results}, f, indent=2)
+        print(f"\nSaved per-job timings to {save}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Submit jobs to the local stack and measure end-to-end latency")
+    parser.add_argument("files", nargs="+", help="source videos, cycled through for the jobs")
+    parser.add_argument("--jobs", type=int, default=20, help="number of jobs to submit")
+    parser.add_argument("--rate", type=float, default=0.2, help="mean arrival rate in jobs/s")
+    parser.add_argument("--pipes", default=",".join(PIPES), help=f"comma separated subset of: {', '.join(PIPES)}")
+    parser.add_argument("--fixed", action="store_true", help="evenly spaced arrivals instead of Poisson")
+    parser.add_argument("--timeout", type=float, default=3600, help="seconds to wait for each job")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the arrival times")
+    parser.add_argument("--save", help="write the per-job timings as JSON")
+    args = parser.parse_args()
+
+    pipes = args.pipes.split(",")
+    unknown = [p for p in pipes if p not in PIPES]
+    missing = [f for f in args.files if not os.path.isfile(f)]
+    if unknown or missing or args.rate <= 0:
+        print(f"Unknown pipes {unknown}, missing files {missing} or rate <= 0")
+        sys.exit(1)
+
+    run_load(args.files, args.jobs, args.rate, pipes, args.fixed, args.timeout, args.save, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -35,6 +35,8 @@ export async function POST(req: NextRequest) {
 		const file = formData.get("file") as File | null;
 		const title = formData.get("title") as string | null;
 		const description = formData.get("description") as string | null;
+		// Optional spoken language (e.g. "en"), lets the transcription skip language detection
+		const language = formData.get("language") as string | null;
 
 		// -------------------------------
 		// Request validation
@@ -50,6 +52,10 @@ export async function POST(req: NextRequest) {
 		if (!file.type.startsWith("video/")) {
 			return NextError.Error("Wrong file type. Only video files are allowed.", HttpError.BadRequest);
 		}
+
+		if (language && !language.match(/^[a-zA-Z]+(-[a-zA-Z]+)?$/)) {
+			return NextError.Error("Invalid language", HttpError.BadRequest);
+		}
 		// -------------------------------
 		// Prepare Client for Database
 		// -------------------------------
@@ -81,8 +87,10 @@ export async function POST(req: NextRequest) {
 		// -------------------------------
 		// Send RabbitMQ Jobs
 		// -------------------------------
+		// duration and size let the pipe managers schedule short jobs first, submitted_at measures queue wait
 		const jobMessage = JSON.stringify({
-			job_id: id, object_key: filename,
+			job_id: id, object_key: filename, duration: duration, size: buffer.length,
+			submitted_at: Date.now() / 1000, language: language || null,
 		});
 
 		try {